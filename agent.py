@@ -1,328 +1,294 @@
 import json
-from typing import Dict
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
 from langgraph.graph import StateGraph, END
 from langchain_openai import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
 from langchain.output_parsers import PydanticOutputParser, OutputFixingParser
-from langchain.prompts import PromptTemplate
 from pydantic import ValidationError
 
-from models import PatientInfo
-from prompts import PATIENT_INFO_EXTRACTION_PROMPT, SEVERITY_ASSESSMENT_PROMPT, CLINICAL_ADVICE_PROMPT
-from rag_system import RedditRAG, format_similar_posts_for_display
+from models import AssessmentResult, PatientInfo, SimilarCase, severity_band_range, severity_level
+from output_repair import PatientInfoParser
+from pipeline import Pipeline, Stage
+from prompt_layout import PromptCacheStats, StagePrompt
+from prompts import (
+    CLINICAL_ADVICE_INSTRUCTIONS, CLINICAL_ADVICE_PROMPT, CLINICAL_ADVICE_SYSTEM,
+    PATIENT_INFO_EXTRACTION_INSTRUCTIONS, PATIENT_INFO_EXTRACTION_PROMPT, PATIENT_INFO_EXTRACTION_SYSTEM,
+    SEVERITY_ASSESSMENT_INSTRUCTIONS, SEVERITY_ASSESSMENT_PROMPT, SEVERITY_ASSESSMENT_SYSTEM, SHARED_CLINICAL_CONTEXT,
+)
+from rag_system import RedditRAG
+from screening import provisional_risk_score
+from speculation import SpeculativeAdvice
 
 
 class CounselorAgent:
     """LangGraph agent for mental health counselor assistance."""
     
-    def __init__(self):
-        self.llm = ChatOpenAI(
+    def __init__(self, llm=None, advice_llm=None, rag_system: Optional[RedditRAG] = None, load_rag: bool = True,
+                 speculative_advice: Optional[bool] = None):
+        """``llm``/``advice_llm`` default to gpt-4o; pass chat models (e.g. ``fakes.FakeChatModel``) to override.
+        
+        ``speculative_advice`` (default ``SPECULATIVE_ADVICE``) starts advice alongside the severity call.
+        """
+        self.llm = (llm or ChatOpenAI(
             model="gpt-4o", 
             temperature=0.1,
             seed=42
-        ).bind(response_format={"type": "json_object"})
+        )).bind(response_format={"type": "json_object"})
+        # stream_usage makes streamed advice report token usage, including cached tokens
+        self.advice_llm = advice_llm or ChatOpenAI(model="gpt-4o", temperature=0.3, stream_usage=True)
         
         self.patient_parser = PydanticOutputParser(pydantic_object=PatientInfo)
         self.fixing_parser = OutputFixingParser.from_llm(
             llm=self.llm,
             parser=self.patient_parser,
         )
+        # Repairs extraction output locally and calls fixing_parser only when that fails
+        self.output_repair = PatientInfoParser(self.patient_parser, self.fixing_parser)
+        # Everything that does not depend on the note, format instructions included, is a fixed prefix
+        self.prompts = {
+            "extract_info": StagePrompt(
+                "extract_info", PATIENT_INFO_EXTRACTION_SYSTEM,
+                PATIENT_INFO_EXTRACTION_INSTRUCTIONS + "\n" + self.patient_parser.get_format_instructions(),
+                PATIENT_INFO_EXTRACTION_PROMPT, SHARED_CLINICAL_CONTEXT,
+            ),
+            "assess_severity": StagePrompt(
+                "assess_severity", SEVERITY_ASSESSMENT_SYSTEM, SEVERITY_ASSESSMENT_INSTRUCTIONS, SEVERITY_ASSESSMENT_PROMPT,
+                SHARED_CLINICAL_CONTEXT,
+            ),
+            "generate_advice": StagePrompt(
+                "generate_advice", CLINICAL_ADVICE_SYSTEM, CLINICAL_ADVICE_INSTRUCTIONS, CLINICAL_ADVICE_PROMPT,
+                SHARED_CLINICAL_CONTEXT,
+            ),
+        }
+        self.prompt_cache = PromptCacheStats()
+        if speculative_advice is None:
+            speculative_advice = os.getenv("SPECULATIVE_ADVICE", "").lower() in ("1", "true", "yes")
+        self.speculation = SpeculativeAdvice(int(os.getenv("SPECULATIVE_WORKERS", "4"))) if speculative_advice else None
+        self.pipeline = self._build_pipeline()
         self.graph = self._build_graph()
         
         # Initialize RAG system
-        try:
-            self.rag_system = RedditRAG()
-        except Exception as e:
-            print(f"Warning: RAG system initialization failed: {e}")
-            self.rag_system = None
+        self.rag_system = rag_system
+        if self.rag_system is None and load_rag:
+            try:
+                self.rag_system = RedditRAG()
+            except Exception as e:
+                print(f"Warning: RAG system initialization failed: {e}")
+    
+    def _build_pipeline(self) -> Pipeline:
+        """Declare the assessment stages and the inputs each one depends on."""
+        return Pipeline([
+            Stage("extract_info", self._extract_patient_info,
+                  inputs=["input_text"], output="patient_info",
+                  fallback=PatientInfo, errors=(ValidationError, ValueError, TypeError)),
+            Stage("assess_severity", self._assess_severity,
+                  inputs=["input_text", "patient_info"], output="phq8_score",
+                  fallback=lambda: 0, errors=(json.JSONDecodeError, KeyError)),
+            Stage("generate_advice", self._generate_advice,
+                  inputs=["input_text", "patient_info", "phq8_score"], output="advice"),
+            Stage("similar_cases", self._get_similar_cases,
+                  inputs=["input_text"], output="similar_cases",
+                  fallback=lambda: None, errors=(Exception,)),
+        ])
     
     def _build_graph(self) -> StateGraph:
-        """Build the LangGraph workflow."""
+        """Build the LangGraph workflow from the pipeline stages."""
         workflow = StateGraph(dict)
         
-        workflow.add_node("extract_info", self._extract_patient_info)
-        workflow.add_node("assess_severity", self._assess_severity)
-        workflow.add_node("generate_advice", self._generate_advice)
+        previous = None
+        for stage in self.pipeline.stages:
+            workflow.add_node(stage.name, lambda state, stage=stage: self.pipeline.run_stage(stage, state))
+            if previous is None:
+                workflow.set_entry_point(stage.name)
+            else:
+                workflow.add_edge(previous, stage.name)
+            previous = stage.name
+        workflow.add_edge(previous, END)
         
-        workflow.add_edge("extract_info", "assess_severity")
-        workflow.add_edge("assess_severity", "generate_advice")
-        workflow.add_edge("generate_advice", END)
-        
-        workflow.set_entry_point("extract_info")
         return workflow.compile()
     
-    def _extract_patient_info(self, state: Dict) -> Dict:
-        """Extract patient information using LLM with PydanticOutputParser."""
-        prompt = PromptTemplate(
-            template=PATIENT_INFO_EXTRACTION_PROMPT,
-            input_variables=["input_text"],
-            partial_variables={"format_instructions": self.patient_parser.get_format_instructions()}
-        )
-        
-        formatted_prompt = prompt.format(input_text=state["input_text"])
-        
-        messages = [
-            SystemMessage(content="You are a clinical information extraction expert. Return only valid JSON."),
-            HumanMessage(content=formatted_prompt)
-        ]
-        
-        try:
-            response = self.llm.invoke(messages)
-            patient_info = self.fixing_parser.parse(response.content)
-            state["patient_info"] = patient_info
-        except ValidationError as e:
-            print(f"Validation error: {e}")
-            state["patient_info"] = PatientInfo()
-        
-        return state
+    def _patient_prompt_fields(self, patient_info: PatientInfo, no_mood: str) -> Dict[str, str]:
+        """Render patient info as the Yes/No fields shared by the severity and advice prompts."""
+        return {
+            "age": patient_info.age or "Not specified",
+            "sleep_issues": "Yes" if patient_info.sleep_issues else "No",
+            "appetite_changes": "Yes" if patient_info.appetite_changes else "No",
+            "energy_level": patient_info.energy_level.value.title(),
+            "mood_symptoms": ", ".join([symptom.value for symptom in patient_info.mood_symptoms]) if patient_info.mood_symptoms else no_mood,
+            "social_withdrawal": "Yes" if patient_info.social_withdrawal else "No",
+            "concentration_issues": "Yes" if patient_info.concentration_issues else "No",
+            "hopelessness": "Yes" if patient_info.hopelessness else "No",
+        }
+    
+    def stage_messages(self, stage: str, input_text: str, patient_info: PatientInfo = None, phq8_score: int = None,
+                       band_only: bool = False) -> List:
+        """Chat messages for one LLM stage: the stage's static prefix, then this note's fields.
+        
+        ``band_only`` gives the advice prompt the score's severity band
+        instead of the exact score, so the advice fits any score in the band.
+        """
+        if stage == "extract_info":
+            fields = {"input_text": input_text}
+        elif stage == "assess_severity":
+            fields = dict(self._patient_prompt_fields(patient_info, no_mood="None"), original_input=input_text)
+        else:
+            fields = dict(
+                self._patient_prompt_fields(patient_info, no_mood="None identified"),
+                phq8_score=severity_band_range(phq8_score) if band_only else phq8_score,
+                severity_level=self._get_severity_level(phq8_score),
+                original_input=input_text,
+            )
+        return self.prompts[stage].messages(**fields)
+    
+    def _invoke(self, llm, stage: str, **inputs):
+        """Call ``llm`` with the stage's messages, recording prompt-cache usage."""
+        messages = self.stage_messages(stage, **inputs)
+        response = llm.invoke(messages)
+        self.prompt_cache.record(self.prompts[stage], messages, response)
+        return response
+    
+    def _extract_patient_info(self, input_text: str) -> PatientInfo:
+        """Extract patient information using LLM, repairing malformed output locally first."""
+        response = self._invoke(self.llm, "extract_info", input_text=input_text)
+        return self.output_repair.parse(response.content)
     
-    def _assess_severity(self, state: Dict) -> Dict:
+    def _assess_severity(self, input_text: str, patient_info: PatientInfo) -> int:
         """Assess suicide severity using LLM."""
-        patient_info = state["patient_info"]
-        
-        # Format patient info for prompt
-        mood_symptoms_str = ", ".join([symptom.value for symptom in patient_info.mood_symptoms]) if patient_info.mood_symptoms else "None"
-        energy_level_str = patient_info.energy_level.value.title()
-        
-        prompt = SEVERITY_ASSESSMENT_PROMPT.format(
-            age=patient_info.age or "Not specified",
-            sleep_issues="Yes" if patient_info.sleep_issues else "No",
-            appetite_changes="Yes" if patient_info.appetite_changes else "No",
-            energy_level=energy_level_str,
-            mood_symptoms=mood_symptoms_str,
-            social_withdrawal="Yes" if patient_info.social_withdrawal else "No",
-            concentration_issues="Yes" if patient_info.concentration_issues else "No",
-            hopelessness="Yes" if patient_info.hopelessness else "No",
-            original_input=state["input_text"]
-        )
-        
-        messages = [
-            SystemMessage(content="You are a clinical suicide risk assessment expert. Return only valid JSON."),
-            HumanMessage(content=prompt)
-        ]
-        
-        try:
-            response = self.llm.invoke(messages)
-            result = json.loads(response.content)
-            severity_score = result.get("severity_score", 0)
-            state["phq8_score"] = severity_score
-        except (json.JSONDecodeError, KeyError) as e:
-            print(f"Severity assessment error: {e}")
-            state["phq8_score"] = 0
-        
-        return state
+        response = self._invoke(self.llm, "assess_severity", input_text=input_text, patient_info=patient_info)
+        result = json.loads(response.content)
+        return result.get("severity_score", 0)
     
-    def _generate_advice(self, state: Dict) -> Dict:
+    def _generate_advice(self, input_text: str, patient_info: PatientInfo, phq8_score: int) -> str:
         """Generate clinical advice using LLM."""
-        patient_info = state["patient_info"]
-        phq8_score = state["phq8_score"]
-        severity_level = self._get_severity_level(phq8_score)
-        
-        # Format mood symptoms and energy level for display
-        mood_symptoms_str = ", ".join([symptom.value for symptom in patient_info.mood_symptoms]) if patient_info.mood_symptoms else "None identified"
-        energy_level_str = patient_info.energy_level.value.title()
-        
-        prompt = CLINICAL_ADVICE_PROMPT.format(
-            phq8_score=phq8_score,
-            severity_level=severity_level,
-            age=patient_info.age or "Not specified",
-            sleep_issues="Yes" if patient_info.sleep_issues else "No",
-            appetite_changes="Yes" if patient_info.appetite_changes else "No",
-            energy_level=energy_level_str,
-            mood_symptoms=mood_symptoms_str,
-            social_withdrawal="Yes" if patient_info.social_withdrawal else "No",
-            concentration_issues="Yes" if patient_info.concentration_issues else "No",
-            hopelessness="Yes" if patient_info.hopelessness else "No",
-            original_input=state["input_text"]
-        )
-        
-        advice_llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
-        messages = [
-            SystemMessage(content="You are an expert mental health counselor providing colleague guidance."),
-            HumanMessage(content=prompt)
-        ]
-        
-        response = advice_llm.invoke(messages)
-        state["advice"] = response.content
-        state["processed"] = True
-        
-        return state
+        response = self._invoke(self.advice_llm, "generate_advice",
+                                input_text=input_text, patient_info=patient_info, phq8_score=phq8_score)
+        return response.content
     
     def _get_severity_level(self, score: int) -> str:
         """Convert CSSRS score to suicide severity level."""
-        if score <= 1:
-            return "Minimal risk"
-        elif score <= 3:
-            return "Low risk"
-        elif score <= 5:
-            return "Moderate risk"
-        elif score <= 7:
-            return "High risk"
-        else:
-            return "Severe risk"
+        return severity_level(score)
     
-    def _get_similar_cases(self, input_text: str) -> str:
-        """Get similar cases from Reddit database."""
+    def _get_similar_cases(self, input_text: str) -> Optional[List[Dict]]:
+        """Get similar cases from Reddit database, or None if retrieval is unavailable."""
         if self.rag_system is None:
-            return "\n## 📚 Similar Cases\n*RAG system not available*\n"
-        
+            return None
+        return self.rag_system.find_similar_posts(input_text, top_k=3)
+    
+    def _build_result(self, state: Dict) -> AssessmentResult:
+        """Collect the pipeline outputs into the structured result that gets persisted."""
+        similar_cases = state["similar_cases"]
+        if similar_cases is not None:
+            similar_cases = [
+                SimilarCase(
+                    id=int(post["id"]),
+                    user=str(post["user"]),
+                    label=str(post["label"]),
+                    preview=post["preview"],
+                    similarity_score=post["similarity_score"],
+                )
+                for post in similar_cases
+            ]
+        
+        return AssessmentResult(
+            score=state["phq8_score"],
+            severity_level=self._get_severity_level(state["phq8_score"]),
+            patient_info=state["patient_info"],
+            advice=state["advice"],
+            similar_cases=similar_cases,
+            timings={entry["stage"]: entry["duration_ms"] for entry in state["trace"]},
+            trace=state["trace"],
+        )
+    
+    def _speculative_advice_text(self, messages: List, cancel: threading.Event) -> Optional[str]:
+        """Stream advice for ``messages``, dropping the stream as soon as ``cancel`` is set."""
+        parts = []
+        usage = None
+        for chunk in self.advice_llm.stream(messages):
+            if cancel.is_set():
+                return None
+            if getattr(chunk, "usage_metadata", None):
+                usage = chunk
+            parts.append(chunk.content)
+        self.prompt_cache.record(self.prompts["generate_advice"], messages, usage)
+        return "".join(parts)
+    
+    def _run_speculative(self, state: Dict) -> Dict:
+        """Run the stages with advice started on the provisional score while severity is assessed."""
+        severity, advice = self.pipeline.stage("assess_severity"), self.pipeline.stage("generate_advice")
+        self.pipeline.run_stage(self.pipeline.stage("extract_info"), state)
+        
+        speculation = None
+        if not self.pipeline.is_cached(severity, state):
+            # The prompt carries only the band, so a hit is advice for exactly these inputs
+            provisional = provisional_risk_score(state["input_text"])
+            messages = self.stage_messages("generate_advice", state["input_text"], state["patient_info"], provisional,
+                                           band_only=True)
+            speculation = self.speculation.start(lambda cancel: self._speculative_advice_text(messages, cancel), provisional)
+        speculated = None
         try:
-            similar_posts = self.rag_system.find_similar_posts(input_text, top_k=3)
-            return "\n" + format_similar_posts_for_display(similar_posts)
-        except Exception as e:
-            print(f"Error retrieving similar cases: {e}")
-            return "\n## 📚 Similar Cases\n*Error retrieving similar cases*\n"
+            self.pipeline.run_stage(severity, state)
+            if speculation is not None:
+                waited = time.perf_counter()
+                speculated = self.speculation.resolve(speculation, state["phq8_score"])
+        finally:
+            # Stop the speculative stream if severity failed or its advice is not used
+            if speculation is not None and speculated is None:
+                speculation.cancel.set()
+                speculation.future.cancel()
+        if speculated is not None:
+            # Written for the band rather than the score, so it is not memoised under the score
+            state["advice"] = speculated
+            state["trace"].append({
+                "stage": advice.name,
+                "status": "speculative",
+                "duration_ms": round((time.perf_counter() - waited) * 1000, 2),
+            })
+        else:
+            self.pipeline.run_stage(advice, state)
+        self.pipeline.run_stage(self.pipeline.stage("similar_cases"), state)
+        return state
+    
+    def _run(self, input_text: str, patient_info: PatientInfo = None) -> Dict:
+        """Run the stage graph, reusing any stage whose inputs are unchanged."""
+        initial_state = self.pipeline.initial_state(input_text=input_text, patient_info=patient_info)
+        if self.speculation is not None:
+            return self._run_speculative(initial_state)
+        return self.graph.invoke(initial_state)
     
     def extract_patient_info_only(self, input_text: str) -> PatientInfo:
         """Extract only patient information for UI display."""
-        prompt = PromptTemplate(
-            template=PATIENT_INFO_EXTRACTION_PROMPT,
-            input_variables=["input_text"],
-            partial_variables={"format_instructions": self.patient_parser.get_format_instructions()}
-        )
-        
-        formatted_prompt = prompt.format(input_text=input_text)
-        
-        messages = [
-            SystemMessage(content="You are a clinical information extraction expert. Return only valid JSON."),
-            HumanMessage(content=formatted_prompt)
-        ]
-        
-        try:
-            response = self.llm.invoke(messages)
-            return self.fixing_parser.parse(response.content)
-        except ValidationError as e:
-            print(f"Validation error: {e}")
-            return PatientInfo()
+        state = self.pipeline.initial_state(input_text=input_text)
+        self.pipeline.run_stage(self.pipeline.stage("extract_info"), state)
+        return state["patient_info"]
     
-    def process_with_patient_info(self, input_text: str, patient_info: PatientInfo) -> str:
-        """Process input with pre-extracted patient info."""
-        # Assess severity using LLM
-        mood_symptoms_str = ", ".join([symptom.value for symptom in patient_info.mood_symptoms]) if patient_info.mood_symptoms else "None"
-        energy_level_str = patient_info.energy_level.value.title()
-        
-        prompt = SEVERITY_ASSESSMENT_PROMPT.format(
-            age=patient_info.age or "Not specified",
-            sleep_issues="Yes" if patient_info.sleep_issues else "No",
-            appetite_changes="Yes" if patient_info.appetite_changes else "No",
-            energy_level=energy_level_str,
-            mood_symptoms=mood_symptoms_str,
-            social_withdrawal="Yes" if patient_info.social_withdrawal else "No",
-            concentration_issues="Yes" if patient_info.concentration_issues else "No",
-            hopelessness="Yes" if patient_info.hopelessness else "No",
-            original_input=input_text
-        )
-        
-        messages = [
-            SystemMessage(content="You are a clinical suicide risk assessment expert. Return only valid JSON."),
-            HumanMessage(content=prompt)
-        ]
-        
-        try:
-            response = self.llm.invoke(messages)
-            result = json.loads(response.content)
-            severity_score = result.get("severity_score", 0)
-        except (json.JSONDecodeError, KeyError) as e:
-            print(f"Severity assessment error: {e}")
-            severity_score = 0
-        
-        # Generate advice
-        severity_level = self._get_severity_level(severity_score)
-        
-        # Format mood symptoms and energy level for display
-        mood_symptoms_str = ", ".join([symptom.value for symptom in patient_info.mood_symptoms]) if patient_info.mood_symptoms else "None identified"
-        energy_level_str = patient_info.energy_level.value.title()
-        
-        advice_prompt = CLINICAL_ADVICE_PROMPT.format(
-            phq8_score=severity_score,
-            severity_level=severity_level,
-            age=patient_info.age or "Not specified",
-            sleep_issues="Yes" if patient_info.sleep_issues else "No",
-            appetite_changes="Yes" if patient_info.appetite_changes else "No",
-            energy_level=energy_level_str,
-            mood_symptoms=mood_symptoms_str,
-            social_withdrawal="Yes" if patient_info.social_withdrawal else "No",
-            concentration_issues="Yes" if patient_info.concentration_issues else "No",
-            hopelessness="Yes" if patient_info.hopelessness else "No",
-            original_input=input_text
-        )
-        
-        advice_llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
-        messages = [
-            SystemMessage(content="You are an expert mental health counselor providing colleague guidance."),
-            HumanMessage(content=advice_prompt)
-        ]
-        
-        response = advice_llm.invoke(messages)
-        
-        # Get similar cases
-        similar_cases = self._get_similar_cases(input_text)
-        
-        return f"""
-## CSSRS Assessment Result
-**Score: {severity_score}/10** - *{severity_level}*
-
-## Extracted Patient Information
-- **Age:** {patient_info.age or 'Not specified'}
-- **Sleep Issues:** {'Yes' if patient_info.sleep_issues else 'No'}
-- **Appetite Changes:** {'Yes' if patient_info.appetite_changes else 'No'}
-- **Energy Level:** {energy_level_str}
-- **Mood Symptoms:** {mood_symptoms_str}
-- **Social Withdrawal:** {'Yes' if patient_info.social_withdrawal else 'No'}
-- **Concentration Issues:** {'Yes' if patient_info.concentration_issues else 'No'}
-- **Hopelessness Indicators:** {'Yes' if patient_info.hopelessness else 'No'}
-
-## Clinical Guidance
-{response.content}
-
-{similar_cases}
-"""
+    def process_with_patient_info(self, input_text: str, patient_info: PatientInfo) -> AssessmentResult:
+        """Process input with pre-extracted (or counselor-corrected) patient info."""
+        return self._build_result(self._run(input_text, patient_info))
+    
+    def assess_only(self, input_text: str, patient_info: PatientInfo = None) -> Dict:
+        """Run extraction and severity scoring only; returns the pipeline state."""
+        state = self.pipeline.initial_state(input_text=input_text, patient_info=patient_info)
+        self.pipeline.run_stage(self.pipeline.stage("extract_info"), state)
+        self.pipeline.run_stage(self.pipeline.stage("assess_severity"), state)
+        return state
     
-    def process_input(self, input_text: str) -> str:
+    def stream_advice(self, input_text: str, patient_info: PatientInfo, phq8_score: int) -> Iterator[str]:
+        """Yield the clinical advice as the LLM produces it."""
+        messages = self.stage_messages("generate_advice", input_text, patient_info, phq8_score)
+        usage = None
+        for chunk in self.advice_llm.stream(messages):
+            # Token usage arrives on the last chunk
+            if getattr(chunk, "usage_metadata", None):
+                usage = chunk
+            if chunk.content:
+                yield chunk.content
+        self.prompt_cache.record(self.prompts["generate_advice"], messages, usage)
+    
+    def process_input(self, input_text: str) -> AssessmentResult:
         """Process counselor input and return clinical guidance."""
-        initial_state = {
-            "input_text": input_text,
-            "patient_info": None,
-            "phq8_score": None,
-            "advice": "",
-            "processed": False
-        }
-        
         try:
-            result = self.graph.invoke(initial_state)
-            
-            # Format the response
-            patient_info = result["patient_info"]
-            phq8_score = result["phq8_score"]
-            severity = self._get_severity_level(phq8_score)
-            advice = result["advice"]
-            
-            # Format mood symptoms and energy level for display
-            mood_symptoms_str = ", ".join([symptom.value for symptom in patient_info.mood_symptoms]) if patient_info.mood_symptoms else "None identified"
-            energy_level_str = patient_info.energy_level.value.title()
-            
-            # Get similar cases
-            similar_cases = self._get_similar_cases(input_text)
-            
-            return f"""
-## CSSRS Assessment Result
-**Score: {phq8_score}/10** - *{severity}*
-
-## Extracted Patient Information
-- **Age:** {patient_info.age or 'Not specified'}
-- **Sleep Issues:** {'Yes' if patient_info.sleep_issues else 'No'}
-- **Appetite Changes:** {'Yes' if patient_info.appetite_changes else 'No'}
-- **Energy Level:** {energy_level_str}
-- **Mood Symptoms:** {mood_symptoms_str}
-- **Social Withdrawal:** {'Yes' if patient_info.social_withdrawal else 'No'}
-- **Concentration Issues:** {'Yes' if patient_info.concentration_issues else 'No'}
-- **Hopelessness Indicators:** {'Yes' if patient_info.hopelessness else 'No'}
-
-## Clinical Guidance
-{advice}
-
-{similar_cases}
-"""
-            
+            return self._build_result(self._run(input_text))
         except Exception as e:
-            return f"Error processing input: {str(e)}. Please try rephrasing your input." 
\ No newline at end of file
+            return AssessmentResult(error=f"Error processing input: {str(e)}. Please try rephrasing your input.")
@@ -1,12 +1,26 @@
 import streamlit as st
+import os
+import threading
 import time
 import uuid
+from functools import partial
 from agent import CounselorAgent
-from models import Conversation, PatientInfo
-from database import Database
+from jobs import AssessmentJobQueue, QUEUED, job_outcome
+from models import Conversation, conversation_key
+from database import create_database
+from diagnostics import TRACER, agent_components, memory_report, parse_budgets
+from history_index import HistoryIndex
+from persistence import WriteBehindQueue
+from views import (
+    RenderCache, build_patient_info_card, read_stylesheet, render_history,
+)
 from dotenv import load_dotenv
 load_dotenv()
 
+# Number of assessments loaded per history page
+HISTORY_PAGE_SIZE = 20
+JOB_POLL_INTERVAL = 0.5
+
 st.set_page_config(
     page_title="Suicide Severity Assessment Assistant", 
     page_icon="🚨",
@@ -16,203 +30,254 @@ st.set_page_config(
 
 def load_css():
     """Load custom CSS styling."""
-    try:
-        with open("style.css") as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
-    except FileNotFoundError:
-        pass
+    stylesheet = read_stylesheet("style.css")
+    if stylesheet is not None:
+        st.markdown(f"<style>{stylesheet}</style>", unsafe_allow_html=True)
+
+@st.cache_resource
+def get_render_cache():
+    """Process-wide cache of rendered historical assessments, shared by all sessions."""
+    return RenderCache()
+
+@st.cache_resource
+def get_agent():
+    """One agent (LLM clients, RAG index and stage memo) shared by every session."""
+    agent = CounselorAgent()
+    # Walking the agent costs a moment, so only when there are budgets to check
+    if parse_budgets():
+        memory_report(agent_components(agent))
+    return agent
+
+@st.cache_resource
+def get_database():
+    """One storage backend (and its connection pool) for the whole process, set up once."""
+    return create_database()
+
+@st.cache_resource
+def get_writer():
+    """One background writer for every session, so there is a single thread and shutdown hook."""
+    return WriteBehindQueue(get_database())
+
+@st.cache_resource
+def get_history_index():
+    """Search index over saved notes, attached to the shared database; None without a RAG model."""
+    rag_system = get_agent().rag_system
+    if rag_system is None:
+        return None
+    # Notes are embedded as they are saved, with the RAG model, so past notes can be searched
+    history_index = HistoryIndex(rag_system.model)
+    history_index.attach(get_database())
+    return history_index
+
+@st.cache_resource
+def get_job_queue():
+    """Process-wide assessment worker pool, so work from all counselors is scheduled together."""
+    return AssessmentJobQueue(get_agent(), workers=int(os.getenv("ASSESSMENT_WORKERS", "4")))
+
+@st.cache_resource
+def get_conversation_locks():
+    """Per conversation key, guards open conversations that job workers add results to."""
+    return {}
+
+def conversation_lock(key):
+    return get_conversation_locks().setdefault(key, threading.RLock())
 
 def init_app():
     """Initialize the app."""
     if "db" not in st.session_state:
-        st.session_state.db = Database()
+        st.session_state.db = get_database()
+    
+    if "writer" not in st.session_state:
+        st.session_state.writer = get_writer()
     
     if "agent" not in st.session_state:
-        st.session_state.agent = CounselorAgent()
+        st.session_state.agent = get_agent()
+        st.session_state.jobs = get_job_queue()
+    
+    if "history_index" not in st.session_state:
+        st.session_state.history_index = get_history_index()
     
-    if "is_generating" not in st.session_state:
-        st.session_state.is_generating = False
+    # Job ids still running per conversation key, and the conversations their results are added to
+    if "pending_jobs" not in st.session_state:
+        st.session_state.pending_jobs = {}
+        st.session_state.open_conversations = {}
     
-    # Always load the global conversation
+    if "counselor_id" not in st.session_state:
+        st.session_state.counselor_id = st.query_params.get("counselor") or os.getenv("COUNSELOR_ID", "default")
+        # One-off move of the pre-sharding global document into this counselor's history
+        st.session_state.db.migrate_global_conversation(st.session_state.counselor_id, "legacy")
+    
+    # Resume the counselor's most recent conversation, or start a new one
     if "conversation" not in st.session_state:
-        existing = st.session_state.db.load_conversation()
-        if existing:
-            st.session_state.conversation = existing
-            print(f"✅ Loaded conversation with {len(existing.messages)} messages")
+        recent = st.session_state.db.list_recent_conversations(st.session_state.counselor_id, limit=1)
+        if recent:
+            open_conversation(recent[0]["session_id"])
         else:
-            st.session_state.conversation = Conversation(
-                id=str(uuid.uuid4()),
-                session_id="global",
-                title="Mental Health Conversations"
-            )
-            print("✅ Created new conversation")
+            start_new_conversation()
+
+def open_conversation(session_id):
+    """Load one of the counselor's stored conversations."""
+    key = conversation_key(st.session_state.counselor_id, session_id)
+    if key in st.session_state.open_conversations:
+        # Still waiting for background assessments, keep using the object they will be added to
+        st.session_state.conversation = st.session_state.open_conversations[key]
+        return
+    
+    existing = st.session_state.db.load_conversation(
+        st.session_state.counselor_id, session_id, assessments=HISTORY_PAGE_SIZE
+    )
+    if existing:
+        st.session_state.conversation = existing
+        print(f"✅ Loaded conversation {existing.key} with {len(existing.messages)} messages")
+    else:
+        start_new_conversation()
+
+def start_new_conversation():
+    """Start an empty conversation in a fresh session."""
+    st.session_state.conversation = Conversation(
+        id=str(uuid.uuid4()),
+        counselor_id=st.session_state.counselor_id,
+        session_id=uuid.uuid4().hex[:12],
+        title="Mental Health Conversations"
+    )
+    print(f"✅ Created new conversation {st.session_state.conversation.key}")
 
 def save_conversation():
-    """Save conversation to file."""
+    """Queue the conversation for saving by the background writer."""
     if st.session_state.conversation:
-        success = st.session_state.db.save_conversation(st.session_state.conversation)
-        if success:
-            print(f"✅ Saved conversation with {len(st.session_state.conversation.messages)} messages")
+        with conversation_lock(st.session_state.conversation.key):
+            st.session_state.writer.submit(st.session_state.conversation)
+        error = st.session_state.writer.failed(st.session_state.conversation.key).get(st.session_state.conversation.key)
+        if error:
+            st.warning(f"⚠️ The last save of this conversation failed ({error}); it is being retried.")
 
-def display_patient_info_card(patient_info, message_id=""):
-    """Display patient information in a visual card format."""
-    
-    # Determine mood indicators
-    risk_indicators = []
-    if patient_info.sleep_issues:
-        risk_indicators.append("💤 Sleep Disturbances")
-    if patient_info.appetite_changes:
-        risk_indicators.append("🍽️ Appetite Changes")
-    if patient_info.social_withdrawal:
-        risk_indicators.append("🚪 Social Isolation")
-    if patient_info.concentration_issues:
-        risk_indicators.append("🧠 Concentration Problems")
-    if patient_info.hopelessness:
-        risk_indicators.append("⚠️ Hopelessness/Despair")
-    
-    # Energy level icon - handle enum
-    energy_icon = {"low": "🔋", "normal": "⚡", "high": "⚡⚡"}
-    energy_value = patient_info.energy_level.value if hasattr(patient_info.energy_level, 'value') else str(patient_info.energy_level)
-    energy_display = f"{energy_icon.get(energy_value, '⚡')} {energy_value.title()}"
-    age_display = patient_info.age or 'Not specified'
-    
-    # Create the basic card structure
-    html_parts = [
-        f'<div class="patient-info-card" id="patient-info-{message_id}">',
-        '    <div class="patient-info-header">',
-        '        <h3>🚨 Suicide Risk Factors Identified</h3>',
-        '    </div>',
-        '    <div class="patient-info-content">',
-        '        <div class="info-row">',
-        '            <div class="info-item">',
-        '                <span class="info-label">👤 Age</span>',
-        f'                <span class="info-value">{age_display}</span>',
-        '            </div>',
-        '            <div class="info-item">',
-        '                <span class="info-label">⚡ Energy</span>',
-        f'                <span class="info-value">{energy_display}</span>',
-        '            </div>',
-        '        </div>'
-    ]
+def submit_assessment(conversation, input_text):
+    """Save the note and queue it for background assessment against ``conversation``."""
+    with conversation_lock(conversation.key):
+        note_seq = conversation._seq_offset + len(conversation.messages)
+        conversation.add_message("user", input_text)
+        st.session_state.writer.submit(conversation)
     
-    # Add mood symptoms section if present - handle enum list
-    if patient_info.mood_symptoms:
-        html_parts.extend([
-            '        <div class="mood-symptoms">',
-            '            <span class="info-label">🎭 Risk Symptoms:</span>'
-        ])
-        for symptom in patient_info.mood_symptoms:
-            symptom_value = symptom.value if hasattr(symptom, 'value') else str(symptom)
-            html_parts.append(f'            <span class="mood-badge">{symptom_value}</span>')
-        html_parts.append('        </div>')
-    
-    # Add indicators section
-    if risk_indicators:
-        html_parts.extend([
-            '        <div class="indicators-grid">'
-        ])
-        for indicator in risk_indicators:
-            html_parts.append(f'            <div class="indicator">{indicator}</div>')
-        html_parts.append('        </div>')
-    else:
-        html_parts.append('        <div class="no-indicators">✅ No significant suicide risk indicators detected</div>')
-    
-    # Close the card
-    html_parts.extend([
-        '    </div>',
-        '</div>'
-    ])
-    
-    # Join all parts and display
-    complete_html = '\n'.join(html_parts)
-    st.markdown(complete_html, unsafe_allow_html=True)
+    on_finish = partial(save_job_result, st.session_state.writer, conversation, note_seq)
+    job_id = st.session_state.jobs.submit(input_text, owner=conversation.key, on_finish=on_finish)
+    st.session_state.pending_jobs.setdefault(conversation.key, []).append(job_id)
+    st.session_state.open_conversations[conversation.key] = conversation
 
-def format_cssrs_result(content):
-    """Extract and format CSSRS result for better display."""
-    lines = content.split('\n')
-    formatted_content = ""
+def save_job_result(writer, conversation, note_seq, job):
+    """Job callback on the worker thread: add the outcome after its note and queue the save.
     
-    for line in lines:
-        if "## CSSRS Assessment Result" in line:
+    The session that submitted the note may have closed or stopped polling
+    by now; the conversation and the shared writer still store the result.
+    """
+    patient_info, result = job_outcome(job)
+    # Other notes may have been saved since this one, so the result names its note
+    result.note_seq = note_seq
+    with conversation_lock(conversation.key):
+        conversation.add_message("patient_info", patient_info)
+        conversation.add_message("assistant", result)
+        writer.submit(conversation)
+
+def collect_finished_jobs():
+    """Stop tracking jobs whose results their callbacks have added to the conversation."""
+    jobs = st.session_state.jobs
+    for key, pending in list(st.session_state.pending_jobs.items()):
+        for job_id in list(pending):
+            job = jobs.get(job_id)
+            if job is None or job.handled.is_set():
+                pending.remove(job_id)
+                jobs.forget(job_id)
+        
+        if not pending:
+            del st.session_state.pending_jobs[key]
+            del st.session_state.open_conversations[key]
+
+def display_pending_jobs(conversation):
+    """Show the status of queued and running assessments for ``conversation`` with a cancel button each."""
+    for job_id in st.session_state.pending_jobs.get(conversation.key, []):
+        job = st.session_state.jobs.get(job_id)
+        if job is None or job.finished:
             continue
-        elif "**Score:" in line and "/10**" in line:
-            # Extract score and severity
-            import re
-            score_match = re.search(r'\*\*Score: (\d+)/10\*\* - \*([^*]+)\*', line)
-            if score_match:
-                score = score_match.group(1)
-                severity = score_match.group(2)
-                formatted_content += f"""
-<div class="phq-score-card">
-    <div class="score-section">
-        <div class="score-number">{score}</div>
-        <div class="score-label">/ 10</div>
-    </div>
-    <div class="severity-section">
-        <div class="severity-label">Suicide Risk</div>
-        <div class="severity-text">{severity}</div>
-    </div>
-</div>
-"""
-            else:
-                formatted_content += line + "\n"
+        
+        if job.status == QUEUED:
+            label = f"Queued (provisional risk {job.provisional_score}/10)"
         else:
-            formatted_content += line + "\n"
+            label = "Extracting risk factors..." if job.stage == "extract_info" else "Generating risk assessment..."
+        preview = job.input_text[:60] + ("..." if len(job.input_text) > 60 else "")
+        st.info(f"⏳ {label}: {preview}")
+        
+        if job.patient_info is not None:
+            display_patient_info_card(job.patient_info, f"job-{job.id}")
+        
+        if st.button("✖️ Cancel", key=f"cancel_{job.id}"):
+            st.session_state.jobs.cancel(job.id)
+            st.rerun()
+
+def display_patient_info_card(patient_info, message_id=""):
+    """Display patient information in a visual card format."""
+    st.markdown(build_patient_info_card(patient_info, message_id), unsafe_allow_html=True)
+
+def display_conversation_messages(conversation, messages=None):
+    """Display the loaded messages in the conversation, or the given trailing slice of them."""
+    if messages is None:
+        messages = conversation.messages
+    
+    # Older pages may not be loaded, so number assessments from the end of the history
+    loaded_assessments = sum(1 for message in conversation.messages if message.role == "user")
+    first_assessment = conversation.total_assessments - loaded_assessments
     
-    return formatted_content
+    first_seq = conversation._seq_offset + (len(conversation.messages) - len(messages))
+    for html in render_history(messages, first_assessment, get_render_cache(), first_seq, conversation.key):
+        st.markdown(html, unsafe_allow_html=True)
 
-def display_conversation_messages(conversation):
-    """Display all messages in the conversation."""
-    assessment_counter = 0
-    i = 0
+def display_memory_diagnostics():
+    """Debug page (``?debug=1``): memory per component and tracemalloc snapshots."""
+    st.markdown("## 🩺 Memory diagnostics")
+    conversations = [st.session_state.conversation, *st.session_state.open_conversations.values()]
+    report = memory_report(agent_components(
+        st.session_state.agent, conversations,
+        render_cache=get_render_cache(), job_queue=st.session_state.jobs, writer=st.session_state.writer,
+    ))
     
-    while i < len(conversation.messages):
-        if conversation.messages[i].role == "user":
-            assessment_counter += 1
-            user_msg = conversation.messages[i]
-            
-            # Display user message
-            st.markdown(f"""
-            <div class="message-container user-message">
-                <div class="message-header">
-                    <span class="role-label">Crisis Report</span>
-                    <span class="message-timestamp">Assessment #{assessment_counter}</span>
-                </div>
-                <div class="message-content">{user_msg.content}</div>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            # Look for patient info
-            if i + 1 < len(conversation.messages) and conversation.messages[i + 1].role == "patient_info":
-                patient_info_msg = conversation.messages[i + 1]
-                
-                if isinstance(patient_info_msg.content, PatientInfo):
-                    display_patient_info_card(patient_info_msg.content, f"msg-{assessment_counter}")
-                
-                # Look for assistant response
-                if i + 2 < len(conversation.messages) and conversation.messages[i + 2].role == "assistant":
-                    assistant_msg = conversation.messages[i + 2]
-                    formatted_content = format_cssrs_result(str(assistant_msg.content))
-                    st.markdown(f"""
-                    <div class="message-container assistant-message">
-                        <div class="message-header">
-                            <span class="role-label">Risk Assessment</span>
-                            <span class="message-timestamp">Assessment #{assessment_counter}</span>
-                        </div>
-                        <div class="message-content">{formatted_content}</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    i += 3
-                else:
-                    i += 2
-            else:
-                i += 1
+    for warning in report["budget_warnings"]:
+        st.warning(f"Memory budget exceeded: {warning}")
+    process = report["process"]
+    st.markdown(
+        f"**RSS** {process['rss_mb']} MB (peak {process['peak_rss_mb']} MB) · "
+        f"**Python heap** {process['python_heap_mb'] if process['tracing'] else 'not traced'} · "
+        f"**Unattributed** {report.get('unattributed_mb')} MB · measured in {report['measure_ms']} ms"
+    )
+    st.table([{"component": name, **values} for name, values in report["components"].items()])
+    st.caption("Only this session's conversations are counted; other sessions' show up as unattributed.")
+    
+    tracing_column, snapshot_column = st.columns(2)
+    with tracing_column:
+        if TRACER.tracing:
+            if st.button("⏹️ Stop tracing"):
+                TRACER.stop()
+                st.rerun()
+        elif st.button("▶️ Start tracing allocations"):
+            TRACER.start()
+            st.rerun()
+    with snapshot_column:
+        if st.button("📸 Take snapshot"):
+            TRACER.take()
+            st.rerun()
+    
+    labels = TRACER.labels()
+    if labels:
+        newer = st.selectbox("Snapshot", labels, index=len(labels) - 1)
+        st.markdown("**Python heap by component (MB)**")
+        st.bar_chart(TRACER.by_component(newer))
+        older = st.selectbox("Compare with", ["(none)"] + [label for label in labels if label != newer])
+        if older == "(none)":
+            st.table(TRACER.top(newer))
         else:
-            i += 1
+            st.table(TRACER.diff(older, newer))
 
 def main():
     load_css()
     init_app()
+    collect_finished_jobs()
     
     conversation = st.session_state.conversation
     
@@ -240,7 +305,7 @@ def main():
             </ol>
         </div>
         """, unsafe_allow_html=True)
-
+        
         # CSSRS Scale Reference
         st.markdown("""
         <div style="background: #fff3cd; padding: 1rem; border-radius: 8px; margin: 1rem 0; border-left: 4px solid #ffc107;">
@@ -271,6 +336,57 @@ def main():
         </div>
         """, unsafe_allow_html=True)
         
+        # Recent conversations for this counselor
+        recent = st.session_state.db.list_recent_conversations(st.session_state.counselor_id, limit=10)
+        if recent:
+            options = {item["session_id"]: item for item in recent}
+            if conversation.session_id not in options:
+                options = {conversation.session_id: {"title": conversation.title, "total_assessments": conversation.total_assessments}, **options}
+            selected = st.selectbox(
+                "🗂️ Recent conversations",
+                list(options),
+                index=list(options).index(conversation.session_id),
+                format_func=lambda sid: f"{options[sid].get('title', 'Untitled')} ({options[sid].get('total_assessments', 0)} assessments)",
+            )
+            if selected != conversation.session_id:
+                open_conversation(selected)
+                st.rerun()
+        
+        if st.button("➕ New Conversation", key="new_conversation_btn", use_container_width=True):
+            start_new_conversation()
+            st.rerun()
+        
+        if st.session_state.history_index is not None:
+            with st.expander("🔎 Search past assessments"):
+                query = st.text_input("Find notes like", key="history_query")
+                if query:
+                    matches = st.session_state.history_index.search(st.session_state.counselor_id, query, k=5)
+                    if not matches:
+                        st.caption("No saved notes to search yet")
+                    for match in matches:
+                        st.markdown(f"**{match['similarity']:.2f}** · {match['timestamp']:%Y-%m-%d %H:%M} · `{match['session_id']}`")
+                        st.caption(match["preview"])
+                        if match["session_id"] != conversation.session_id and st.button(
+                            "Open conversation", key=f"history_open_{match['conversation_id']}_{match['seq']}"
+                        ):
+                            open_conversation(match["session_id"])
+                            st.rerun()
+        
+        # Aggregates across all of this counselor's conversations, computed by the database
+        with st.expander("📈 Dashboard"):
+            dashboard = st.session_state.db.assessment_dashboard(st.session_state.counselor_id)
+            if dashboard.get("assessments"):
+                st.markdown(f"**{dashboard['assessments']}** assessments in **{dashboard['conversations']}** conversations")
+                st.markdown("**Risk levels**")
+                st.bar_chart(dashboard["band_counts"])
+                if dashboard["label_counts"]:
+                    st.markdown("**Similar-case labels**")
+                    st.bar_chart(dashboard["label_counts"])
+                st.markdown("**Assessments per day**")
+                st.line_chart(dict(sorted(dashboard["daily_assessments"].items())))
+            else:
+                st.caption("No assessments recorded yet")
+        
         # Show conversation stats or empty state
         if conversation.messages:
             st.markdown(f"""
@@ -283,10 +399,9 @@ def main():
             """, unsafe_allow_html=True)
             
             if st.button("🗑️ Clear All History", key="clear_btn", help="Clear all assessments", use_container_width=True):
-                conversation.messages = []
-                conversation.total_assessments = 0
-                conversation.last_phq_score = None
-                save_conversation()
+                with conversation_lock(conversation.key):
+                    conversation.clear_history()
+                    save_conversation()
                 st.rerun()
         else:
             st.markdown("""
@@ -295,7 +410,7 @@ def main():
                 <p>Start by describing patient's suicidal ideation, behaviors, and risk factors.</p>
             </div>
             """, unsafe_allow_html=True)
-        
+    
     
     # Main content
     st.markdown("""
@@ -307,115 +422,32 @@ def main():
     </div>
     """, unsafe_allow_html=True)
     
-    # Always display conversation messages
-    if not st.session_state.is_generating:
-        display_conversation_messages(conversation)
+    if st.query_params.get("debug") == "1":
+        display_memory_diagnostics()
     
-    # Handle generation
-    if st.session_state.is_generating:
-        # Show existing messages first (excluding the current one being processed)
-        if len(conversation.messages) > 1:
-            temp_conversation = Conversation(
-                id=conversation.id,
-                session_id=conversation.session_id,
-                title=conversation.title,
-                messages=conversation.messages[:-1],  # Exclude last message
-                created_at=conversation.created_at,
-                updated_at=conversation.updated_at,
-                total_assessments=conversation.total_assessments,
-                last_phq_score=conversation.last_phq_score
-            )
-            display_conversation_messages(temp_conversation)
-        
-        # Then show the generation process
-        latest_message = conversation.messages[-1]
-        assessment_num = conversation.total_assessments
-        
-        # Display current user message being processed
-        st.markdown(f"""
-        <div class="message-container user-message">
-            <div class="message-header">
-                <span class="role-label">Crisis Report</span>
-                <span class="message-timestamp">Assessment #{assessment_num} (Processing...)</span>
-            </div>
-            <div class="message-content">{latest_message.content}</div>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        # Extract patient info
-        with st.spinner("🔍 Extracting suicide risk factors..."):
-            patient_info = st.session_state.agent.extract_patient_info_only(latest_message.content)
-        
-        display_patient_info_card(patient_info, f"current-{assessment_num}")
-        conversation.add_message("patient_info", patient_info)
-        save_conversation()
-        
-        # Generate response with streaming
-        response_placeholder = st.empty()
-        
-        with st.spinner("🚨 Generating suicide risk assessment..."):
-            full_response = st.session_state.agent.process_with_patient_info(latest_message.content, patient_info)
-            
-            # Simulate streaming
-            words = full_response.split()
-            current_text = ""
-            
-            for i, word in enumerate(words):
-                current_text += word + " "
-                formatted_current = format_cssrs_result(current_text + "...")
-                
-                with response_placeholder:
-                    st.markdown(f"""
-                    <div class="message-container assistant-message streaming">
-                        <div class="message-header">
-                            <span class="role-label">Risk Assessment</span>
-                            <span class="message-timestamp">Generating...</span>
-                        </div>
-                        <div class="message-content">{formatted_current}</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                
-                if i % 4 == 0:
-                    time.sleep(0.08)
-            
-            # Add complete response
-            conversation.add_message("assistant", full_response)
-            
-            # Update PHQ score
-            import re
-            score_match = re.search(r'\*\*Score: (\d+)/10\*\*', full_response)
-            if score_match:
-                conversation.last_phq_score = int(score_match.group(1))
-            
-            save_conversation()
-            st.session_state.is_generating = False
-            
-            # Show final response
-            formatted_final = format_cssrs_result(full_response)
-            with response_placeholder:
-                st.markdown(f"""
-                <div class="message-container assistant-message">
-                    <div class="message-header">
-                        <span class="role-label">Risk Assessment</span>
-                        <span class="message-timestamp">Assessment #{assessment_num}</span>
-                    </div>
-                    <div class="message-content">{formatted_final}</div>
-                </div>
-                """, unsafe_allow_html=True)
-            
+    # Older assessments are fetched from storage only when asked for
+    if conversation.has_older_messages:
+        if st.button("⬆️ Load older assessments", key="load_older_btn", use_container_width=True):
+            with conversation_lock(conversation.key):
+                st.session_state.db.load_older_messages(conversation, HISTORY_PAGE_SIZE)
             st.rerun()
     
+    display_conversation_messages(conversation)
+    
+    # Assessments still running in the background
+    display_pending_jobs(conversation)
+    
     # Input
     st.markdown('<div class="input-area"></div>', unsafe_allow_html=True)
     
-    if st.session_state.is_generating:
-        st.chat_input("Please wait for current risk assessment to complete...", disabled=True)
-    else:
-        if prompt := st.chat_input("Describe patient's suicidal thoughts, behaviors, risk factors, and clinical observations..."):
-            conversation.add_message("user", prompt)
-            save_conversation()
-            st.session_state.is_generating = True
-            st.rerun()
+    if prompt := st.chat_input("Describe patient's suicidal thoughts, behaviors, risk factors, and clinical observations..."):
+        submit_assessment(conversation, prompt)
+        st.rerun()
+    
+    # Poll until every background assessment has been collected
+    if st.session_state.pending_jobs:
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
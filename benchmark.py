@@ -0,0 +1,459 @@
+"""
+Micro-benchmarks for the storage and retrieval layers.
+
+Run with ``python benchmark.py <name>``; each benchmark prints a small table.
+Storage benchmarks use the backend named by ``BENCH_BACKEND`` (default
+``sqlite``). mongomock scans collections linearly instead of using indexes,
+so it is only useful for functional comparisons, not for scaling curves;
+set ``MONGODB_URI`` and ``BENCH_BACKEND=mongo`` to measure a real server.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import numpy as np
+
+from models import ChatMessage, Conversation, PatientInfo, EnergyLevel, MoodSymptom, StoredMessage
+
+
+def _make_conversation() -> Conversation:
+    return Conversation(id=str(uuid.uuid4()), session_id="global", title="Benchmark")
+
+
+def _add_assessment(conversation: Conversation, n: int):
+    """Append one user / patient_info / assistant triple, like a single app assessment."""
+    conversation.add_message("user", f"Patient note #{n}: reports poor sleep and feeling hopeless lately.")
+    conversation.add_message("patient_info", PatientInfo(
+        age=30 + n % 40,
+        sleep_issues=True,
+        energy_level=EnergyLevel.low,
+        mood_symptoms=[MoodSymptom.sadness, MoodSymptom.emptiness],
+        hopelessness=n % 2 == 0,
+    ))
+    conversation.add_message("assistant", f"## CSSRS Assessment Result\n**Score: {n % 10}/10** - *Low risk*\n" + "Guidance. " * 80)
+
+
+def _mongomock_database():
+    import mongomock
+    from database import MongoDatabase
+    return MongoDatabase(client=mongomock.MongoClient())
+
+
+def _sqlite_database():
+    from database import SQLiteDatabase
+    return SQLiteDatabase(path=os.path.join(tempfile.mkdtemp(), "benchmark.db"))
+
+
+def _available_backends():
+    """Backends that can run here: SQLite always, Mongo via mongomock or a real MONGODB_URI."""
+    backends = {"sqlite": _sqlite_database}
+    try:
+        import mongomock  # noqa: F401
+        backends["mongomock"] = _mongomock_database
+    except ImportError:
+        pass
+    if os.getenv("MONGODB_URI"):
+        from database import MongoDatabase
+        backends["mongo"] = MongoDatabase
+    return backends
+
+
+def _benchmark_database():
+    return _available_backends()[os.getenv("BENCH_BACKEND", "sqlite")]()
+
+
+def bench_save(history_sizes=(0, 100, 1000, 3000), repeats: int = 20):
+    """Time one assessment's saves at growing history sizes."""
+    db = _benchmark_database()
+    conversation = _make_conversation()
+    
+    print(f"{'history (assessments)':>22} {'ms / assessment save':>22}")
+    done = 0
+    for size in history_sizes:
+        while done < size:
+            _add_assessment(conversation, done)
+            done += 1
+        db.save_conversation(conversation)
+        
+        started = time.perf_counter()
+        for _ in range(repeats):
+            _add_assessment(conversation, done)
+            done += 1
+            db.save_conversation(conversation)
+        elapsed_ms = (time.perf_counter() - started) * 1000 / repeats
+        print(f"{size:>22} {elapsed_ms:>22.3f}")
+
+
+def bench_load(history_sizes=(100, 1000, 3000), page_size: int = 20, repeats: int = 5):
+    """Compare loading the full history with loading only the latest page."""
+    db = _benchmark_database()
+    conversation = _make_conversation()
+    
+    print(f"{'history (assessments)':>22} {'full load ms':>14} {'paged load ms':>14}")
+    done = 0
+    for size in history_sizes:
+        while done < size:
+            _add_assessment(conversation, done)
+            done += 1
+        db.save_conversation(conversation)
+        
+        timings = []
+        for assessments in (None, page_size):
+            started = time.perf_counter()
+            for _ in range(repeats):
+                db.load_conversation(conversation.counselor_id, conversation.session_id, assessments=assessments)
+            timings.append((time.perf_counter() - started) * 1000 / repeats)
+        print(f"{size:>22} {timings[0]:>14.2f} {timings[1]:>14.2f}")
+
+
+def bench_backends(history: int = 300, saves: int = 100, loads: int = 20, page_size: int = 20):
+    """Compare save and load throughput of every available storage backend."""
+    print(f"{'backend':>10} {'saves/s':>10} {'full loads/s':>13} {'paged loads/s':>14}")
+    for name, factory in _available_backends().items():
+        db = factory()
+        conversation = _make_conversation()
+        for n in range(history):
+            _add_assessment(conversation, n)
+        db.save_conversation(conversation)
+        
+        started = time.perf_counter()
+        for n in range(saves):
+            _add_assessment(conversation, history + n)
+            db.save_conversation(conversation)
+        save_rate = saves / (time.perf_counter() - started)
+        
+        load_rates = []
+        for assessments in (None, page_size):
+            started = time.perf_counter()
+            for _ in range(loads):
+                db.load_conversation(conversation.counselor_id, conversation.session_id, assessments=assessments)
+            load_rates.append(loads / (time.perf_counter() - started))
+        
+        print(f"{name:>10} {save_rate:>10.1f} {load_rates[0]:>13.1f} {load_rates[1]:>14.1f}")
+
+
+def _measure(fn, repeats: int):
+    """Mean wall time in ms and peak traced allocation in KiB of ``fn``."""
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    elapsed_ms = (time.perf_counter() - started) * 1000 / repeats
+    
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed_ms, peak / 1024
+
+
+def bench_codec(assessments: int = 334, repeats: int = 10):
+    """Encode and decode a ~1,000 message history with the pydantic round trip and with the direct codec."""
+    conversation = _make_conversation()
+    for n in range(assessments):
+        _add_assessment(conversation, n)
+    messages = conversation.messages
+    
+    def encode_roundtrip():
+        return [
+            json.loads(m.content.model_dump_json()) if isinstance(m.content, PatientInfo) else str(m.content)
+            for m in messages
+        ]
+    
+    def encode_direct():
+        return [m.content.to_record() if isinstance(m.content, PatientInfo) else str(m.content) for m in messages]
+    
+    records = [
+        {"role": m.role, "timestamp": m.timestamp, "content": content,
+         "content_type": "patient_info" if isinstance(m.content, PatientInfo) else "text"}
+        for m, content in zip(messages, encode_direct())
+    ]
+    
+    def decode_validated():
+        return Conversation(id="x", session_id="bench", title="Benchmark", messages=[
+            ChatMessage(role=r["role"], timestamp=r["timestamp"],
+                        content=PatientInfo(**r["content"]) if r["content_type"] == "patient_info" else r["content"])
+            for r in records
+        ])
+    
+    def decode_lazy():
+        return Conversation.model_construct(id="x", session_id="bench", title="Benchmark",
+                                            messages=[StoredMessage(r) for r in records])
+    
+    def decode_lazy_and_read_latest_page():
+        conversation = decode_lazy()
+        return [m.content for m in conversation.messages[-60:]]
+    
+    print(f"{'operation':>34} {'ms':>9} {'peak KiB':>10}")
+    for name, fn in [
+        ("encode: model_dump_json + loads", encode_roundtrip),
+        ("encode: to_record", encode_direct),
+        ("decode: validated models", decode_validated),
+        ("decode: lazy views", decode_lazy),
+        ("decode: lazy + read last 20", decode_lazy_and_read_latest_page),
+    ]:
+        elapsed_ms, peak_kib = _measure(fn, repeats)
+        print(f"{name:>34} {elapsed_ms:>9.2f} {peak_kib:>10.1f}")
+
+
+def bench_render(assessments: int = 1000, reruns: int = 5):
+    """Time re-rendering a 1,000 assessment history on each rerun, without and with the render cache."""
+    from models import AssessmentResult
+    from views import RenderCache, render_history
+    
+    conversation = _make_conversation()
+    for n in range(assessments):
+        conversation.add_message("user", f"Patient note #{n}: reports poor sleep and feeling hopeless lately.")
+        conversation.add_message("patient_info", PatientInfo(
+            age=30 + n % 40,
+            sleep_issues=True,
+            energy_level=EnergyLevel.low,
+            mood_symptoms=[MoodSymptom.sadness, MoodSymptom.emptiness],
+            hopelessness=n % 2 == 0,
+        ))
+        conversation.add_message("assistant", AssessmentResult(
+            score=n % 10,
+            severity_level="Low risk",
+            advice="Guidance. " * 80,
+            similar_cases=[
+                {"id": n * 5 + k, "user": f"user{k}", "label": "Ideation",
+                 "preview": "Similar post text. " * 10, "similarity_score": 0.8}
+                for k in range(5)
+            ],
+        ))
+    messages = conversation.messages
+    cache = RenderCache()
+    
+    def per_rerun(fn):
+        started = time.perf_counter()
+        for _ in range(reruns):
+            fn()
+        return (time.perf_counter() - started) * 1000 / reruns
+    
+    uncached_ms = per_rerun(lambda: render_history(messages, 0))
+    started = time.perf_counter()
+    render_history(messages, 0, cache)
+    first_ms = (time.perf_counter() - started) * 1000
+    cached_ms = per_rerun(lambda: render_history(messages, 0, cache))
+    
+    print(f"{'mode':>24} {'ms/rerun':>10}")
+    print(f"{'uncached':>24} {uncached_ms:>10.2f}")
+    print(f"{'cache: first render':>24} {first_ms:>10.2f}")
+    print(f"{'cache: later reruns':>24} {cached_ms:>10.2f}")
+    print(f"cache stats: {cache.stats()}")
+
+
+def bench_posts(copies: int = 40, top_k: int = 3, repeats: int = 200):
+    """Resident size of the post metadata as a list of dicts versus the columnar PostStore."""
+    from post_store import PostStore, clean_post_text, make_preview
+    import csv
+    
+    csv.field_size_limit(sys.maxsize)
+    with open("500_Reddit_users_posts_labels.csv", newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    
+    def build_dicts():
+        posts = []
+        for copy in range(copies):
+            for row in rows:
+                text = clean_post_text(row["Post"])
+                posts.append({"id": len(posts), "user": row["User"], "text": text,
+                              "label": row["Label"], "preview": make_preview(text)})
+        return posts
+    
+    tracemalloc.start()
+    posts = build_dicts()
+    dict_kib = tracemalloc.get_traced_memory()[0] / 1024
+    tracemalloc.stop()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        prefix = os.path.join(directory, "posts")
+        PostStore.write(prefix, posts).close()
+        del posts
+        
+        tracemalloc.start()
+        store = PostStore(prefix)
+        store_kib = tracemalloc.get_traced_memory()[0] / 1024
+        tracemalloc.stop()
+        
+        posts = build_dicts()
+        indices = list(range(0, len(store), max(1, len(store) // top_k)))[:top_k]
+        started = time.perf_counter()
+        for _ in range(repeats):
+            [dict(posts[i]) for i in indices]
+        dict_ms = (time.perf_counter() - started) * 1000 / repeats
+        started = time.perf_counter()
+        for _ in range(repeats):
+            [store.record(i) for i in indices]
+        store_ms = (time.perf_counter() - started) * 1000 / repeats
+        store.close()
+    
+    print(f"{len(rows) * copies} posts")
+    print(f"{'layout':>16} {'KiB':>10} {'top-k ms':>10}")
+    print(f"{'list of dicts':>16} {dict_kib:>10.1f} {dict_ms:>10.4f}")
+    print(f"{'PostStore':>16} {store_kib:>10.1f} {store_ms:>10.4f}")
+
+
+def _bench_encoder():
+    """MiniLM when ``BENCH_ENCODER=minilm``, otherwise the offline hashing encoder."""
+    if os.getenv("BENCH_ENCODER") == "minilm":
+        return None
+    from fakes import HashingEncoder
+    return HashingEncoder()
+
+
+def bench_retrieval(copies=(1, 10, 40), queries: int = 50, top_k: int = 3):
+    """Latency of dense, hybrid and prefilter retrieval as the corpus grows, and overlap with dense results."""
+    import csv
+    import random
+    from rag_system import RETRIEVAL_MODES, RedditRAG
+    
+    csv.field_size_limit(sys.maxsize)
+    with open("500_Reddit_users_posts_labels.csv", newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    rng = random.Random(3)
+    query_texts = []
+    for row in rng.sample(rows, queries):
+        words = row["Post"].split()
+        query_texts.append(" ".join(words[20:60] or words[:40]))
+    encoder = _bench_encoder()
+    
+    print(f"{'posts':>7} {'mode':>10} {'ms/query':>10} {'overlap@' + str(top_k):>11}")
+    for n_copies in copies:
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, "posts.csv")
+            with open(csv_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=["User", "Post", "Label"])
+                writer.writeheader()
+                for _ in range(n_copies):
+                    writer.writerows(rows)
+            
+            rag = RedditRAG(csv_path, model=encoder, data_dir=directory)
+            # Tiled copies of a post are the same case, so compare by original row
+            dense = [set(rag.rank(q, top_k, "dense")[0] % len(rows)) for q in query_texts]
+            for mode in RETRIEVAL_MODES:
+                started = time.perf_counter()
+                results = [rag.rank(q, top_k, mode)[0] for q in query_texts]
+                elapsed_ms = (time.perf_counter() - started) * 1000 / queries
+                overlap = sum(len(set(r % len(rows)) & d) / len(d) for r, d in zip(results, dense)) / queries
+                print(f"{len(rag.posts):>7} {mode:>10} {elapsed_ms:>10.2f} {overlap:>11.2f}")
+            rag.posts.close()
+
+
+def bench_neighbors(copies=(1, 10), lookups: int = 200, added: int = 100, top_k: int = 3):
+    """Graph build and incremental add times, and related-case lookups from the graph versus re-ranking the post text."""
+    import csv
+    import random
+    from neighbor_graph import NeighborGraph
+    from rag_system import RedditRAG
+    
+    csv.field_size_limit(sys.maxsize)
+    with open("500_Reddit_users_posts_labels.csv", newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    rng = random.Random(5)
+    encoder = _bench_encoder()
+    
+    print(f"{'posts':>7} {'build s':>8} {'add ' + str(added) + ' s':>9} {'graph ms':>9} {'re-rank ms':>11}")
+    for n_copies in copies:
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, "posts.csv")
+            with open(csv_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=["User", "Post", "Label"])
+                writer.writeheader()
+                for _ in range(n_copies):
+                    writer.writerows(rows)
+            
+            rag = RedditRAG(csv_path, model=encoder, data_dir=directory, neighbors=0)
+            started = time.perf_counter()
+            NeighborGraph.build(rag.embeddings, 10)
+            build_s = time.perf_counter() - started
+            rag.neighbor_count = 10
+            rag._load_or_create_neighbor_graph()
+            
+            started = time.perf_counter()
+            rag.add_posts([{"user": row["User"], "text": row["Post"], "label": row["Label"]} for row in rng.sample(rows, added)])
+            add_s = time.perf_counter() - started
+            
+            post_ids = [int(rag.posts.ids[i]) for i in rng.sample(range(len(rag.posts)), lookups)]
+            started = time.perf_counter()
+            for post_id in post_ids:
+                rag.neighbors_of(post_id, top_k)
+            graph_ms = (time.perf_counter() - started) * 1000 / lookups
+            rows_by_id = {int(post_id): row for row, post_id in enumerate(rag.posts.ids)}
+            started = time.perf_counter()
+            for post_id in post_ids:
+                rag.find_similar_posts(rag.posts.text(rows_by_id[post_id]), top_k + 1)
+            rerank_ms = (time.perf_counter() - started) * 1000 / lookups
+            print(f"{len(rag.posts):>7} {build_s:>8.2f} {add_s:>9.2f} {graph_ms:>9.3f} {rerank_ms:>11.2f}")
+            rag.posts.close()
+
+
+def bench_shards(rows: int = 200_000, dimensions: int = 384, shard_counts=(1, 2, 4, 8), worker_counts=(1, 2, 4),
+                 queries: int = 100, clients: int = 8, top_k: int = 3):
+    """Query latency and throughput of sharded search as shards and worker processes increase."""
+    from concurrent.futures import ThreadPoolExecutor
+    from rag_system import _top_indices
+    from vector_shards import ShardedIndex, row_batches, write_shards
+    
+    rng = np.random.default_rng(5)
+    embeddings = rng.standard_normal((rows, dimensions), dtype=np.float32)
+    query_vectors = rng.standard_normal((queries, dimensions), dtype=np.float32)
+    print(f"{rows} x {dimensions} embeddings, {os.cpu_count()} cores, {clients} concurrent clients for throughput")
+    
+    normalised = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    started = time.perf_counter()
+    for query in query_vectors:
+        _top_indices(normalised @ query, top_k)
+    baseline_ms = (time.perf_counter() - started) * 1000 / queries
+    print(f"in-process: {baseline_ms:.2f} ms/query")
+    
+    print(f"{'shards':>7} {'workers':>8} {'ms/query':>9} {'p95 ms':>8} {'queries/s':>10}")
+    for shards in shard_counts:
+        with tempfile.TemporaryDirectory() as directory:
+            write_shards(row_batches(embeddings), rows, directory, shards)
+            for workers in worker_counts:
+                if workers > shards:
+                    continue
+                index = ShardedIndex(directory, workers=workers)
+                # First queries spawn the workers and map the shards
+                for query in query_vectors[:workers * 2]:
+                    index.search(query, top_k)
+                
+                latencies = []
+                for query in query_vectors:
+                    started = time.perf_counter()
+                    index.search(query, top_k)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=clients) as pool:
+                    list(pool.map(lambda query: index.search(query, top_k), query_vectors))
+                throughput = queries / (time.perf_counter() - started)
+                
+                latencies.sort()
+                print(f"{shards:>7} {workers:>8} {sum(latencies) / queries:>9.2f} "
+                      f"{latencies[int(0.95 * (queries - 1))]:>8.2f} {throughput:>10.1f}")
+                index.close()
+
+
+BENCHMARKS = {
+    "save": bench_save,
+    "load": bench_load,
+    "backends": bench_backends,
+    "codec": bench_codec,
+    "render": bench_render,
+    "posts": bench_posts,
+    "retrieval": bench_retrieval,
+    "shards": bench_shards,
+    "neighbors": bench_neighbors,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"\n=== {name} ===")
+        BENCHMARKS[name]()
@@ -1,110 +1,1318 @@
+import gzip
 import json
 import os
-from datetime import datetime
-from typing import Optional
-from pymongo import MongoClient
-from models import Conversation, ChatMessage, PatientInfo
+import queue
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
 
-class Database:
-    """MongoDB storage for mental health conversation data."""
+import numpy as np
+from bson import Binary
+from pymongo import ASCENDING, DESCENDING, DeleteMany, MongoClient, ReplaceOne
+from pymongo.errors import ConnectionFailure, DuplicateKeyError
+from models import AssessmentResult, Conversation, ConversationRollups, ChatMessage, PatientInfo, StoredMessage, conversation_key
+from post_store import make_preview
+
+# Document id used before conversations were keyed by counselor and session
+LEGACY_CONVERSATION_ID = "global_conversation"
+
+# Notes per gzip member of an archived segment, so paging inflates one member rather than the segment
+ARCHIVE_PAGE_ASSESSMENTS = 20
+
+
+class Database(ABC):
+    """Storage interface for mental health conversation data.
     
-    def __init__(self,):
-        try:
-            MONGODB_URI = os.getenv("MONGODB_URI")
-            MONGODB_DATABASE = os.getenv("MONGODB_DATABASE")
-            MONGODB_COLLECTION = os.getenv("MONGODB_COLLECTION")
-            
-            self.client = MongoClient(MONGODB_URI)
-            self.db = self.client[MONGODB_DATABASE]
-            self.conversations = self.db[MONGODB_COLLECTION]
-            self.client.admin.command('ping')
-        except Exception:
-            self.client = None
-            self.db = None
-            self.conversations = None
+    Each counselor session has a small metadata record, keyed by
+    ``"<counselor_id>:<session_id>"``, and messages are appended separately,
+    keyed by ``(conversation_id, seq)``, so each save only writes the
+    messages added since the previous one. Backends implement the storage
+    primitives below (abstract, so an incomplete backend fails when it is
+    created); serialisation, paging and save bookkeeping are shared.
     
-    def save_conversation(self, conversation: Conversation) -> bool:
-        """Save conversation to MongoDB."""
-        if self.conversations is None:
-            return False
-            
-        try:
-            data = {
-                "_id": "global_conversation",
+    With a ``note_encoder`` attached, every note written is embedded once
+    and its vector stored next to the messages, for ``history_index``.
+    
+    ``archive_conversation`` moves a conversation's oldest messages into
+    gzip-compressed JSONL segments kept apart from the hot messages, with a
+    stub per segment (sequence range, counts, dates). Loading skips archived
+    messages; ``load_older_messages`` reads a segment back when paging
+    reaches it. Each segment is a series of gzip members of
+    ``ARCHIVE_PAGE_ASSESSMENTS`` notes, listed in the stub's ``pages``, so
+    a page of history inflates only the members it needs.
+    
+    A page of history starts earlier than its first note when one of its
+    assessments names a note before it (see ``AssessmentResult.note_seq``),
+    so an answer is loaded together with its note.
+    """
+    
+    def __init__(self):
+        self.last_error: Optional[str] = None
+        self.note_encoder = None
+        self._note_listeners: List[Callable[[Dict], None]] = []
+    
+    @property
+    @abstractmethod
+    def available(self) -> bool:
+        """True if the backend is connected and persistence is enabled."""
+        raise NotImplementedError
+    
+    def _disable(self, error: Exception):
+        """Record why the backend is unusable and say so."""
+        self.last_error = str(error)
+        print(f"Warning: {type(self).__name__} unavailable, conversations will not be saved: {error}")
+    
+    # Backend primitives
+    
+    @abstractmethod
+    def write_batches(self, batches: List[Dict]):
+        """Apply prepared save batches; errors propagate to the caller."""
+        raise NotImplementedError
+    
+    def is_transient_error(self, error: Exception) -> bool:
+        """True if a failed write is worth retrying."""
+        return False
+    
+    @abstractmethod
+    def _find_conversation(self, conversation_id: str) -> Optional[Dict]:
+        """Metadata of one conversation, with ``created_at``/``updated_at`` as datetimes."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def _page_start(self, conversation_id: str, before_seq: Optional[int], assessments: int) -> int:
+        """Sequence number where the ``assessments`` most recent assessments before ``before_seq`` begin."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def _find_messages(self, conversation_id: str, start_seq: int, before_seq: Optional[int] = None) -> List[Dict]:
+        """Message records with ``start_seq <= seq < before_seq`` in order."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def list_recent_conversations(self, counselor_id: str, limit: int = 10) -> List[Dict]:
+        """Metadata of a counselor's most recently updated conversations, newest first."""
+        raise NotImplementedError
+    
+    def migrate_global_conversation(self, counselor_id: str, session_id: str) -> bool:
+        """Move a legacy single global conversation under a counselor's session, if the backend has one."""
+        return False
+    
+    @abstractmethod
+    def conversation_ids(self, counselor_id: Optional[str] = None) -> List[str]:
+        raise NotImplementedError
+    
+    @abstractmethod
+    def _first_seq_since(self, conversation_id: str, since: datetime) -> Optional[int]:
+        """Sequence number of the first hot user message at or after ``since``."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def _archive_index(self, conversation_id: str) -> List[Dict]:
+        """Stubs of the conversation's archived segments, oldest first."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def _store_segment(self, conversation_id: str, stub: Dict, data: bytes):
+        """Save a segment and drop its messages (``stub["first_seq"]`` up to ``stub["end_seq"]``) from the hot store."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def _read_segment(self, conversation_id: str, first_seq: int) -> bytes:
+        raise NotImplementedError
+    
+    @abstractmethod
+    def find_note_vectors(self, counselor_id: str) -> List[Dict]:
+        """Stored note vectors of a counselor: conversation_id, seq, vector (float32 bytes), preview, timestamp."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def count_note_vectors(self, counselor_id: str) -> int:
+        raise NotImplementedError
+    
+    @abstractmethod
+    def assessment_dashboard(self, counselor_id: str) -> Dict:
+        """Sum the stored rollups of a counselor's conversations inside the database.
+        
+        Returns ``conversations``, ``assessments`` and the ``band_counts``,
+        ``label_counts`` and ``daily_assessments`` totals.
+        """
+        raise NotImplementedError
+    
+    # Shared logic
+    
+    def _message_to_record(self, msg: ChatMessage, conversation_id: str, seq: int) -> Dict:
+        """Serialise a single message for the messages store."""
+        record = {
+            "conversation_id": conversation_id,
+            "seq": seq,
+            "role": msg.role,
+            "timestamp": msg.timestamp,
+        }
+        
+        if msg.role == "patient_info" and isinstance(msg.content, PatientInfo):
+            record["content"] = msg.content.to_record()
+            record["content_type"] = "patient_info"
+        elif msg.role == "assistant" and isinstance(msg.content, AssessmentResult):
+            record["content"] = msg.content.to_record()
+            record["content_type"] = "assessment"
+        else:
+            record["content"] = str(msg.content)
+            record["content_type"] = "text"
+        
+        return record
+    
+    @staticmethod
+    def _same_message(stored: Dict, record: Dict) -> bool:
+        """Whether a stored record is ``record`` written earlier, e.g. by a retried save."""
+        timestamp = stored["timestamp"]
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        # MongoDB keeps milliseconds
+        return (stored["role"] == record["role"]
+                and timestamp.replace(microsecond=timestamp.microsecond // 1000)
+                == record["timestamp"].replace(microsecond=record["timestamp"].microsecond // 1000)
+                and stored["content"] == record["content"])
+    
+    def _place_batch(self, batch: Dict, next_seq: Optional[int], stored: Optional[Dict],
+                     stored_records: Dict[int, Dict]) -> Optional[int]:
+        """Where ``batch``'s messages go, given the stored counter; returns the shift to apply, or None if none.
+        
+        ``next_seq`` is the stored ``message_count`` (the next free sequence
+        number), ``stored`` the stored metadata and ``stored_records`` the
+        stored messages at the batch's sequence numbers below ``next_seq``.
+        A batch computed from a conversation another writer has appended to
+        since it was loaded would reuse their sequence numbers; it is moved
+        to the end instead of overwriting them.
+        """
+        records = batch["messages"]
+        if batch["truncate_from"] is not None or next_seq is None or not records:
+            return None
+        clash = any(
+            record["seq"] in stored_records and not self._same_message(stored_records[record["seq"]], record)
+            for record in records
+        )
+        return next_seq - records[0]["seq"] if clash else None
+    
+    def _shift_batch(self, batch: Dict, shift: int, stored: Dict):
+        """Renumber ``batch``'s messages by ``shift`` and merge its metadata into the stored metadata."""
+        first = batch["messages"][0]["seq"]
+        for record in batch["messages"]:
+            record["seq"] += shift
+            content = record["content"]
+            # A note's assessment saved with it points at the note's new position
+            if record["content_type"] == "assessment" and content.get("note_seq") is not None and content["note_seq"] >= first:
+                record["content"] = dict(content, note_seq=content["note_seq"] + shift)
+        for record in batch.get("note_vectors", []):
+            record["seq"] += shift
+        
+        rollups = ConversationRollups.from_record(stored["rollups"]) if stored.get("rollups") else ConversationRollups()
+        metadata = dict(batch["metadata"])
+        metadata["total_assessments"] = stored.get("total_assessments", 0)
+        metadata["last_phq_score"] = stored.get("last_phq_score")
+        for message in map(self._record_to_message, batch["messages"]):
+            metadata["total_assessments"] += message.role == "user"
+            score = self._record_rollups(rollups, message)
+            if score is not None:
+                metadata["last_phq_score"] = score
+        metadata["rollups"] = rollups.to_record()
+        metadata["id"] = stored.get("id") or metadata["id"]
+        metadata["title"] = stored.get("title") or metadata["title"]
+        metadata["message_count"] = batch["messages"][-1]["seq"] + 1
+        batch["metadata"] = metadata
+        batch["seq_shift"] = batch.get("seq_shift", 0) + shift
+        print(f"⚠️ {batch['conversation_id']} was saved by another writer; appended this save's "
+              f"{len(batch['messages'])} messages after theirs")
+    
+    def _metadata_to_write(self, batch: Dict, next_seq: Optional[int]) -> Optional[Dict]:
+        """``batch``'s metadata, or None if a newer save (which already counted these messages) wrote it."""
+        if batch["truncate_from"] is None and next_seq is not None and batch["metadata"]["message_count"] < next_seq:
+            return None
+        return batch["metadata"]
+    
+    def add_note_listener(self, listener: Callable[[Dict], None]):
+        """Call ``listener`` with every save batch once it has been written."""
+        self._note_listeners.append(listener)
+    
+    def _note_vectors(self, batch: Dict) -> List[Dict]:
+        """Vectors of the notes in a save batch, encoded once and kept on the batch for retries."""
+        if self.note_encoder is None:
+            return []
+        if "note_vectors" not in batch:
+            notes = [record for record in batch["messages"] if record["role"] == "user"]
+            if not notes:
+                batch["note_vectors"] = []
+                return []
+            try:
+                embeddings = np.asarray(self.note_encoder.encode([record["content"] for record in notes]), dtype=np.float32)
+            except Exception as e:
+                # The messages still get saved; these notes are just not searchable
+                print(f"Warning: could not embed notes of {batch['conversation_id']}: {e}")
+                return []
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.where(norms == 0, 1, norms)
+            batch["note_vectors"] = [
+                {
+                    "conversation_id": batch["conversation_id"],
+                    "counselor_id": batch["metadata"]["counselor_id"],
+                    "seq": record["seq"],
+                    "vector": vector.tobytes(),
+                    "preview": make_preview(record["content"]),
+                    "timestamp": record["timestamp"],
+                }
+                for record, vector in zip(notes, embeddings)
+            ]
+        return batch["note_vectors"]
+    
+    def _notify_written(self, batches: List[Dict]):
+        for batch in batches:
+            for listener in self._note_listeners:
+                try:
+                    listener(batch)
+                except Exception as e:
+                    print(f"Warning: note listener failed: {e}")
+    
+    def _record_to_message(self, record: Dict) -> StoredMessage:
+        """Wrap a stored record; content is decoded only when accessed."""
+        return StoredMessage(record)
+    
+    def prepare_save(self, conversation: Conversation) -> Dict:
+        """Describe the writes needed to persist ``conversation`` without performing them.
+        
+        The returned batch holds the sequence number to truncate from (if any),
+        the records of messages added since the last save and the metadata.
+        """
+        offset = conversation._seq_offset
+        persisted = conversation._persisted_count
+        total = len(conversation.messages)
+        
+        # History was cleared or truncated since the last save
+        truncate_from = conversation._truncate_from
+        if truncate_from is None and total < persisted:
+            truncate_from = offset + total
+        if truncate_from is not None:
+            persisted = min(persisted, max(truncate_from - offset, 0))
+        
+        return {
+            "conversation_id": conversation.key,
+            "truncate_from": truncate_from,
+            "messages": [
+                self._message_to_record(msg, conversation.key, offset + index)
+                for index, msg in enumerate(conversation.messages[persisted:], start=persisted)
+            ],
+            "metadata": {
                 "id": conversation.id,
+                "counselor_id": conversation.counselor_id,
+                "session_id": conversation.session_id,
                 "title": conversation.title,
-                "created_at": conversation.created_at,
                 "updated_at": datetime.utcnow(),
                 "total_assessments": conversation.total_assessments,
                 "last_phq_score": conversation.last_phq_score,
-                "messages": []
-            }
-            
-            for msg in conversation.messages:
-                msg_data = {
-                    "role": msg.role,
-                    "timestamp": msg.timestamp,
-                }
-                
-                if msg.role == "patient_info" and isinstance(msg.content, PatientInfo):
-                    msg_data["content"] = json.loads(msg.content.model_dump_json())
-                    msg_data["content_type"] = "patient_info"
-                else:
-                    msg_data["content"] = str(msg.content)
-                    msg_data["content_type"] = "text"
-                
-                data["messages"].append(msg_data)
-            
-            self.conversations.replace_one(
-                {"_id": "global_conversation"}, 
-                data, 
-                upsert=True
-            )
-            
+                "message_count": offset + total,
+                "rollups": conversation.rollups.to_record(),
+            },
+            "created_at": conversation.created_at,
+        }
+    
+    def mark_saved(self, conversation: Conversation):
+        """Record that every loaded message of ``conversation`` has been handed to storage."""
+        conversation._persisted_count = len(conversation.messages)
+        conversation._truncate_from = None
+    
+    def apply_shift(self, conversation: Conversation, shift: int, metadata: Dict):
+        """Follow a save that storage moved ``shift`` places on, after another writer's messages.
+        
+        Later saves continue after the other writer's messages, and the
+        counters and rollups become the stored ones (``metadata``) plus the
+        messages not saved yet. The loaded messages keep their places;
+        reload the conversation to see the other writer's.
+        """
+        conversation._seq_offset += shift
+        rollups = ConversationRollups.from_record(metadata["rollups"])
+        total_assessments, last_score = metadata["total_assessments"], metadata["last_phq_score"]
+        for message in conversation.messages[conversation._persisted_count:]:
+            total_assessments += message.role == "user"
+            score = self._record_rollups(rollups, message)
+            if score is not None:
+                last_score = score
+        conversation.rollups = rollups
+        conversation.total_assessments = total_assessments
+        conversation.last_phq_score = last_score
+    
+    def save_conversation(self, conversation: Conversation) -> bool:
+        """Persist messages added since the last save and refresh the metadata."""
+        if not self.available:
+            return False
+        
+        try:
+            batch = self.prepare_save(conversation)
+            self.write_batches([batch])
+            self.mark_saved(conversation)
+            if batch.get("seq_shift"):
+                self.apply_shift(conversation, batch["seq_shift"], batch["metadata"])
             return True
-            
-        except Exception:
+        
+        except Exception as e:
+            print(f"Error saving conversation {conversation.key}: {e}")
             return False
     
-    def load_conversation(self) -> Optional[Conversation]:
-        """Load conversation from MongoDB."""
-        if self.conversations is None:
+    def load_conversation(self, counselor_id: str, session_id: str, assessments: Optional[int] = None) -> Optional[Conversation]:
+        """Load a counselor's session.
+        
+        Only the ``assessments`` most recent assessments are loaded when given;
+        older ones can be fetched later with ``load_older_messages``.
+        """
+        if not self.available:
             return None
-            
+        
         try:
-            data = self.conversations.find_one({"_id": "global_conversation"})
+            key = conversation_key(counselor_id, session_id)
+            data = self._find_conversation(key)
             if not data:
                 return None
             
-            messages = []
-            for msg_data in data.get("messages", []):
-                content = msg_data["content"]
-                
-                if msg_data.get("content_type") == "patient_info":
-                    try:
-                        content = PatientInfo(**content)
-                    except Exception:
-                        content = str(content)
-                
-                message = ChatMessage(
-                    role=msg_data["role"],
-                    content=content,
-                    timestamp=msg_data["timestamp"]
-                )
-                messages.append(message)
+            archived_until = self.archived_until(key)
+            start_seq = self._page_start(key, None, assessments) if assessments else 0
+            start_seq = max(start_seq, archived_until)
+            if data.get("message_count") is not None:
+                start_seq = min(start_seq, data["message_count"])
+            # Messages another writer stored after ``data`` was read belong to a newer save; leaving them
+            # out keeps the counters consistent, and the next save is placed after them
+            start_seq, records = self._find_page(key, start_seq, data.get("message_count"), archived_until)
+            messages = [self._record_to_message(record) for record in records]
+            
+            if "rollups" in data:
+                rollups = ConversationRollups.from_record(data["rollups"])
+            else:
+                rollups = self._backfill_rollups(key)
             
-            conversation = Conversation(
+            # Stored metadata is trusted, so skip re-validating every loaded message
+            conversation = Conversation.model_construct(
                 id=data.get("id"),
-                session_id="global",
+                counselor_id=counselor_id,
+                session_id=session_id,
                 title=data.get("title", "Mental Health Conversations"),
                 messages=messages,
                 created_at=data["created_at"],
                 updated_at=data["updated_at"],
                 total_assessments=data.get("total_assessments", 0),
-                last_phq_score=data.get("last_phq_score")
+                last_phq_score=data.get("last_phq_score"),
+                rollups=rollups
             )
+            conversation._seq_offset = start_seq
+            conversation._persisted_count = len(messages)
             
             return conversation
+        
+        except Exception as e:
+            print(f"Error loading conversation {counselor_id}:{session_id}: {e}")
+            return None
+    
+    @staticmethod
+    def _record_rollups(rollups: ConversationRollups, message) -> Optional[int]:
+        """Add one stored message to ``rollups``; returns the score it carries, if any."""
+        if message.role == "user":
+            rollups.record_user_message(message.timestamp)
+        elif message.role == "patient_info" and isinstance(message.content, PatientInfo):
+            rollups.record_patient_info(message.content)
+        elif message.role == "assistant" and isinstance(message.content, AssessmentResult):
+            result = message.content
+            if result.error is None:
+                rollups.record_score(result.score, [case.label for case in result.similar_cases or []], message.timestamp)
+                return result.score
+        elif message.role == "assistant":
+            score_match = re.search(r'\*\*Score: (\d+)/10\*\*', str(message.content))
+            if score_match:
+                labels = re.findall(r'Case \d+ - (\w+) Risk', str(message.content))
+                rollups.record_score(int(score_match.group(1)), labels, message.timestamp)
+                return int(score_match.group(1))
+        return None
+    
+    def _backfill_rollups(self, conversation_id: str) -> ConversationRollups:
+        """Build rollups once for a conversation saved before they existed.
+        
+        Scores of legacy markdown assistant messages are recovered with a
+        regex here, once; the result is persisted with the next save.
+        """
+        rollups = ConversationRollups()
+        for message in map(self._record_to_message, self._find_messages(conversation_id, 0)):
+            self._record_rollups(rollups, message)
+        return rollups
+    
+    def load_older_messages(self, conversation: Conversation, assessments: int) -> int:
+        """Prepend the previous page of ``assessments`` assessments and return how many messages were loaded."""
+        if not self.available or not conversation.has_older_messages:
+            return 0
+        
+        try:
+            before_seq = conversation._seq_offset
+            archive = self._archive_index(conversation.key)
+            archived_until = archive[-1]["end_seq"] if archive else 0
+            # Paging has reached the archive: read the page from the segment holding the previous message
+            segment = next((stub for stub in archive if stub["first_seq"] < before_seq <= stub["end_seq"]), None)
+            if segment is not None:
+                records = self._archived_page(conversation.key, segment, before_seq, assessments)
+            else:
+                # Gaps in the archive index fall back to whatever the hot store still holds
+                floor = archived_until if before_seq > archived_until else 0
+                start_seq = max(self._page_start(conversation.key, before_seq, assessments), floor)
+                _, records = self._find_page(conversation.key, start_seq, before_seq, floor)
+            messages = [self._record_to_message(record) for record in records]
+            conversation.prepend_messages(messages)
+            return len(messages)
+        
+        except Exception as e:
+            print(f"Error loading older messages of {conversation.key}: {e}")
+            return 0
+    
+    @staticmethod
+    def _named_notes_start(records: List[Dict], start_seq: int) -> int:
+        """``start_seq``, or the earliest note before it that an assessment in ``records`` names."""
+        for record in records:
+            if record["role"] == "assistant":
+                note_seq = getattr(StoredMessage(record).content, "note_seq", None)
+                if note_seq is not None and note_seq < start_seq:
+                    start_seq = note_seq
+        return start_seq
+    
+    def _find_page(self, conversation_id: str, start_seq: int, before_seq: Optional[int], floor: int):
+        """``(start, records)`` from ``start_seq`` up to ``before_seq``, starting earlier (not before ``floor``) to take in named notes."""
+        records = added = self._find_messages(conversation_id, start_seq, before_seq)
+        while added:
+            earlier = max(self._named_notes_start(added, start_seq), floor)
+            if earlier >= start_seq:
+                break
+            added = self._find_messages(conversation_id, earlier, start_seq)
+            records = added + records
+            start_seq = earlier
+        return start_seq, records
+    
+    def _archived_page(self, conversation_id: str, stub: Dict, before_seq: int, assessments: int) -> List[Dict]:
+        """Records of the ``assessments`` notes before ``before_seq`` in an archived segment, and the notes they name.
+        
+        Only the gzip members holding them are inflated; segments archived
+        before members were recorded are one member.
+        """
+        data = self._read_segment(conversation_id, stub["first_seq"])
+        pages = stub.get("pages") or [[stub["first_seq"], 0]]
+        ends = [page[1] for page in pages[1:]] + [len(data)]
+        
+        records: List[Dict] = []
+        index = max(i for i, page in enumerate(pages) if page[0] < before_seq)
+        while True:
+            member = _inflate(data[pages[index][1]:ends[index]])
+            records = [record for record in member if record["seq"] < before_seq] + records
+            notes = [record["seq"] for record in records if record["role"] == "user"]
+            start_seq = notes[-assessments] if len(notes) >= assessments else pages[index][0]
+            # Notes named by assessments that the earlier start takes in are needed too
+            while True:
+                earlier = self._named_notes_start([record for record in records if record["seq"] >= start_seq], start_seq)
+                if earlier >= start_seq:
+                    break
+                start_seq = earlier
+            if index == 0 or (len(notes) >= assessments and start_seq >= pages[index][0]):
+                break
+            index -= 1
+        return [record for record in records if record["seq"] >= start_seq]
+    
+    def archived_until(self, conversation_id: str) -> int:
+        """First sequence number still in the hot store; everything before it is archived."""
+        index = self._archive_index(conversation_id)
+        return index[-1]["end_seq"] if index else 0
+    
+    def archive_conversation(
+        self,
+        conversation_id: str,
+        keep_assessments: Optional[int] = None,
+        older_than: Optional[timedelta] = None,
+    ) -> Optional[Dict]:
+        """Archive the messages before the ``keep_assessments`` most recent notes, or older than ``older_than``.
+        
+        Whichever rule archives more wins. The cut always falls on a note, so
+        an assessment is never split across tiers. Returns the new segment's
+        stub, or None if there was nothing to archive.
+        """
+        start = self.archived_until(conversation_id)
+        cut = start
+        if keep_assessments:
+            # 0 means fewer notes than that are hot
+            cut = max(cut, self._page_start(conversation_id, None, keep_assessments))
+        if older_than is not None:
+            first_recent = self._first_seq_since(conversation_id, datetime.utcnow() - older_than)
+            if first_recent is None:
+                metadata = self._find_conversation(conversation_id) or {}
+                first_recent = metadata.get("message_count", start)
+            cut = max(cut, first_recent)
+        if cut <= start:
+            return None
+        
+        records = self._find_messages(conversation_id, start, cut)
+        if not records:
+            return None
+        # One gzip member per page of notes; concatenated members still read as a single gzip stream
+        pages, members = [], []
+        notes = 0
+        for record in records:
+            notes += record["role"] == "user"
+            if not members or (record["role"] == "user" and notes > ARCHIVE_PAGE_ASSESSMENTS):
+                pages.append([record["seq"]])
+                members.append([])
+                notes = int(record["role"] == "user")
+            record = {key: value for key, value in record.items() if key != "_id"}
+            members[-1].append(json.dumps(record, default=_json_default))
+        compressed = [gzip.compress(("\n".join(lines) + "\n").encode("utf-8")) for lines in members]
+        offset = 0
+        for page, member in zip(pages, compressed):
+            page.append(offset)
+            offset += len(member)
+        data = b"".join(compressed)
+        
+        timestamps = [StoredMessage(record).timestamp for record in records]
+        stub = {
+            "first_seq": start,
+            "end_seq": cut,
+            "messages": len(records),
+            "assessments": sum(record["role"] == "user" for record in records),
+            "first_timestamp": min(timestamps),
+            "last_timestamp": max(timestamps),
+            "bytes": len(data),
+            "pages": pages,
+        }
+        self._store_segment(conversation_id, stub, data)
+        return stub
+    
+    def load_archived_messages(self, conversation_id: str, first_seq: int, before_seq: Optional[int] = None) -> List[StoredMessage]:
+        """The messages of the archived segment starting at ``first_seq`` (only those before ``before_seq`` if set)."""
+        records = _inflate(self._read_segment(conversation_id, first_seq))
+        return [self._record_to_message(record) for record in records if before_seq is None or record["seq"] < before_seq]
+
+
+def _inflate(data: bytes) -> List[Dict]:
+    """Records of gzip-compressed JSONL, one or more members."""
+    text = gzip.decompress(data).decode("utf-8")
+    return [json.loads(line) for line in text.splitlines() if line]
+
+
+# MongoClient instances are thread-safe connection pools; share one per configuration per process
+_MONGO_CLIENTS: Dict[tuple, MongoClient] = {}
+_MONGO_CLIENTS_LOCK = threading.Lock()
+
+
+def get_mongo_client(uri: Optional[str], max_pool_size: int, timeout_ms: int) -> MongoClient:
+    """Return the process-wide client for this configuration, connecting (and pinging) once."""
+    key = (uri, max_pool_size, timeout_ms)
+    with _MONGO_CLIENTS_LOCK:
+        client = _MONGO_CLIENTS.get(key)
+        if client is None:
+            client = MongoClient(
+                uri,
+                maxPoolSize=max_pool_size,
+                serverSelectionTimeoutMS=timeout_ms,
+                connectTimeoutMS=timeout_ms,
+                socketTimeoutMS=timeout_ms,
+            )
+            client.admin.command('ping')
+            _MONGO_CLIENTS[key] = client
+        return client
+
+
+class MongoDatabase(Database):
+    """MongoDB backend sharing one pooled client per process.
+    
+    Both collections can be sharded on a hashed ``_id`` / ``conversation_id``.
+    """
+    
+    def __init__(
+        self,
+        client: Optional[MongoClient] = None,
+        max_pool_size: Optional[int] = None,
+        timeout_ms: Optional[int] = None,
+    ):
+        super().__init__()
+        self.client = None
+        self.db = None
+        self.conversations = None
+        self.messages = None
+        
+        try:
+            MONGODB_URI = os.getenv("MONGODB_URI")
+            MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "mental_health")
+            MONGODB_COLLECTION = os.getenv("MONGODB_COLLECTION", "conversations")
+            
+            if client is None:
+                client = get_mongo_client(
+                    MONGODB_URI,
+                    max_pool_size or int(os.getenv("MONGODB_MAX_POOL_SIZE", "50")),
+                    timeout_ms or int(os.getenv("MONGODB_TIMEOUT_MS", "5000")),
+                )
+            
+            self.client = client
+            self.db = self.client[MONGODB_DATABASE]
+            self.conversations = self.db[MONGODB_COLLECTION]
+            self.messages = self.db[f"{MONGODB_COLLECTION}_messages"]
+            self.note_vectors = self.db[f"{MONGODB_COLLECTION}_note_vectors"]
+            self.archive = self.db[f"{MONGODB_COLLECTION}_archive"]
+            self.messages.create_index(
+                [("conversation_id", ASCENDING), ("seq", ASCENDING)],
+                unique=True
+            )
+            self.messages.create_index(
+                [("conversation_id", ASCENDING), ("role", ASCENDING), ("seq", ASCENDING)]
+            )
+            self.archive.create_index([("conversation_id", ASCENDING), ("end_seq", ASCENDING)])
+            self.note_vectors.create_index(
+                [("conversation_id", ASCENDING), ("seq", ASCENDING)],
+                unique=True
+            )
+            self.note_vectors.create_index([("counselor_id", ASCENDING)])
+            self.conversations.create_index([("session_id", ASCENDING)])
+            self.conversations.create_index([("updated_at", DESCENDING)])
+            self.conversations.create_index([("counselor_id", ASCENDING), ("updated_at", DESCENDING)])
+        except Exception as e:
+            self.conversations = None
+            self.messages = None
+            self._disable(e)
+    
+    @property
+    def available(self) -> bool:
+        return self.conversations is not None
+    
+    def write_batches(self, batches: List[Dict]):
+        """Apply prepared save batches with one bulk_write per message collection.
+        
+        Each batch first claims its sequence numbers on the conversation
+        document, with an update conditional on the ``message_count`` it
+        read (``_claim``), so writers in other processes cannot take the
+        same numbers. Messages are then upserted by ``(conversation_id, seq)``
+        so a batch can be retried safely after a partial failure.
+        """
+        message_ops = []
+        vector_ops = []
+        archive_ops = []
+        
+        for batch in batches:
+            conversation_id = batch["conversation_id"]
+            self._claim(batch)
+            if batch["truncate_from"] is not None:
+                truncated = {"conversation_id": conversation_id, "seq": {"$gte": batch["truncate_from"]}}
+                message_ops.append(DeleteMany(truncated))
+                vector_ops.append(DeleteMany(truncated))
+                # Clearing the history also drops archived segments past the cut
+                archive_ops.append(DeleteMany({"conversation_id": conversation_id, "end_seq": {"$gt": batch["truncate_from"]}}))
+            for record in batch["messages"]:
+                message_ops.append(ReplaceOne(
+                    {"conversation_id": conversation_id, "seq": record["seq"]},
+                    record,
+                    upsert=True
+                ))
+            for record in self._note_vectors(batch):
+                vector_ops.append(ReplaceOne(
+                    {"conversation_id": conversation_id, "seq": record["seq"]},
+                    record,
+                    upsert=True
+                ))
+        
+        if message_ops:
+            self.messages.bulk_write(message_ops, ordered=True)
+        if vector_ops:
+            self.note_vectors.bulk_write(vector_ops, ordered=True)
+        if archive_ops:
+            self.archive.bulk_write(archive_ops, ordered=False)
+        self._notify_written(batches)
+    
+    def _claim(self, batch: Dict, attempts: int = 20):
+        """Place ``batch`` after the stored messages and write its metadata, retrying when another writer gets there first."""
+        conversation_id = batch["conversation_id"]
+        for _ in range(attempts):
+            stored = self.conversations.find_one({"_id": conversation_id}) or {}
+            next_seq = stored.get("message_count")
+            if batch["messages"] and next_seq is not None and batch["messages"][0]["seq"] < next_seq:
+                stored_records = {
+                    record["seq"]: record for record in self.messages.find(
+                        {"conversation_id": conversation_id, "seq": {"$gte": batch["messages"][0]["seq"], "$lt": next_seq}},
+                        {"seq": 1, "role": 1, "timestamp": 1, "content": 1}
+                    )
+                }
+                shift = self._place_batch(batch, next_seq, stored, stored_records)
+                if shift is not None:
+                    self._shift_batch(batch, shift, stored)
+            
+            metadata = self._metadata_to_write(batch, next_seq)
+            if metadata is None:
+                return
+            update = {"$set": metadata, "$setOnInsert": {"created_at": batch["created_at"]}}
+            if batch["truncate_from"] is not None:
+                update["$pull"] = {"archive": {"end_seq": {"$gt": batch["truncate_from"]}}}
+            try:
+                # Matches only if no other writer has moved message_count since it was read
+                result = self.conversations.update_one({"_id": conversation_id, "message_count": next_seq}, update, upsert=True)
+            except DuplicateKeyError:
+                continue
+            if result.matched_count or result.upserted_id is not None:
+                return
+        raise RuntimeError(f"could not claim sequence numbers for {conversation_id}: too many concurrent writers")
+    
+    def is_transient_error(self, error: Exception) -> bool:
+        return isinstance(error, ConnectionFailure)
+    
+    def _find_conversation(self, conversation_id: str) -> Optional[Dict]:
+        return self.conversations.find_one({"_id": conversation_id})
+    
+    def _page_start(self, conversation_id: str, before_seq: Optional[int], assessments: int) -> int:
+        query = {"conversation_id": conversation_id, "role": "user"}
+        if before_seq is not None:
+            query["seq"] = {"$lt": before_seq}
+        
+        cursor = (
+            self.messages.find(query, {"seq": 1})
+            .sort("seq", DESCENDING)
+            .skip(assessments - 1)
+            .limit(1)
+        )
+        first = next(iter(cursor), None)
+        return first["seq"] if first else 0
+    
+    def _find_messages(self, conversation_id: str, start_seq: int, before_seq: Optional[int] = None) -> List[Dict]:
+        seq_range = {"$gte": start_seq}
+        if before_seq is not None:
+            seq_range["$lt"] = before_seq
+        
+        return list(self.messages.find({"conversation_id": conversation_id, "seq": seq_range}).sort("seq", ASCENDING))
+    
+    def list_recent_conversations(self, counselor_id: str, limit: int = 10) -> List[Dict]:
+        if not self.available:
+            return []
+        
+        try:
+            cursor = (
+                self.conversations.find(
+                    {"counselor_id": counselor_id},
+                    {"session_id": 1, "title": 1, "updated_at": 1, "total_assessments": 1, "last_phq_score": 1}
+                )
+                .sort("updated_at", DESCENDING)
+                .limit(limit)
+            )
+            return list(cursor)
+        
+        except Exception as e:
+            print(f"Error listing conversations for {counselor_id}: {e}")
+            return []
+    
+    def conversation_ids(self, counselor_id: Optional[str] = None) -> List[str]:
+        query = {"counselor_id": counselor_id} if counselor_id is not None else {}
+        return [data["_id"] for data in self.conversations.find(query, {"_id": 1})]
+    
+    def _first_seq_since(self, conversation_id: str, since: datetime) -> Optional[int]:
+        first = self.messages.find_one(
+            {"conversation_id": conversation_id, "role": "user", "timestamp": {"$gte": since}},
+            {"seq": 1},
+            sort=[("seq", ASCENDING)]
+        )
+        return first["seq"] if first else None
+    
+    def _archive_index(self, conversation_id: str) -> List[Dict]:
+        # The stubs live on the conversation document itself
+        data = self.conversations.find_one({"_id": conversation_id}, {"archive": 1}) or {}
+        return sorted(data.get("archive", []), key=lambda stub: stub["first_seq"])
+    
+    def _store_segment(self, conversation_id: str, stub: Dict, data: bytes):
+        # Ordered so that a crash at any step leaves every message readable from one of the tiers
+        self.archive.replace_one(
+            {"_id": f"{conversation_id}:{stub['first_seq']}"},
+            dict(stub, conversation_id=conversation_id, data=Binary(data)),
+            upsert=True
+        )
+        self.conversations.update_one(
+            {"_id": conversation_id, "archive.first_seq": {"$ne": stub["first_seq"]}},
+            {"$push": {"archive": stub}}
+        )
+        self.messages.delete_many({"conversation_id": conversation_id, "seq": {"$gte": stub["first_seq"], "$lt": stub["end_seq"]}})
+    
+    def _read_segment(self, conversation_id: str, first_seq: int) -> bytes:
+        segment = self.archive.find_one({"_id": f"{conversation_id}:{first_seq}"}, {"data": 1})
+        if segment is None:
+            raise KeyError(f"no archived segment {first_seq} for {conversation_id}")
+        return bytes(segment["data"])
+    
+    def find_note_vectors(self, counselor_id: str) -> List[Dict]:
+        return list(self.note_vectors.find({"counselor_id": counselor_id}, {"_id": 0}).sort(
+            [("conversation_id", ASCENDING), ("seq", ASCENDING)]
+        ))
+    
+    def count_note_vectors(self, counselor_id: str) -> int:
+        return self.note_vectors.count_documents({"counselor_id": counselor_id})
+    
+    def assessment_dashboard(self, counselor_id: str) -> Dict:
+        if not self.available:
+            return {}
+        
+        def sum_rollup(field):
+            return [
+                {"$project": {"entry": {"$objectToArray": {"$ifNull": [f"$rollups.{field}", {}]}}}},
+                {"$unwind": "$entry"},
+                {"$group": {"_id": "$entry.k", "count": {"$sum": "$entry.v"}}},
+            ]
+        
+        pipeline = [
+            {"$match": {"counselor_id": counselor_id}},
+            {"$facet": {
+                "totals": [{"$group": {"_id": None, "conversations": {"$sum": 1}, "assessments": {"$sum": "$total_assessments"}}}],
+                "band_counts": sum_rollup("band_counts"),
+                "label_counts": sum_rollup("label_counts"),
+                "daily_assessments": sum_rollup("daily_assessments"),
+            }},
+        ]
+        
+        try:
+            result = next(iter(self.conversations.aggregate(pipeline)), {})
+            totals = (result.get("totals") or [{}])[0]
+            dashboard = {
+                "conversations": totals.get("conversations", 0),
+                "assessments": totals.get("assessments", 0),
+            }
+            for field in ("band_counts", "label_counts", "daily_assessments"):
+                dashboard[field] = {item["_id"]: item["count"] for item in result.get(field, [])}
+            return dashboard
+        
+        except Exception as e:
+            print(f"Error building dashboard for {counselor_id}: {e}")
+            return {}
+    
+    def migrate_global_conversation(self, counselor_id: str, session_id: str) -> bool:
+        """Move the legacy single ``global_conversation`` document under a counselor's session.
+        
+        Handles both the original layout, with messages embedded in the
+        document, and the append-only layout keyed by the legacy id. Returns
+        True if anything was migrated.
+        """
+        if not self.available:
+            return False
+        
+        try:
+            data = self.conversations.find_one({"_id": LEGACY_CONVERSATION_ID})
+            if not data:
+                return False
+            
+            key = conversation_key(counselor_id, session_id)
+            embedded = data.pop("messages", None)
+            if embedded:
+                records = [
+                    dict(msg_data, conversation_id=key, seq=seq)
+                    for seq, msg_data in enumerate(embedded)
+                ]
+                self.messages.insert_many(records, ordered=True)
+                message_count = len(records)
+            else:
+                self.messages.update_many(
+                    {"conversation_id": LEGACY_CONVERSATION_ID},
+                    {"$set": {"conversation_id": key}}
+                )
+                message_count = data.get("message_count", 0)
             
-        except Exception:
-            return None 
\ No newline at end of file
+            data.update(
+                _id=key,
+                counselor_id=counselor_id,
+                session_id=session_id,
+                message_count=message_count,
+            )
+            self.conversations.insert_one(data)
+            self.conversations.delete_one({"_id": LEGACY_CONVERSATION_ID})
+            
+            print(f"✅ Migrated global conversation ({message_count} messages) to {key}")
+            return True
+        
+        except Exception as e:
+            print(f"Error migrating global conversation: {e}")
+            return False
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    counselor_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversations_session ON conversations (session_id);
+CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated_at);
+CREATE INDEX IF NOT EXISTS conversations_counselor_updated ON conversations (counselor_id, updated_at);
+
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    PRIMARY KEY (conversation_id, seq)
+);
+CREATE INDEX IF NOT EXISTS messages_role ON messages (conversation_id, role, seq);
+
+CREATE TABLE IF NOT EXISTS note_vectors (
+    conversation_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    counselor_id TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    preview TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    PRIMARY KEY (conversation_id, seq)
+);
+CREATE INDEX IF NOT EXISTS note_vectors_counselor ON note_vectors (counselor_id);
+
+CREATE TABLE IF NOT EXISTS archive_segments (
+    conversation_id TEXT NOT NULL,
+    first_seq INTEGER NOT NULL,
+    end_seq INTEGER NOT NULL,
+    stub TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (conversation_id, first_seq)
+);
+"""
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+class SQLiteConnectionPool:
+    """Fixed-size pool of SQLite connections in WAL mode, shared across threads."""
+    
+    def __init__(self, path: str, size: int = 4, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self._connections: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=size)
+        
+        for _ in range(size):
+            connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._connections.put(connection)
+        
+        with self.connection() as connection:
+            connection.executescript(SQLITE_SCHEMA)
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, waiting up to ``timeout`` seconds for one to be free."""
+        try:
+            connection = self._connections.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"No free connection in pool for {self.path}")
+        try:
+            yield connection
+        finally:
+            self._connections.put(connection)
+
+
+_SQLITE_POOLS: Dict[tuple, SQLiteConnectionPool] = {}
+_SQLITE_POOLS_LOCK = threading.Lock()
+
+
+def get_sqlite_pool(path: str, size: int, timeout: float) -> SQLiteConnectionPool:
+    """Return the process-wide pool for this database file."""
+    key = (os.path.abspath(path), size, timeout)
+    with _SQLITE_POOLS_LOCK:
+        pool = _SQLITE_POOLS.get(key)
+        if pool is None:
+            pool = SQLiteConnectionPool(path, size, timeout)
+            _SQLITE_POOLS[key] = pool
+        return pool
+
+
+class SQLiteDatabase(Database):
+    """Embedded SQLite backend for single-node or offline deployments."""
+    
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        pool_size: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ):
+        super().__init__()
+        self.pool = None
+        
+        try:
+            self.pool = get_sqlite_pool(
+                path or os.getenv("SQLITE_PATH", "conversations.db"),
+                pool_size or int(os.getenv("SQLITE_POOL_SIZE", "4")),
+                timeout or float(os.getenv("SQLITE_TIMEOUT", "5")),
+            )
+        except Exception as e:
+            self._disable(e)
+    
+    @property
+    def available(self) -> bool:
+        return self.pool is not None
+    
+    def write_batches(self, batches: List[Dict]):
+        """Apply prepared save batches in a single transaction.
+        
+        ``BEGIN IMMEDIATE`` holds SQLite's write lock across processes, so
+        checking the stored ``message_count`` and placing the messages (see
+        ``_place_batch``) cannot interleave with another writer.
+        """
+        # Encode before taking the write lock
+        vectors = {batch["conversation_id"]: self._note_vectors(batch) for batch in batches}
+        with self.pool.connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for batch in batches:
+                    conversation_id = batch["conversation_id"]
+                    row = connection.execute(
+                        "SELECT created_at, updated_at, metadata FROM conversations WHERE id = ?", (conversation_id,)
+                    ).fetchone()
+                    stored = self._row_to_metadata(row) if row else None
+                    next_seq = stored.get("message_count") if stored else None
+                    if batch["messages"] and next_seq is not None and batch["messages"][0]["seq"] < next_seq:
+                        stored_records = {
+                            record["seq"]: dict(record, content=json.loads(record["content"])) for record in connection.execute(
+                                "SELECT seq, role, timestamp, content FROM messages WHERE conversation_id = ? AND seq >= ? AND seq < ?",
+                                (conversation_id, batch["messages"][0]["seq"], next_seq)
+                            )
+                        }
+                        shift = self._place_batch(batch, next_seq, stored, stored_records)
+                        if shift is not None:
+                            self._shift_batch(batch, shift, stored)
+                    
+                    if batch["truncate_from"] is not None:
+                        connection.execute(
+                            "DELETE FROM messages WHERE conversation_id = ? AND seq >= ?",
+                            (conversation_id, batch["truncate_from"])
+                        )
+                        connection.execute(
+                            "DELETE FROM note_vectors WHERE conversation_id = ? AND seq >= ?",
+                            (conversation_id, batch["truncate_from"])
+                        )
+                        connection.execute(
+                            "DELETE FROM archive_segments WHERE conversation_id = ? AND end_seq > ?",
+                            (conversation_id, batch["truncate_from"])
+                        )
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO messages (conversation_id, seq, role, content_type, content, timestamp) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [
+                            (conversation_id, record["seq"], record["role"], record["content_type"],
+                             json.dumps(record["content"]), record["timestamp"].isoformat())
+                            for record in batch["messages"]
+                        ]
+                    )
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO note_vectors (conversation_id, seq, counselor_id, vector, preview, timestamp) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [
+                            (conversation_id, record["seq"], record["counselor_id"], record["vector"],
+                             record["preview"], record["timestamp"].isoformat())
+                            for record in vectors[conversation_id]
+                        ]
+                    )
+                    metadata = self._metadata_to_write(batch, next_seq)
+                    if metadata is None:
+                        continue
+                    connection.execute(
+                        "INSERT INTO conversations (id, counselor_id, session_id, created_at, updated_at, metadata) "
+                        "VALUES (?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (id) DO UPDATE SET counselor_id = excluded.counselor_id, "
+                        "session_id = excluded.session_id, updated_at = excluded.updated_at, metadata = excluded.metadata",
+                        (conversation_id, metadata["counselor_id"], metadata["session_id"],
+                         batch["created_at"].isoformat(), metadata["updated_at"].isoformat(),
+                         json.dumps(metadata, default=_json_default))
+                    )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        self._notify_written(batches)
+    
+    def is_transient_error(self, error: Exception) -> bool:
+        # "database is locked" and pool exhaustion clear up on their own
+        return isinstance(error, sqlite3.OperationalError)
+    
+    def _row_to_metadata(self, row: sqlite3.Row) -> Dict:
+        data = json.loads(row["metadata"])
+        data["created_at"] = datetime.fromisoformat(row["created_at"])
+        data["updated_at"] = datetime.fromisoformat(row["updated_at"])
+        return data
+    
+    def _find_conversation(self, conversation_id: str) -> Optional[Dict]:
+        with self.pool.connection() as connection:
+            row = connection.execute(
+                "SELECT created_at, updated_at, metadata FROM conversations WHERE id = ?",
+                (conversation_id,)
+            ).fetchone()
+        return self._row_to_metadata(row) if row else None
+    
+    def _page_start(self, conversation_id: str, before_seq: Optional[int], assessments: int) -> int:
+        query = "SELECT seq FROM messages WHERE conversation_id = ? AND role = 'user'"
+        params = [conversation_id]
+        if before_seq is not None:
+            query += " AND seq < ?"
+            params.append(before_seq)
+        query += " ORDER BY seq DESC LIMIT 1 OFFSET ?"
+        params.append(assessments - 1)
+        
+        with self.pool.connection() as connection:
+            row = connection.execute(query, params).fetchone()
+        return row["seq"] if row else 0
+    
+    def _find_messages(self, conversation_id: str, start_seq: int, before_seq: Optional[int] = None) -> List[Dict]:
+        query = "SELECT seq, role, content_type, content, timestamp FROM messages WHERE conversation_id = ? AND seq >= ?"
+        params = [conversation_id, start_seq]
+        if before_seq is not None:
+            query += " AND seq < ?"
+            params.append(before_seq)
+        query += " ORDER BY seq"
+        
+        with self.pool.connection() as connection:
+            rows = connection.execute(query, params).fetchall()
+        
+        # Content JSON and timestamps are decoded lazily by StoredMessage
+        return [
+            {
+                "conversation_id": conversation_id,
+                "seq": row["seq"],
+                "role": row["role"],
+                "content_type": row["content_type"],
+                "content": row["content"],
+                "content_encoding": "json",
+                "timestamp": row["timestamp"],
+            }
+            for row in rows
+        ]
+    
+    def list_recent_conversations(self, counselor_id: str, limit: int = 10) -> List[Dict]:
+        if not self.available:
+            return []
+        
+        try:
+            with self.pool.connection() as connection:
+                rows = connection.execute(
+                    "SELECT id, created_at, updated_at, metadata FROM conversations "
+                    "WHERE counselor_id = ? ORDER BY updated_at DESC LIMIT ?",
+                    (counselor_id, limit)
+                ).fetchall()
+            return [dict(self._row_to_metadata(row), _id=row["id"]) for row in rows]
+        
+        except Exception as e:
+            print(f"Error listing conversations for {counselor_id}: {e}")
+            return []
+    
+    def conversation_ids(self, counselor_id: Optional[str] = None) -> List[str]:
+        with self.pool.connection() as connection:
+            if counselor_id is None:
+                rows = connection.execute("SELECT id FROM conversations").fetchall()
+            else:
+                rows = connection.execute("SELECT id FROM conversations WHERE counselor_id = ?", (counselor_id,)).fetchall()
+        return [row["id"] for row in rows]
+    
+    def _first_seq_since(self, conversation_id: str, since: datetime) -> Optional[int]:
+        # ISO timestamps sort lexically in time order
+        with self.pool.connection() as connection:
+            row = connection.execute(
+                "SELECT MIN(seq) AS seq FROM messages WHERE conversation_id = ? AND role = 'user' AND timestamp >= ?",
+                (conversation_id, since.isoformat())
+            ).fetchone()
+        return row["seq"]
+    
+    def _archive_index(self, conversation_id: str) -> List[Dict]:
+        with self.pool.connection() as connection:
+            rows = connection.execute(
+                "SELECT stub FROM archive_segments WHERE conversation_id = ? ORDER BY first_seq",
+                (conversation_id,)
+            ).fetchall()
+        stubs = [json.loads(row["stub"]) for row in rows]
+        for stub in stubs:
+            stub["first_timestamp"] = datetime.fromisoformat(stub["first_timestamp"])
+            stub["last_timestamp"] = datetime.fromisoformat(stub["last_timestamp"])
+        return stubs
+    
+    def _store_segment(self, conversation_id: str, stub: Dict, data: bytes):
+        with self.pool.connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "INSERT OR REPLACE INTO archive_segments (conversation_id, first_seq, end_seq, stub, data) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (conversation_id, stub["first_seq"], stub["end_seq"], json.dumps(stub, default=_json_default), data)
+                )
+                connection.execute(
+                    "DELETE FROM messages WHERE conversation_id = ? AND seq >= ? AND seq < ?",
+                    (conversation_id, stub["first_seq"], stub["end_seq"])
+                )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+    
+    def _read_segment(self, conversation_id: str, first_seq: int) -> bytes:
+        with self.pool.connection() as connection:
+            row = connection.execute(
+                "SELECT data FROM archive_segments WHERE conversation_id = ? AND first_seq = ?",
+                (conversation_id, first_seq)
+            ).fetchone()
+        if row is None:
+            raise KeyError(f"no archived segment {first_seq} for {conversation_id}")
+        return bytes(row["data"])
+    
+    def find_note_vectors(self, counselor_id: str) -> List[Dict]:
+        with self.pool.connection() as connection:
+            rows = connection.execute(
+                "SELECT conversation_id, seq, vector, preview, timestamp FROM note_vectors "
+                "WHERE counselor_id = ? ORDER BY conversation_id, seq",
+                (counselor_id,)
+            ).fetchall()
+        return [
+            dict(row, counselor_id=counselor_id, vector=bytes(row["vector"]), timestamp=datetime.fromisoformat(row["timestamp"]))
+            for row in map(dict, rows)
+        ]
+    
+    def count_note_vectors(self, counselor_id: str) -> int:
+        with self.pool.connection() as connection:
+            return connection.execute(
+                "SELECT COUNT(*) FROM note_vectors WHERE counselor_id = ?", (counselor_id,)
+            ).fetchone()[0]
+    
+    def assessment_dashboard(self, counselor_id: str) -> Dict:
+        if not self.available:
+            return {}
+        
+        try:
+            with self.pool.connection() as connection:
+                totals = connection.execute(
+                    "SELECT COUNT(*) AS conversations, "
+                    "COALESCE(SUM(json_extract(metadata, '$.total_assessments')), 0) AS assessments "
+                    "FROM conversations WHERE counselor_id = ?",
+                    (counselor_id,)
+                ).fetchone()
+                dashboard = {"conversations": totals["conversations"], "assessments": totals["assessments"]}
+                
+                for field in ("band_counts", "label_counts", "daily_assessments"):
+                    rows = connection.execute(
+                        "SELECT entry.key AS key, SUM(entry.value) AS count "
+                        f"FROM conversations, json_each(conversations.metadata, '$.rollups.{field}') AS entry "
+                        "WHERE conversations.counselor_id = ? GROUP BY entry.key",
+                        (counselor_id,)
+                    ).fetchall()
+                    dashboard[field] = {row["key"]: row["count"] for row in rows}
+            return dashboard
+        
+        except Exception as e:
+            print(f"Error building dashboard for {counselor_id}: {e}")
+            return {}
+
+
+def create_database() -> Database:
+    """Build the storage backend selected by ``STORAGE_BACKEND`` (``mongo`` or ``sqlite``)."""
+    backend = os.getenv("STORAGE_BACKEND", "mongo").lower()
+    if backend == "sqlite":
+        return SQLiteDatabase()
+    if backend == "mongo":
+        return MongoDatabase()
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}', expected 'mongo' or 'sqlite'")
@@ -0,0 +1,353 @@
+"""
+Memory accounting for one app or API process.
+
+``memory_report`` measures the process (resident set, peak, traced Python
+heap) and the bytes retained by each named component: the encoder model,
+the embedding matrix, the post metadata, the lexical index, the agent's
+LangChain objects and the loaded conversations. Components are measured in
+order over one shared set of visited objects, so anything reachable from
+an earlier component (e.g. the RAG index inside the agent) is counted once,
+under the first. Numpy arrays and torch tensors count their data buffers;
+memory-mapped files are reported as mapped rather than retained.
+
+``TRACER`` takes on-demand tracemalloc snapshots and diffs them by
+allocation site or by component. Soft budgets come from ``MEMORY_BUDGETS_MB``
+(e.g. ``rss=1500,embeddings=200,conversations=50``); exceeding one prints a
+warning and nothing else.
+
+Run ``python diagnostics.py --fake-llm`` for a report from the command line.
+"""
+import argparse
+import gc
+import json
+import mmap
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from typing import Dict, Iterable, List, Optional
+
+MB = 1024 * 1024
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Shared code and interpreter state, never part of one component's footprint
+_SKIP_TYPES = (
+    type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+    types.CodeType, types.FrameType, threading.Thread, type(threading.Lock()),
+)
+
+# Allocation sites to components, in priority order: the first group with a frame anywhere
+# on the stack wins, so model loading called from rag_system.py still counts as the model
+LIBRARY_COMPONENTS = {
+    "rag_model": ("sentence_transformers", "transformers", "torch", "tokenizers", "huggingface_hub"),
+}
+MODULE_COMPONENTS = {
+    "fakes.py": "rag_model",
+    "embedding_server.py": "rag_model",
+    "rag_system.py": "embeddings",
+    "post_store.py": "post_metadata",
+    "lexical_index.py": "lexical_index",
+    "models.py": "conversations",
+    "database.py": "conversations",
+    "persistence.py": "conversations",
+    "views.py": "conversations",
+    "agent.py": "agent",
+    "pipeline.py": "agent",
+    "prompts.py": "agent",
+    "jobs.py": "agent",
+}
+AGENT_LIBRARIES = ("langchain", "langgraph", "openai", "httpx")
+
+
+def process_memory() -> Dict:
+    """Resident and peak resident set size of this process, in MB."""
+    rss = None
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    peak = peak if sys.platform == "darwin" else peak * 1024
+    
+    traced, traced_peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (None, None)
+    return {
+        "rss_mb": round(rss / MB, 2) if rss is not None else None,
+        "peak_rss_mb": round(peak / MB, 2),
+        "tracing": tracemalloc.is_tracing(),
+        "python_heap_mb": round(traced / MB, 2) if traced is not None else None,
+        "python_heap_peak_mb": round(traced_peak / MB, 2) if traced_peak is not None else None,
+    }
+
+
+def _buffer_bytes(obj) -> Optional[int]:
+    """Size of the data buffer owned by an array or tensor, or None for other objects."""
+    if hasattr(obj, "nbytes") and hasattr(obj, "base") and hasattr(obj, "dtype"):
+        # A view shares its base's buffer, which is counted when the base is reached
+        return obj.nbytes if obj.base is None else 0
+    if hasattr(obj, "element_size") and hasattr(obj, "nelement"):
+        try:
+            return obj.nelement() * obj.element_size()
+        except Exception:
+            return 0
+    return None
+
+
+def retained_size(roots: Iterable, seen: Optional[set] = None, max_objects: int = 2_000_000) -> Dict:
+    """Bytes retained by ``roots`` and everything they reference that is not already in ``seen``."""
+    seen = set() if seen is None else seen
+    stack = [root for root in roots if root is not None]
+    size = mapped = objects = 0
+    truncated = False
+    
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SKIP_TYPES):
+            continue
+        seen.add(id(obj))
+        objects += 1
+        if objects > max_objects:
+            truncated = True
+            break
+        
+        size += sys.getsizeof(obj, 0)
+        if isinstance(obj, mmap.mmap):
+            mapped += len(obj)
+            continue
+        buffer = _buffer_bytes(obj)
+        if buffer is not None:
+            size += buffer
+            if getattr(obj, "base", None) is not None:
+                stack.append(obj.base)
+            if not hasattr(obj, "element_size"):
+                # Array elements are in the buffer already; only object arrays reference more
+                if getattr(obj.dtype, "hasobject", False):
+                    stack.extend(obj.ravel().tolist())
+                continue
+        stack.extend(gc.get_referents(obj))
+    
+    return {
+        "mb": round(size / MB, 2),
+        "mapped_mb": round(mapped / MB, 2),
+        "objects": objects,
+        "truncated": truncated,
+    }
+
+
+def agent_components(agent=None, conversations: Iterable = (), **extra) -> Dict[str, List]:
+    """Measurement roots per component, in the order they are attributed."""
+    components: Dict[str, List] = {}
+    rag = getattr(agent, "rag_system", None)
+    if rag is not None:
+        components["rag_model"] = [rag.model]
+        components["embeddings"] = [rag.embeddings]
+        components["post_metadata"] = [rag.posts]
+        components["lexical_index"] = [rag.lexical_index]
+    if agent is not None:
+        components["agent"] = [agent]
+    components["conversations"] = list(conversations)
+    for name, obj in extra.items():
+        components[name] = [obj]
+    return components
+
+
+def parse_budgets(spec: Optional[str] = None) -> Dict[str, float]:
+    """``"rss=1500,embeddings=200"`` as {name: MB}; defaults to ``MEMORY_BUDGETS_MB``."""
+    spec = os.getenv("MEMORY_BUDGETS_MB", "") if spec is None else spec
+    budgets = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, value = item.partition("=")
+        try:
+            budgets[name.strip()] = float(value)
+        except ValueError:
+            print(f"⚠️ Ignoring malformed memory budget {item!r}")
+    return budgets
+
+
+def check_budgets(report: Dict, budgets: Optional[Dict[str, float]] = None) -> List[str]:
+    """Warnings for every component (or ``rss``/``python_heap``) above its soft budget."""
+    budgets = parse_budgets() if budgets is None else budgets
+    usage = {name: component["mb"] for name, component in report.get("components", {}).items()}
+    usage["rss"] = report["process"]["rss_mb"]
+    usage["python_heap"] = report["process"]["python_heap_mb"]
+    
+    warnings = []
+    for name, limit in budgets.items():
+        used = usage.get(name)
+        if used is not None and used > limit:
+            warnings.append(f"{name} uses {used:.1f} MB, over its {limit:.0f} MB budget")
+    for warning in warnings:
+        print(f"⚠️ Memory budget exceeded: {warning}")
+    return warnings
+
+
+def memory_report(components: Optional[Dict[str, List]] = None, budgets: Optional[Dict[str, float]] = None) -> Dict:
+    """Process memory plus the retained size of each component, checked against the soft budgets."""
+    started = time.perf_counter()
+    seen: set = set()
+    # The root lists themselves belong to no component
+    seen.update(id(roots) for roots in (components or {}).values())
+    measured = {name: retained_size(roots, seen) for name, roots in (components or {}).items()}
+    
+    report = {
+        "process": process_memory(),
+        "components": measured,
+        "measure_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    if report["process"]["rss_mb"] is not None:
+        attributed = sum(component["mb"] for component in measured.values())
+        # Interpreter, libraries, allocator slack and anything no component reaches
+        report["unattributed_mb"] = round(report["process"]["rss_mb"] - attributed, 2)
+    report["budget_warnings"] = check_budgets(report, budgets)
+    return report
+
+
+def _in_package(filename: str, packages) -> bool:
+    parts = filename.replace("\\", "/").split("/")
+    return any(package in parts for package in packages)
+
+
+def component_for(traceback: tracemalloc.Traceback) -> str:
+    """The component an allocation belongs to, judged by the files on its stack."""
+    frames = [frame.filename for frame in reversed(traceback)]
+    for component, packages in LIBRARY_COMPONENTS.items():
+        if any(_in_package(filename, packages) for filename in frames):
+            return component
+    for filename in frames:
+        # Only this repo's modules, not same-named files inside installed packages
+        if os.path.dirname(os.path.abspath(filename)) == REPO_DIR and os.path.basename(filename) in MODULE_COMPONENTS:
+            return MODULE_COMPONENTS[os.path.basename(filename)]
+    if any(_in_package(filename, AGENT_LIBRARIES) for filename in frames):
+        return "agent"
+    return "other"
+
+
+class SnapshotTracer:
+    """On-demand tracemalloc snapshots, kept in memory under a label."""
+    
+    def __init__(self, max_snapshots: int = 10):
+        self.max_snapshots = max_snapshots
+        self.snapshots: Dict[str, tracemalloc.Snapshot] = {}
+        self._lock = threading.Lock()
+    
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+    
+    def start(self, frames: int = 10):
+        """Start tracing; allocations made before this are invisible to snapshots.
+        
+        Tracing slows allocation-heavy code several times over, so stop it when done.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+    
+    def stop(self):
+        with self._lock:
+            self.snapshots.clear()
+        tracemalloc.stop()
+    
+    def take(self, label: Optional[str] = None) -> str:
+        """Snapshot the traced heap, starting tracing first if needed; returns its label."""
+        self.start()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*"),
+        ])
+        with self._lock:
+            label = label or f"snapshot-{len(self.snapshots) + 1}-{time.strftime('%H:%M:%S')}"
+            self.snapshots[label] = snapshot
+            # Snapshots hold every trace; only the latest few are kept
+            while len(self.snapshots) > self.max_snapshots:
+                del self.snapshots[next(iter(self.snapshots))]
+        return label
+    
+    def labels(self) -> List[str]:
+        with self._lock:
+            return list(self.snapshots)
+    
+    def _get(self, label: str) -> tracemalloc.Snapshot:
+        with self._lock:
+            if label not in self.snapshots:
+                raise KeyError(f"no snapshot named {label!r}")
+            return self.snapshots[label]
+    
+    def top(self, label: str, limit: int = 20, key_type: str = "lineno") -> List[Dict]:
+        """Largest allocation sites in one snapshot."""
+        return [
+            {"site": str(stat.traceback[-1]), "mb": round(stat.size / MB, 3), "blocks": stat.count}
+            for stat in self._get(label).statistics(key_type)[:limit]
+        ]
+    
+    def diff(self, older: str, newer: str, limit: int = 20, key_type: str = "lineno") -> List[Dict]:
+        """Allocation sites that grew or shrank the most between two snapshots."""
+        return [
+            {
+                "site": str(stat.traceback[-1]),
+                "mb": round(stat.size / MB, 3),
+                "change_mb": round(stat.size_diff / MB, 3),
+                "blocks_change": stat.count_diff,
+            }
+            for stat in self._get(newer).compare_to(self._get(older), key_type)[:limit]
+        ]
+    
+    def by_component(self, label: str) -> Dict[str, float]:
+        """Traced Python heap (MB) per component, attributed by allocation stack."""
+        totals: Dict[str, int] = {}
+        for stat in self._get(label).statistics("traceback"):
+            component = component_for(stat.traceback)
+            totals[component] = totals.get(component, 0) + stat.size
+        return {component: round(size / MB, 2) for component, size in sorted(totals.items(), key=lambda item: -item[1])}
+
+
+# Process-wide, so the debug page and the CLI see the same snapshots
+TRACER = SnapshotTracer()
+
+
+def main(argv=None) -> Dict:
+    parser = argparse.ArgumentParser(description="Per-component memory report for the assessment agent")
+    parser.add_argument("--fake-llm", action="store_true", help="use fakes.FakeChatModel instead of OpenAI clients")
+    parser.add_argument("--no-rag", action="store_true", help="skip loading the similar case index")
+    parser.add_argument("--counselor", default=None, help="also load this counselor's recent conversations")
+    parser.add_argument("--conversations", type=int, default=10, help="how many recent conversations to load")
+    parser.add_argument("--assessments", type=int, default=20, help="assessments loaded per conversation")
+    parser.add_argument("--trace", action="store_true",
+                        help="trace allocations while loading and report the Python heap per component")
+    parser.add_argument("--top", type=int, default=15, help="allocation sites listed with --trace")
+    parser.add_argument("--budgets", default=None, help="soft budgets in MB, e.g. rss=1500,embeddings=200")
+    args = parser.parse_args(argv)
+    
+    if args.trace:
+        TRACER.take("start")
+    
+    from server import build_agent
+    agent = build_agent(fake_llm=args.fake_llm, load_rag=not args.no_rag)
+    
+    conversations = []
+    if args.counselor:
+        from database import create_database
+        db = create_database()
+        for item in db.list_recent_conversations(args.counselor, limit=args.conversations):
+            conversation = db.load_conversation(args.counselor, item["session_id"], assessments=args.assessments)
+            if conversation is not None:
+                conversations.append(conversation)
+    
+    report = memory_report(agent_components(agent, conversations), parse_budgets(args.budgets))
+    if args.trace:
+        TRACER.take("loaded")
+        report["python_heap_by_component_mb"] = TRACER.by_component("loaded")
+        report["top_growth"] = TRACER.diff("start", "loaded", limit=args.top)
+    
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main()
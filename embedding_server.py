@@ -0,0 +1,274 @@
+"""
+Local embedding service shared by every app and API worker on a node.
+
+One process loads the sentence encoder and serves ``encode`` calls over a
+Unix socket. Requests that arrive within ``batch_window_ms`` of each other
+(up to ``max_batch`` texts) are encoded in one model call, so concurrent
+queries from many workers share a forward pass.
+
+Run with ``python embedding_server.py --socket /tmp/embeddings.sock`` and
+set ``EMBEDDING_SOCKET`` to the same path; ``RedditRAG`` then uses
+``RemoteEncoder`` instead of loading its own model.
+``python embedding_server.py --socket ... --metrics`` prints the server's
+metrics.
+
+Wire format, both directions: a 4-byte big-endian header length, a JSON
+header, then ``header["size"]`` bytes of payload (float32 embeddings in
+responses, nothing in requests).
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+HEADER = struct.Struct(">I")
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("embedding socket closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def send_frame(sock: socket.socket, header: Dict, payload: bytes = b""):
+    header = dict(header, size=len(payload))
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(HEADER.pack(len(data)) + data + payload)
+
+
+def recv_frame(sock: socket.socket) -> Tuple[Dict, bytes]:
+    (length,) = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    header = json.loads(_recv_exact(sock, length))
+    payload = _recv_exact(sock, header.get("size", 0)) if header.get("size") else b""
+    return header, payload
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))], 3)
+
+
+class MicroBatcher:
+    """Collects concurrent encode requests and runs them through the model together."""
+    
+    def __init__(self, model, max_batch: int = 64, batch_window_ms: float = 5.0):
+        self.model = model
+        self.max_batch = max_batch
+        self.batch_window_ms = batch_window_ms
+        self._queue: "queue.Queue[Tuple[List[str], Future, float]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._latencies_ms = deque(maxlen=2000)
+        self._stats = {
+            "requests": 0,
+            "texts": 0,
+            "batches": 0,
+            "max_queue_depth": 0,
+            "encode_seconds": 0.0,
+            "errors": 0,
+        }
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+    
+    def submit(self, texts: List[str]) -> Future:
+        future = Future()
+        self._queue.put((texts, future, time.perf_counter()))
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queue.qsize())
+        return future
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.perf_counter() + self.batch_window_ms / 1000
+            
+            # Wait out the window for more requests unless the batch is already full
+            while size < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            
+            texts = [text for request_texts, _, _ in batch for text in request_texts]
+            started = time.perf_counter()
+            try:
+                embeddings = np.asarray(self.model.encode(texts), dtype=np.float32)
+                error = None
+            except Exception as e:
+                error = e
+            finished = time.perf_counter()
+            
+            offset = 0
+            for request_texts, future, submitted in batch:
+                if error is None:
+                    future.set_result(embeddings[offset:offset + len(request_texts)])
+                else:
+                    future.set_exception(error)
+                offset += len(request_texts)
+                self._latencies_ms.append((finished - submitted) * 1000)
+            
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["texts"] += len(texts)
+                self._stats["encode_seconds"] += finished - started
+                self._stats["errors"] += error is not None
+    
+    def metrics(self) -> Dict:
+        with self._lock:
+            latencies = list(self._latencies_ms)
+            batches = self._stats["batches"]
+            return dict(
+                self._stats,
+                batch_window_ms=self.batch_window_ms,
+                max_batch=self.max_batch,
+                queue_depth=self._queue.qsize(),
+                mean_batch_size=round(self._stats["texts"] / batches, 2) if batches else 0.0,
+                mean_requests_per_batch=round(self._stats["requests"] / batches, 2) if batches else 0.0,
+                latency_ms={"p50": _percentile(latencies, 50), "p95": _percentile(latencies, 95),
+                            "p99": _percentile(latencies, 99)},
+            )
+
+
+class _EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        batcher = self.server.batcher
+        while True:
+            try:
+                header, _ = recv_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+            
+            if header.get("op") == "metrics":
+                send_frame(self.request, {"ok": True, "metrics": batcher.metrics()})
+                continue
+            
+            try:
+                embeddings = batcher.submit(header["texts"]).result()
+                send_frame(self.request, {"ok": True, "shape": list(embeddings.shape)}, embeddings.tobytes())
+            except Exception as e:
+                send_frame(self.request, {"ok": False, "error": str(e)})
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server; one thread per client connection feeding a shared MicroBatcher."""
+    
+    daemon_threads = True
+    # Every worker thread of every client process connects at startup
+    request_queue_size = 128
+    
+    def __init__(self, socket_path: str, model, max_batch: int = 64, batch_window_ms: float = 5.0):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.batcher = MicroBatcher(model, max_batch, batch_window_ms)
+        super().__init__(socket_path, _EmbeddingRequestHandler)
+    
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+class RemoteEncoder:
+    """Drop-in for SentenceTransformer's ``encode`` that calls the embedding server.
+    
+    Each thread keeps its own connection, so concurrent callers in one
+    process are batched by the server like callers from other processes.
+    """
+    
+    def __init__(self, socket_path: str, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+    
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+    
+    def _call(self, header: Dict) -> Tuple[Dict, bytes]:
+        # One reconnect covers a server restart between calls
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                send_frame(sock, header)
+                response, payload = recv_frame(sock)
+                break
+            except (ConnectionError, OSError):
+                self._local.sock = None
+                if attempt:
+                    raise
+        if not response.get("ok"):
+            raise RuntimeError(f"embedding server error: {response.get('error')}")
+        return response, payload
+    
+    def encode(self, sentences, batch_size: int = 32, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        response, payload = self._call({"op": "encode", "texts": list(sentences)})
+        return np.frombuffer(payload, dtype=np.float32).reshape(response["shape"])
+    
+    def metrics(self) -> Dict:
+        return self._call({"op": "metrics"})[0]["metrics"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared embedding server over a Unix socket")
+    parser.add_argument("--socket", default=os.getenv("EMBEDDING_SOCKET", "/tmp/embeddings.sock"))
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--max-batch", type=int, default=64, help="most texts encoded in one model call")
+    parser.add_argument("--batch-window-ms", type=float, default=5.0, help="how long to wait for more requests")
+    parser.add_argument("--fake-encoder", action="store_true", help="serve fakes.HashingEncoder instead of MiniLM")
+    parser.add_argument("--metrics", action="store_true", help="print a running server's metrics and exit")
+    args = parser.parse_args()
+    
+    if args.metrics:
+        print(json.dumps(RemoteEncoder(args.socket).metrics(), indent=2))
+        return
+    
+    if args.fake_encoder:
+        from fakes import HashingEncoder
+        model = HashingEncoder()
+    else:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(args.model)
+    
+    server = EmbeddingServer(args.socket, model, args.max_batch, args.batch_window_ms)
+    print(f"Serving embeddings on {args.socket} (window {args.batch_window_ms}ms, max batch {args.max_batch})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
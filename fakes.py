@@ -0,0 +1,225 @@
+"""
+Offline stand-ins for the OpenAI chat models.
+
+``FakeChatModel`` answers the extraction, severity and advice prompts from
+``prompts.py`` with deterministic keyword heuristics, after a configurable
+simulated latency. It is a regular LangChain chat model, so it can be
+passed to ``CounselorAgent`` and used with ``bind``, ``invoke`` and
+``stream`` like ``ChatOpenAI``. ``HashingEncoder`` stands in for the
+MiniLM sentence encoder.
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from typing import Any, Iterator, List, Optional
+
+import numpy as np
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from screening import provisional_risk_score
+
+
+KEYWORDS = {
+    "sleep_issues": r"\b(sleep\w*|insomnia|awake at night|nightmares)\b",
+    "appetite_changes": r"\b(appetite|eating|weight|not hungry)\b",
+    "social_withdrawal": r"\b(isolat\w*|withdraw\w*|alone|avoid\w* (people|friends|family))\b",
+    "concentration_issues": r"\b(concentrat\w*|focus\w*|forgetful|can'?t think)\b",
+    "hopelessness": r"\b(hopeless\w*|worthless|despair|suicid\w*|no point|burden)\b",
+}
+
+MOOD_KEYWORDS = {
+    "sadness": r"\b(sad\w*|down|depress\w*|crying|tearful)\b",
+    "anxiety": r"\b(anxi\w*|worr\w*|panic\w*|nervous)\b",
+    "irritability": r"\b(irritab\w*|angry|anger|snapping)\b",
+    "emptiness": r"\b(empty|emptiness|numb)\b",
+}
+
+ADVICE_TEMPLATE = """**Immediate risk:** CSSRS {score}/10 indicates {band}. Ask directly about ideation, plan, intent and means.
+
+**Safety planning:** Build a written safety plan with warning signs, coping steps and crisis contacts; restrict access to lethal means.
+
+**Level of care:** {care}
+
+**Protective factors:** Identify and strengthen supportive relationships, reasons for living and engagement in treatment.
+
+**Monitoring:** Schedule follow-up within {follow_up} and reassess with the CSSRS at every contact.
+
+**Referrals:** {referral}
+"""
+
+
+def _input_section(prompt: str) -> str:
+    """The note being assessed, cut out of one of the agent prompts."""
+    for marker in ("Original Input:", "INPUT TEXT:"):
+        if marker in prompt:
+            return prompt.split(marker, 1)[1].lstrip().split("\n\n", 1)[0].strip()
+    return prompt
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic chat model that simulates the agent's three LLM calls.
+    
+    ``latency_ms`` is the mean simulated response time; ``latency_distribution``
+    is one of ``fixed``, ``uniform`` (±``latency_jitter_ms``), ``normal``
+    (sd ``latency_jitter_ms``), ``lognormal`` or ``exponential``.
+    ``stream_chunk_ms`` is the delay between streamed words. Responses carry
+    token usage (about four characters per token) and, like OpenAI, report
+    the system prefix as cached once it has been seen and the prompt has at
+    least ``cache_min_tokens`` tokens.
+    """
+    
+    latency_ms: float = 0.0
+    latency_jitter_ms: float = 0.0
+    latency_distribution: str = "fixed"
+    stream_chunk_ms: float = 0.0
+    seed: Optional[int] = None
+    cache_min_tokens: int = 1024
+    
+    _rng: random.Random = PrivateAttr(default=None)
+    _seen_prefixes: set = PrivateAttr(default_factory=set)
+    _prefix_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    
+    def model_post_init(self, __context: Any):
+        self._rng = random.Random(self.seed)
+    
+    @property
+    def _llm_type(self) -> str:
+        return "fake-counselor"
+    
+    def sample_latency(self) -> float:
+        """One simulated response time in seconds."""
+        mean = self.latency_ms
+        jitter = self.latency_jitter_ms
+        if mean <= 0:
+            return 0.0
+        if self.latency_distribution == "uniform":
+            value = self._rng.uniform(mean - jitter, mean + jitter)
+        elif self.latency_distribution == "normal":
+            value = self._rng.gauss(mean, jitter)
+        elif self.latency_distribution == "lognormal":
+            # Parameterised so the distribution's mean is ``latency_ms`` and its sd ``latency_jitter_ms``
+            sigma2 = math.log(1 + (jitter / mean) ** 2)
+            value = self._rng.lognormvariate(math.log(mean) - sigma2 / 2, math.sqrt(sigma2))
+        elif self.latency_distribution == "exponential":
+            value = self._rng.expovariate(1 / mean)
+        else:
+            value = mean
+        return max(0.0, value) / 1000
+    
+    def usage(self, messages: List[BaseMessage], response: str) -> dict:
+        """Simulated token usage, with the system prefix cached in 128-token steps after its first use."""
+        input_tokens = sum(len(str(message.content)) for message in messages) // 4
+        cached = 0
+        if messages and messages[0].type == "system":
+            prefix = str(messages[0].content)
+            with self._prefix_lock:
+                seen = prefix in self._seen_prefixes
+                self._seen_prefixes.add(prefix)
+            if seen and input_tokens >= self.cache_min_tokens:
+                cached = len(prefix) // 4 // 128 * 128
+        output_tokens = len(response) // 4
+        return {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "input_token_details": {"cache_read": cached},
+        }
+    
+    def respond(self, messages: List[BaseMessage]) -> str:
+        """The canned answer for the agent prompt in ``messages``."""
+        prompt = "\n\n".join(str(message.content) for message in messages)
+        note = _input_section(prompt)
+        
+        if "Extract patient information" in prompt:
+            info = {field: bool(re.search(pattern, note, re.I)) for field, pattern in KEYWORDS.items()}
+            age = re.search(r"\b(\d{1,2})[- ](year|yo\b|y/o)", note, re.I)
+            info["age"] = int(age.group(1)) if age else None
+            info["energy_level"] = "low" if re.search(r"\b(tired|exhausted|fatigue\w*|low energy)\b", note, re.I) else "normal"
+            info["mood_symptoms"] = [mood for mood, pattern in MOOD_KEYWORDS.items() if re.search(pattern, note, re.I)]
+            return json.dumps(info)
+        
+        if "severity_score" in prompt:
+            return json.dumps({"severity_score": provisional_risk_score(note)})
+        
+        score = provisional_risk_score(note)
+        if score >= 6:
+            care, follow_up, referral = "Consider inpatient or crisis stabilisation.", "24 hours", "Refer to emergency services or a crisis team now."
+        elif score >= 4:
+            care, follow_up, referral = "Intensive outpatient care with crisis line access.", "72 hours", "Refer to psychiatry for evaluation."
+        else:
+            care, follow_up, referral = "Routine outpatient care.", "one to two weeks", "None indicated at this time."
+        band = "minimal risk" if score < 2 else "low risk" if score < 4 else "moderate risk" if score < 6 else "high risk" if score < 8 else "severe risk"
+        return ADVICE_TEMPLATE.format(score=score, band=band, care=care, follow_up=follow_up, referral=referral)
+    
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.sample_latency())
+        content = self.respond(messages)
+        message = AIMessage(content=content, usage_metadata=self.usage(messages, content))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+    
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        # Time to first token, then one word at a time
+        time.sleep(self.sample_latency())
+        content = self.respond(messages)
+        for word in re.findall(r"\S+\s*", content):
+            if self.stream_chunk_ms:
+                time.sleep(self.stream_chunk_ms / 1000)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word))
+            if run_manager:
+                run_manager.on_llm_new_token(word, chunk=chunk)
+            yield chunk
+        # Usage comes on a final empty chunk, as with stream_usage on ChatOpenAI
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self.usage(messages, content)))
+
+
+class HashingEncoder:
+    """Bag-of-words encoder with SentenceTransformer's ``encode`` signature.
+    
+    Each word is hashed to a fixed random unit vector and a text embeds as the
+    normalised sum, so texts sharing words are similar. No model download or
+    torch needed.
+    """
+    
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+        self._vectors = {}
+    
+    def _word_vector(self, word: str) -> np.ndarray:
+        vector = self._vectors.get(word)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(word.encode("utf-8")))
+            vector = self._vectors[word] = rng.standard_normal(self.dimensions).astype(np.float32)
+        return vector
+    
+    def encode(self, sentences, batch_size: int = 32, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        embeddings = np.zeros((len(sentences), self.dimensions), dtype=np.float32)
+        for i, sentence in enumerate(sentences):
+            for word in re.findall(r"[a-z0-9']+", sentence.lower()):
+                embeddings[i] += self._word_vector(word)
+            norm = np.linalg.norm(embeddings[i])
+            if norm:
+                embeddings[i] /= norm
+        return embeddings
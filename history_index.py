@@ -0,0 +1,191 @@
+"""
+Semantic search over a counselor's past notes.
+
+Notes are embedded once, when their conversation is saved (see
+``Database.note_encoder``), and the vectors are stored with the messages.
+``HistoryIndex`` loads a counselor's vectors into one normalised matrix on
+first use and then appends each newly saved note to it, so a lookup is a
+single matrix-vector product over vectors that are already in memory
+rather than a re-embedding of the history.
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class _CounselorVectors:
+    """One counselor's note vectors, with spare capacity for appends."""
+    
+    def __init__(self, records: List[Dict], dimensions: int):
+        self.keys: List[tuple] = []
+        self.seen: set = set()
+        self.details: List[Dict] = []
+        self.matrix = np.empty((max(16, len(records)), dimensions), dtype=np.float32)
+        self.rows = 0
+        for record in records:
+            self.add(record)
+    
+    def add(self, record: Dict):
+        key = (record["conversation_id"], record["seq"])
+        if key in self.seen:
+            # Saved while the counselor's vectors were loading, so also in the loaded records
+            return False
+        vector = np.frombuffer(record["vector"], dtype=np.float32)
+        if self.rows == len(self.matrix):
+            grown = np.empty((2 * len(self.matrix), self.matrix.shape[1]), dtype=np.float32)
+            grown[:self.rows] = self.matrix[:self.rows]
+            self.matrix = grown
+        self.matrix[self.rows] = vector
+        self.rows += 1
+        self.keys.append(key)
+        self.seen.add(key)
+        self.details.append({"preview": record["preview"], "timestamp": record["timestamp"]})
+        return True
+
+
+class HistoryIndex:
+    """Per-counselor vector index over saved notes, kept current by the database's write path."""
+    
+    def __init__(self, encoder):
+        self.encoder = encoder
+        self.db = None
+        self._lock = threading.Lock()
+        self._counselors: Dict[str, _CounselorVectors] = {}
+        # One load per counselor at a time; notes written during a load are buffered
+        # in ``_pending`` (None once a clear makes the load stale) and merged after it
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._pending: Dict[str, Optional[List[Dict]]] = {}
+        self._stats = {"searches": 0, "loads": 0, "appended": 0, "total_seconds": 0.0}
+    
+    def attach(self, db):
+        """Embed ``db``'s notes with this index's encoder from now on, and follow its writes."""
+        if self.db is db:
+            return
+        self.db = db
+        db.note_encoder = self.encoder
+        db.add_note_listener(self._on_written)
+        with self._lock:
+            self._counselors.clear()
+    
+    def _on_written(self, batch: Dict):
+        counselor_id = batch["metadata"]["counselor_id"]
+        with self._lock:
+            if counselor_id in self._pending:
+                if batch["truncate_from"] is not None:
+                    self._pending[counselor_id] = None
+                elif self._pending[counselor_id] is not None:
+                    self._pending[counselor_id].extend(batch.get("note_vectors", []))
+                return
+            vectors = self._counselors.get(counselor_id)
+            if vectors is None:
+                return
+            if batch["truncate_from"] is not None:
+                # Rare (history cleared); reload from storage on the next search
+                del self._counselors[counselor_id]
+                return
+            for record in batch.get("note_vectors", []):
+                self._stats["appended"] += vectors.add(record)
+    
+    def _vectors(self, counselor_id: str) -> Optional[_CounselorVectors]:
+        with self._lock:
+            vectors = self._counselors.get(counselor_id)
+            if vectors is not None:
+                return vectors
+            load_lock = self._load_locks.setdefault(counselor_id, threading.Lock())
+        
+        with load_lock:
+            with self._lock:
+                vectors = self._counselors.get(counselor_id)
+                if vectors is not None:
+                    return vectors
+                self._pending[counselor_id] = []
+            try:
+                records = self.db.find_note_vectors(counselor_id)
+            finally:
+                with self._lock:
+                    pending = self._pending.pop(counselor_id)
+            
+            if pending is None:
+                # History was cleared during the load; use it once and reload on the next search
+                records = self.db.find_note_vectors(counselor_id)
+            else:
+                records = records + pending
+            if not records:
+                return None
+            vectors = _CounselorVectors(records, len(records[0]["vector"]) // 4)
+            if pending is not None:
+                with self._lock:
+                    self._counselors[counselor_id] = vectors
+                    self._stats["loads"] += 1
+            return vectors
+    
+    def search(
+        self,
+        counselor_id: str,
+        text: str,
+        k: int = 5,
+        conversation_id: Optional[str] = None,
+        exclude: Optional[str] = None,
+    ) -> List[Dict]:
+        """The ``k`` past notes most similar to ``text``, best first.
+        
+        ``conversation_id`` restricts the search to one conversation;
+        ``exclude`` leaves one out (e.g. the conversation being viewed).
+        """
+        if self.db is None or not self.db.available:
+            return []
+        started = time.perf_counter()
+        vectors = self._vectors(counselor_id)
+        if vectors is None:
+            return []
+        
+        query = np.asarray(self.encoder.encode([text]), dtype=np.float32)[0]
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        with self._lock:
+            rows = vectors.rows
+            scores = vectors.matrix[:rows] @ query
+            keys = vectors.keys[:rows]
+            details = vectors.details[:rows]
+        
+        if conversation_id is not None or exclude is not None:
+            keep = np.array([
+                (conversation_id is None or key[0] == conversation_id) and key[0] != exclude
+                for key in keys
+            ], dtype=bool)
+            scores = np.where(keep, scores, -np.inf)
+        
+        k = min(k, rows)
+        top = np.argpartition(-scores, k - 1)[:k] if 0 < k < rows else np.arange(k)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        
+        results = []
+        for i in top:
+            if not np.isfinite(scores[i]):
+                continue
+            key_conversation, seq = keys[i]
+            results.append({
+                "conversation_id": key_conversation,
+                "session_id": key_conversation.partition(":")[2] or key_conversation,
+                "seq": seq,
+                "similarity": float(scores[i]),
+                **details[i],
+            })
+        
+        with self._lock:
+            self._stats["searches"] += 1
+            self._stats["total_seconds"] += time.perf_counter() - started
+        return results
+    
+    def metrics(self) -> Dict:
+        with self._lock:
+            searches = self._stats["searches"]
+            return dict(
+                self._stats,
+                counselors_loaded=len(self._counselors),
+                vectors=sum(vectors.rows for vectors in self._counselors.values()),
+                mean_ms=round(self._stats["total_seconds"] * 1000 / searches, 3) if searches else 0.0,
+            )
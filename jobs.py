@@ -0,0 +1,261 @@
+import itertools
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from models import AssessmentResult, PatientInfo
+from screening import provisional_risk_score
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class AssessmentJob:
+    """One submitted note and the state of its assessment."""
+    
+    def __init__(
+        self,
+        input_text: str,
+        patient_info: Optional[PatientInfo] = None,
+        owner: str = "",
+        on_finish: Optional[Callable[["AssessmentJob"], None]] = None,
+    ):
+        self.id = uuid.uuid4().hex
+        self.input_text = input_text
+        self.owner = owner
+        self.provisional_score = provisional_risk_score(input_text)
+        self.status = QUEUED
+        self.stage: Optional[str] = None
+        self.patient_info = patient_info
+        self.result: Optional[AssessmentResult] = None
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_requested = threading.Event()
+        self.on_finish = on_finish
+        # Set once on_finish has returned, so pollers know the outcome has been handled
+        self.handled = threading.Event()
+    
+    @property
+    def priority(self) -> int:
+        """Lower runs first: notes that screen as higher risk jump the queue."""
+        return -self.provisional_score
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+    
+    def to_dict(self) -> Dict:
+        """Status snapshot for polling."""
+        return {
+            "id": self.id,
+            "owner": self.owner,
+            "status": self.status,
+            "stage": self.stage,
+            "provisional_score": self.provisional_score,
+            "queued_seconds": round((self.started_at or time.time()) - self.submitted_at, 3),
+            "run_seconds": round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else 0.0,
+            "error": self.error,
+        }
+
+
+def job_outcome(job: AssessmentJob) -> Tuple[PatientInfo, AssessmentResult]:
+    """Patient info and result messages that record a finished job."""
+    if job.status == DONE:
+        result = job.result.model_copy()
+    elif job.status == CANCELLED:
+        result = AssessmentResult(error="Assessment cancelled.")
+    else:
+        result = AssessmentResult(error=f"Error processing input: {job.error}. Please try rephrasing your input.")
+    return job.patient_info or PatientInfo(), result
+
+
+class AssessmentJobQueue:
+    """Worker pool that runs assessments in the background, highest provisional risk first.
+    
+    ``submit`` screens the note with ``provisional_risk_score`` and returns a
+    job id immediately; callers poll ``get``/``status`` for the result. Equal
+    priorities run in submission order. Cancelling a queued job removes it
+    before it starts; a running job stops at its next stage boundary, since
+    an in-flight LLM call cannot be interrupted.
+    
+    A job's ``on_finish`` callback runs on the worker (or cancelling) thread
+    once the job is done, failed or cancelled, so its outcome can be stored
+    even if nobody polls for it; finished jobs beyond ``keep_finished`` are
+    forgotten, oldest first.
+    """
+    
+    def __init__(self, agent, workers: int = 4, keep_finished: int = 1000):
+        self.agent = agent
+        self.keep_finished = keep_finished
+        
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._jobs: "OrderedDict[str, AssessmentJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._closed = False
+        
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "high_priority": 0,
+        }
+        
+        self._workers = [
+            threading.Thread(target=self._run, name=f"assessment-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+    
+    def submit(
+        self,
+        input_text: str,
+        patient_info: Optional[PatientInfo] = None,
+        owner: str = "",
+        on_finish: Optional[Callable[[AssessmentJob], None]] = None,
+    ) -> str:
+        """Queue a note for assessment and return its job id; ``on_finish(job)`` is called when it finishes."""
+        if self._closed:
+            raise RuntimeError("Assessment queue is closed")
+        
+        job = AssessmentJob(input_text, patient_info, owner, on_finish)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._stats["submitted"] += 1
+            if job.provisional_score >= 6:
+                self._stats["high_priority"] += 1
+        self._queue.put((job.priority, next(self._order), job.id))
+        return job.id
+    
+    def get(self, job_id: str) -> Optional[AssessmentJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def status(self, job_id: str) -> Optional[Dict]:
+        job = self.get(job_id)
+        return job.to_dict() if job is not None else None
+    
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job; False if it is unknown or already finished."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            job.cancel_requested.set()
+            # Queued jobs are finished here; workers skip them when they are dequeued
+            cancelled = job.status == QUEUED
+            if cancelled:
+                self._finish(job, CANCELLED)
+        if cancelled:
+            self._notify(job)
+        return True
+    
+    def jobs_for(self, owner: str) -> List[AssessmentJob]:
+        """Jobs submitted by ``owner``, oldest first."""
+        with self._lock:
+            return [job for job in self._jobs.values() if job.owner == owner]
+    
+    def forget(self, job_id: str):
+        """Drop a finished job once its result has been collected."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.finished:
+                del self._jobs[job_id]
+    
+    def _finish(self, job: AssessmentJob, status: str, error: Optional[str] = None):
+        # Caller holds self._lock
+        job.status = status
+        job.error = error
+        job.stage = None
+        job.finished_at = time.time()
+        self._stats[{DONE: "completed", FAILED: "failed", CANCELLED: "cancelled"}[status]] += 1
+        
+        finished = [job_id for job_id, j in self._jobs.items() if j.finished]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+    
+    def _notify(self, job: AssessmentJob):
+        # Called without self._lock, the callback may take its time
+        try:
+            if job.on_finish is not None:
+                job.on_finish(job)
+        except Exception as e:
+            print(f"⚠️ Handling the outcome of job {job.id} failed: {e}")
+        finally:
+            job.handled.set()
+    
+    def _run(self):
+        while True:
+            _, _, job_id = self._queue.get()
+            if job_id is None:
+                return
+            
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job.status != QUEUED:
+                    continue
+                job.status = RUNNING
+                job.started_at = time.time()
+            
+            try:
+                self._execute(job)
+            except Exception as e:
+                with self._lock:
+                    self._finish(job, FAILED, error=str(e))
+            self._notify(job)
+    
+    def _execute(self, job: AssessmentJob):
+        if job.patient_info is None:
+            job.stage = "extract_info"
+            job.patient_info = self.agent.extract_patient_info_only(job.input_text)
+        
+        if job.cancel_requested.is_set():
+            with self._lock:
+                self._finish(job, CANCELLED)
+            return
+        
+        job.stage = "assess"
+        result = self.agent.process_with_patient_info(job.input_text, job.patient_info)
+        
+        with self._lock:
+            if job.cancel_requested.is_set():
+                self._finish(job, CANCELLED)
+            else:
+                job.result = result
+                self._finish(job, DONE)
+    
+    def close(self, timeout: Optional[float] = 30.0):
+        """Stop the workers after the jobs already queued; queued jobs still run."""
+        if self._closed:
+            return
+        self._closed = True
+        # Sentinels sort after every real priority, so queued work drains first
+        for _ in self._workers:
+            self._queue.put((float("inf"), next(self._order), None))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+    
+    def metrics(self) -> Dict:
+        """Queue depth, running jobs and counters for monitoring."""
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+            return dict(
+                self._stats,
+                queued=statuses.count(QUEUED),
+                running=statuses.count(RUNNING),
+                workers=len(self._workers),
+            )
@@ -0,0 +1,118 @@
+"""
+In-process BM25 inverted index over the post texts.
+
+Postings are stored CSR-style in flat numpy arrays (term -> slice of doc
+ids and term frequencies), so the index is a few arrays rather than a dict
+per term and scoring a query is a handful of vectorised adds. Terms are
+lowercased words without stemming, so method and medication names match
+exactly.
+"""
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+TOKEN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+STOPWORDS = frozenset("""
+a about after again all also am an and any are as at be because been before being but by can could did do does
+doing dont for from had has have having he her here him his how i if im in into is it its ive just me more most my
+no not now of on or our out over own same she so some such than that the their them then there these they this
+those through to too up very was we were what when where which while who why will with would you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens without stopwords."""
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS and len(token) > 1]
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed corpus, with postings in CSR arrays."""
+    
+    def __init__(self, terms: np.ndarray, indptr: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray,
+                 doc_lengths: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        self.terms = terms
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        
+        n_docs = len(doc_lengths)
+        doc_freq = np.diff(indptr).astype(np.float32)
+        self.idf = np.log1p((n_docs - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+        # Every document empty (e.g. all stopwords) would divide by zero; any positive value gives the same scores then
+        average_length = float(doc_lengths.mean()) if n_docs else 0.0
+        average_length = average_length or 1.0
+        # Per-document part of the BM25 denominator, precomputed once
+        self._length_norm = (k1 * (1 - b + b * doc_lengths / average_length)).astype(np.float32)
+    
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        """Index ``texts``; document ids are their positions."""
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lengths = []
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc_id, count))
+        
+        terms = sorted(postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            indptr[i + 1] = indptr[i] + len(postings[term])
+        doc_ids = np.empty(indptr[-1], dtype=np.int32)
+        tfs = np.empty(indptr[-1], dtype=np.float32)
+        for i, term in enumerate(terms):
+            entries = np.array(postings[term], dtype=np.int64)
+            doc_ids[indptr[i]:indptr[i + 1]] = entries[:, 0]
+            tfs[indptr[i]:indptr[i + 1]] = entries[:, 1]
+        
+        return cls(np.array(terms), indptr, doc_ids, tfs, np.array(doc_lengths, dtype=np.float32), k1, b)
+    
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            np.savez(f, terms=self.terms, indptr=self.indptr, doc_ids=self.doc_ids, tfs=self.tfs,
+                     doc_lengths=self.doc_lengths, params=np.array([self.k1, self.b]))
+    
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path) as arrays:
+            k1, b = arrays["params"]
+            return cls(arrays["terms"], arrays["indptr"], arrays["doc_ids"], arrays["tfs"],
+                       arrays["doc_lengths"], float(k1), float(b))
+    
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+    
+    def term_id(self, term: str) -> Optional[int]:
+        """Position of ``term`` in the sorted term array, or None if it does not occur."""
+        i = int(np.searchsorted(self.terms, term))
+        return i if i < len(self.terms) and self.terms[i] == term else None
+    
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for ``query``; zero where no term matches."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term, count in Counter(tokenize(query)).items():
+            term_id = self.term_id(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end]
+            scores[docs] += count * self.idf[term_id] * tf * (self.k1 + 1) / (tf + self._length_norm[docs])
+        return scores
+    
+    def top_k(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Indices and scores of the ``k`` best matching documents, best first, matches only."""
+        scores = self.scores(query)
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        order = matched[np.argsort(-scores[matched], kind="stable")]
+        return order, scores[order]
@@ -0,0 +1,296 @@
+"""
+Load generator for one assessment node.
+
+Replays counselor notes sampled from the bundled CSV against a
+``CounselorAgent`` backed by ``fakes.FakeChatModel`` (configurable latency
+distribution) and a storage backend (mongomock by default, so no server is
+needed). Every assessment is extracted, scored, advised and saved to its
+counselor's conversation, like one turn in the app.
+
+Two modes, each a sweep of steps:
+
+* open loop (``--rates 2,4,8``): Poisson arrivals at each rate, served by
+  ``--workers`` threads; queueing delay is the wait for a free worker.
+* closed loop (``--concurrency 1,4,16``): that many counselors submit back
+  to back with ``--think-ms`` between notes.
+
+The report is JSON (stdout or ``--output``): per step throughput, queueing
+delay and latency percentiles, plus the saturation point, i.e. the first
+step whose throughput falls short of the offered load (open loop) or
+stops growing (closed loop), or whose p95 latency exceeds ``--slo-ms``.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from models import Conversation
+from post_store import clean_post_text
+
+
+def read_notes(csv_path: str, limit: int = 500, max_chars: int = 1500) -> List[str]:
+    """Post texts from the dataset, trimmed to the length of a counselor note."""
+    csv.field_size_limit(sys.maxsize)
+    notes = []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            notes.append(clean_post_text(row["Post"])[:max_chars])
+            if len(notes) >= limit:
+                break
+    return notes
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of ``values`` (``q`` in 0-100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return round(ordered[rank], 2)
+
+
+def create_database(backend: str, directory: str):
+    """Storage for the run: mongomock, a temporary SQLite file, or the configured backend."""
+    if backend == "mongomock":
+        import mongomock
+        from database import MongoDatabase
+        return MongoDatabase(client=mongomock.MongoClient())
+    if backend == "sqlite":
+        from database import SQLiteDatabase
+        return SQLiteDatabase(path=os.path.join(directory, "loadtest.db"))
+    from database import create_database as create_configured_database
+    return create_configured_database()
+
+
+class LoadTest:
+    """Shared agent, storage and note pool for all steps of a sweep."""
+    
+    def __init__(self, args):
+        from agent import CounselorAgent
+        from fakes import FakeChatModel
+        
+        def fake_llm(seed):
+            return FakeChatModel(
+                latency_ms=args.llm_latency_ms,
+                latency_jitter_ms=args.llm_jitter_ms,
+                latency_distribution=args.llm_distribution,
+                seed=seed,
+            )
+        
+        self.args = args
+        self.agent = CounselorAgent(llm=fake_llm(args.seed), advice_llm=fake_llm(args.seed + 1), load_rag=args.rag)
+        self._tmp = tempfile.TemporaryDirectory()
+        self.db = create_database(args.backend, self._tmp.name)
+        self.notes = read_notes(args.csv, max_chars=args.max_note_chars)
+        self.rng = random.Random(args.seed)
+        self._visits = 0
+        self._lock = threading.Lock()
+        self._conversations: Dict[str, Conversation] = {}
+        self._conversation_locks: Dict[str, threading.Lock] = {}
+    
+    def _next_note(self) -> str:
+        with self._lock:
+            self._visits += 1
+            # A distinct suffix per visit keeps the agent's stage memo from serving repeats
+            return f"{self.rng.choice(self.notes)} (visit {self._visits})"
+    
+    def _conversation(self, counselor: str):
+        with self._lock:
+            if counselor not in self._conversations:
+                self._conversations[counselor] = Conversation(
+                    id=str(uuid.uuid4()), counselor_id=counselor, session_id="loadtest", title=""
+                )
+                self._conversation_locks[counselor] = threading.Lock()
+            return self._conversations[counselor], self._conversation_locks[counselor]
+    
+    def assess(self, counselor: str, arrived: float) -> Dict:
+        """One counselor turn: full assessment, then a synchronous save."""
+        started = time.perf_counter()
+        note = self._next_note()
+        error = None
+        try:
+            patient_info = self.agent.extract_patient_info_only(note)
+            result = self.agent.process_with_patient_info(note, patient_info)
+            
+            conversation, lock = self._conversation(counselor)
+            with lock:
+                conversation.add_message("user", note)
+                conversation.add_message("patient_info", patient_info)
+                conversation.add_message("assistant", result)
+                save_started = time.perf_counter()
+                if not self.db.save_conversation(conversation):
+                    error = "save failed"
+                save_ms = (time.perf_counter() - save_started) * 1000
+        except Exception as e:
+            error = str(e)
+            save_ms = 0.0
+        finished = time.perf_counter()
+        return {
+            "queue_ms": (started - arrived) * 1000,
+            "service_ms": (finished - started) * 1000,
+            "latency_ms": (finished - arrived) * 1000,
+            "save_ms": save_ms,
+            "error": error,
+        }
+    
+    def run_open_loop(self, rate: float) -> Dict:
+        """Poisson arrivals at ``rate`` per second for ``duration`` seconds."""
+        samples = []
+        sample_lock = threading.Lock()
+        arrival_rng = random.Random(self.args.seed)
+        arrivals = 0
+        
+        def task(counselor, arrived):
+            sample = self.assess(counselor, arrived)
+            with sample_lock:
+                samples.append(sample)
+        
+        with ThreadPoolExecutor(max_workers=self.args.workers) as pool:
+            started = time.perf_counter()
+            next_arrival = started
+            while next_arrival - started < self.args.duration:
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                counselor = f"counselor-{arrival_rng.randrange(self.args.counselors)}"
+                pool.submit(task, counselor, time.perf_counter())
+                arrivals += 1
+                next_arrival += arrival_rng.expovariate(rate)
+        elapsed = time.perf_counter() - started
+        
+        return self._summarise(samples, elapsed, offered_rate=rate, arrivals=arrivals)
+    
+    def run_closed_loop(self, concurrency: int) -> Dict:
+        """``concurrency`` counselors submitting back to back for ``duration`` seconds."""
+        samples = []
+        sample_lock = threading.Lock()
+        deadline = time.perf_counter() + self.args.duration
+        
+        def counselor_loop(n):
+            counselor = f"counselor-{n}"
+            while time.perf_counter() < deadline:
+                sample = self.assess(counselor, time.perf_counter())
+                with sample_lock:
+                    samples.append(sample)
+                time.sleep(self.args.think_ms / 1000)
+        
+        started = time.perf_counter()
+        threads = [threading.Thread(target=counselor_loop, args=(n,)) for n in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        
+        return self._summarise(samples, elapsed, concurrency=concurrency, arrivals=len(samples))
+    
+    def _summarise(self, samples: List[Dict], elapsed: float, **step) -> Dict:
+        ok = [sample for sample in samples if sample["error"] is None]
+        summary = dict(step)
+        summary.update({
+            "completed": len(ok),
+            "errors": len(samples) - len(ok),
+            "elapsed_s": round(elapsed, 3),
+            "throughput_per_s": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        })
+        for metric in ("queue_ms", "latency_ms", "service_ms", "save_ms"):
+            values = [sample[metric] for sample in ok]
+            summary[metric] = {
+                "mean": round(sum(values) / len(values), 2) if values else None,
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": round(max(values), 2) if values else None,
+            }
+        return summary
+    
+    def close(self):
+        self._tmp.cleanup()
+
+
+def find_saturation(steps: List[Dict], slo_ms: Optional[float]) -> Optional[Dict]:
+    """First step where the node stops keeping up, with the reason."""
+    previous = None
+    for step in steps:
+        p95 = step["latency_ms"]["p95"]
+        if slo_ms is not None and p95 is not None and p95 > slo_ms:
+            return {"step": step, "reason": f"p95 latency {p95}ms exceeds SLO {slo_ms}ms"}
+        if "offered_rate" in step and step["throughput_per_s"] < 0.9 * step["offered_rate"]:
+            return {"step": step, "reason": "throughput below 90% of the offered rate"}
+        if "concurrency" in step and previous is not None:
+            scale = step["concurrency"] / previous["concurrency"]
+            gain = step["throughput_per_s"] / previous["throughput_per_s"] if previous["throughput_per_s"] else 0
+            # Less than a tenth of the added concurrency turned into throughput
+            if scale > 1 and gain < 1 + 0.1 * (scale - 1):
+                return {"step": step, "reason": "throughput stopped growing with concurrency"}
+        previous = step
+    return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the assessment pipeline with a fake LLM")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--rates", default=None, help="comma separated arrival rates (per second) for an open loop sweep")
+    mode.add_argument("--concurrency", default="1,2,4,8,16", help="comma separated counselor counts for a closed loop sweep")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per step")
+    parser.add_argument("--workers", type=int, default=8, help="open loop: threads serving requests")
+    parser.add_argument("--counselors", type=int, default=50, help="open loop: distinct counselors (conversations)")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="closed loop: pause between a counselor's notes")
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0, help="mean fake LLM latency per call")
+    parser.add_argument("--llm-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--llm-distribution", default="lognormal",
+                        choices=["fixed", "uniform", "normal", "lognormal", "exponential"])
+    parser.add_argument("--backend", default="mongomock", choices=["mongomock", "sqlite", "configured"])
+    parser.add_argument("--rag", action="store_true", help="also load the similar case index")
+    parser.add_argument("--slo-ms", type=float, default=None, help="p95 latency above which a step counts as saturated")
+    parser.add_argument("--csv", default="500_Reddit_users_posts_labels.csv")
+    parser.add_argument("--max-note-chars", type=int, default=1500)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default=None, help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> Dict:
+    args = parse_args(argv)
+    test = LoadTest(args)
+    steps = []
+    try:
+        if args.rates:
+            for rate in [float(value) for value in args.rates.split(",")]:
+                print(f"open loop: {rate}/s for {args.duration}s", file=sys.stderr)
+                steps.append(test.run_open_loop(rate))
+        else:
+            for concurrency in [int(value) for value in args.concurrency.split(",")]:
+                print(f"closed loop: {concurrency} counselors for {args.duration}s", file=sys.stderr)
+                steps.append(test.run_closed_loop(concurrency))
+    finally:
+        test.close()
+    
+    saturation = find_saturation(steps, args.slo_ms)
+    report = {
+        "mode": "open" if args.rates else "closed",
+        "config": vars(args),
+        "steps": steps,
+        "saturation": saturation,
+        "max_throughput_per_s": max((step["throughput_per_s"] for step in steps), default=0.0),
+    }
+    
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
 """
 Pydantic models for the Mental Health Counselor Assistant
 """
+import json
 from enum import Enum
-from typing import List, Optional, Union, Any
+from typing import ClassVar, Dict, List, Optional, Union, Any
 from datetime import datetime
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 from bson import ObjectId
 from typing_extensions import TypedDict
 
@@ -26,8 +27,9 @@ class AgentState(TypedDict):
     input_text: str
     patient_info: Optional['PatientInfo']
     phq8_score: Optional[int]
-    advice: str
-    processed: bool
+    advice: Optional[str]
+    similar_cases: Optional[List[dict]]
+    trace: List[dict]
 
 
 class PatientInfo(BaseModel):
@@ -40,32 +42,238 @@ class PatientInfo(BaseModel):
     social_withdrawal: bool = Field(False, description="True if patient mentions isolation, avoiding people, or staying alone")
     concentration_issues: bool = Field(False, description="True if patient mentions focus problems, memory issues, or difficulty thinking")
     hopelessness: bool = Field(False, description="True if patient mentions despair, suicidal thoughts, or feeling worthless")
+    
+    def to_record(self) -> dict:
+        """Encode as a plain storage dict without a JSON round trip."""
+        return {
+            "age": self.age,
+            "sleep_issues": self.sleep_issues,
+            "appetite_changes": self.appetite_changes,
+            "energy_level": self.energy_level.value,
+            "mood_symptoms": [symptom.value for symptom in self.mood_symptoms],
+            "social_withdrawal": self.social_withdrawal,
+            "concentration_issues": self.concentration_issues,
+            "hopelessness": self.hopelessness,
+        }
+    
+    @classmethod
+    def from_record(cls, record: dict) -> "PatientInfo":
+        """Decode a dict written by ``to_record``, validated so old or hand-edited records cannot bypass the schema."""
+        return cls.model_validate(record)
+
+
+class SimilarCase(BaseModel):
+    """A labelled corpus post returned as similar to the assessed note."""
+    id: int = Field(..., description="Post id in the Reddit dataset")
+    user: str = Field(..., description="Anonymised author of the post")
+    label: str = Field(..., description="Expert risk label of the post")
+    preview: str = Field(..., description="First 200 characters of the post")
+    similarity_score: float = Field(..., description="Cosine similarity to the assessed note")
+
+
+class AssessmentResult(BaseModel):
+    """Structured outcome of one assessment; rendering happens in the view layer."""
+    score: int = Field(0, description="CSSRS severity score (0-10)")
+    severity_level: str = Field("Minimal risk", description="Risk band for the score")
+    patient_info: PatientInfo = Field(default_factory=PatientInfo, description="Patient information the score was based on")
+    advice: str = Field("", description="Clinical guidance in markdown")
+    similar_cases: Optional[List[SimilarCase]] = Field(None, description="Similar labelled cases, None if retrieval was unavailable")
+    timings: Dict[str, float] = Field(default_factory=dict, description="Milliseconds spent per pipeline stage")
+    trace: List[Dict] = Field(default_factory=list, description="Per-stage status of the run that produced this result; not persisted")
+    error: Optional[str] = Field(None, description="Set when the assessment could not be completed")
+    note_seq: Optional[int] = Field(None, description="Sequence number of the note assessed, when other notes may have been saved in between")
+    
+    def to_record(self) -> dict:
+        """Encode as a plain storage dict."""
+        return {
+            "score": self.score,
+            "severity_level": self.severity_level,
+            "patient_info": self.patient_info.to_record(),
+            "advice": self.advice,
+            "similar_cases": [case.model_dump() for case in self.similar_cases] if self.similar_cases is not None else None,
+            "timings": dict(self.timings),
+            "error": self.error,
+            "note_seq": self.note_seq,
+        }
+    
+    @classmethod
+    def from_record(cls, record: dict) -> "AssessmentResult":
+        similar_cases = record.get("similar_cases")
+        return cls.model_construct(
+            score=record["score"],
+            severity_level=record["severity_level"],
+            patient_info=PatientInfo.from_record(record["patient_info"]),
+            advice=record.get("advice", ""),
+            similar_cases=[SimilarCase.model_construct(**case) for case in similar_cases] if similar_cases is not None else None,
+            timings=record.get("timings", {}),
+            error=record.get("error"),
+            note_seq=record.get("note_seq"),
+        )
 
 
 class ChatMessage(BaseModel):
     """Individual chat message in a conversation."""
     role: str = Field(..., description="Message role: user, assistant, or patient_info")
-    content: Union[str, PatientInfo, Any] = Field(..., description="Message content, varies by role")
+    content: Union[str, PatientInfo, AssessmentResult, Any] = Field(..., description="Message content, varies by role")
     timestamp: datetime = Field(default_factory=datetime.utcnow, description="Message timestamp")
     
     class Config:
         arbitrary_types_allowed = True
         json_encoders = {
             datetime: lambda dt: dt.isoformat(),
-            PatientInfo: lambda pi: pi.dict()
+            PatientInfo: lambda pi: pi.dict(),
+            AssessmentResult: lambda result: result.dict()
         }
 
 
+class StoredMessage:
+    """Read-only view over a stored message record.
+    
+    Behaves like ``ChatMessage`` but decodes the content and timestamp only
+    when they are first accessed, so loading long histories does not build
+    a pydantic model per message.
+    """
+    __slots__ = ("_record", "_content", "_timestamp")
+    
+    def __init__(self, record: dict):
+        self._record = record
+        self._content = None
+        self._timestamp = None
+    
+    @property
+    def role(self) -> str:
+        return self._record["role"]
+    
+    @property
+    def seq(self) -> Optional[int]:
+        return self._record.get("seq")
+    
+    @property
+    def content(self) -> Union[str, PatientInfo, AssessmentResult, Any]:
+        if self._content is None:
+            content = self._record["content"]
+            if isinstance(content, str) and self._record.get("content_encoding") == "json":
+                content = json.loads(content)
+            content_type = self._record.get("content_type")
+            if content_type in ("patient_info", "assessment"):
+                try:
+                    model = PatientInfo if content_type == "patient_info" else AssessmentResult
+                    content = model.from_record(content)
+                except Exception:
+                    content = str(content)
+            self._content = content
+        return self._content
+    
+    @property
+    def timestamp(self) -> datetime:
+        if self._timestamp is None:
+            timestamp = self._record["timestamp"]
+            self._timestamp = datetime.fromisoformat(timestamp) if isinstance(timestamp, str) else timestamp
+        return self._timestamp
+    
+    def to_chat_message(self) -> ChatMessage:
+        """Fully validated copy of this message."""
+        return ChatMessage(role=self.role, content=self.content, timestamp=self.timestamp)
+
+
+def severity_level(score: int) -> str:
+    """Convert CSSRS score to suicide severity level."""
+    if score <= 1:
+        return "Minimal risk"
+    elif score <= 3:
+        return "Low risk"
+    elif score <= 5:
+        return "Moderate risk"
+    elif score <= 7:
+        return "High risk"
+    else:
+        return "Severe risk"
+
+
+def severity_band_range(score: int) -> str:
+    """The scores sharing ``score``'s severity level, e.g. "4-5"."""
+    for low, high in ((0, 1), (2, 3), (4, 5), (6, 7)):
+        if score <= high:
+            return f"{low}-{high}"
+    return "8-10"
+
+
+class ConversationRollups(BaseModel):
+    """Aggregates kept up to date as messages are added, so nothing rescans the history."""
+    latest_patient_info: Optional[PatientInfo] = Field(None, description="Most recently extracted patient information")
+    score_history: List[Dict[str, Any]] = Field(default_factory=list, description="Recent CSSRS scores as {score, timestamp}")
+    band_counts: Dict[str, int] = Field(default_factory=dict, description="Assessments per severity level")
+    label_counts: Dict[str, int] = Field(default_factory=dict, description="Similar-case labels returned across assessments")
+    daily_assessments: Dict[str, int] = Field(default_factory=dict, description="Assessments per UTC day (YYYY-MM-DD)")
+    
+    # Oldest scores are dropped beyond this many entries
+    max_score_history: ClassVar[int] = 1000
+    
+    def record_user_message(self, timestamp: datetime):
+        day = timestamp.strftime("%Y-%m-%d")
+        self.daily_assessments[day] = self.daily_assessments.get(day, 0) + 1
+    
+    def record_patient_info(self, patient_info: PatientInfo):
+        self.latest_patient_info = patient_info
+    
+    def record_score(self, score: int, labels: List[str], timestamp: datetime):
+        self.score_history.append({"score": score, "timestamp": timestamp})
+        del self.score_history[:-self.max_score_history]
+        band = severity_level(score)
+        self.band_counts[band] = self.band_counts.get(band, 0) + 1
+        for label in labels:
+            self.label_counts[label] = self.label_counts.get(label, 0) + 1
+    
+    def to_record(self) -> dict:
+        """Encode for storage next to the conversation metadata."""
+        return {
+            "latest_patient_info": self.latest_patient_info.to_record() if self.latest_patient_info else None,
+            "score_history": list(self.score_history),
+            "band_counts": dict(self.band_counts),
+            "label_counts": dict(self.label_counts),
+            "daily_assessments": dict(self.daily_assessments),
+        }
+    
+    @classmethod
+    def from_record(cls, record: dict) -> "ConversationRollups":
+        latest = record.get("latest_patient_info")
+        score_history = [
+            dict(entry, timestamp=datetime.fromisoformat(entry["timestamp"]) if isinstance(entry["timestamp"], str) else entry["timestamp"])
+            for entry in record.get("score_history", [])
+        ]
+        return cls(
+            latest_patient_info=PatientInfo.from_record(latest) if latest else None,
+            score_history=score_history,
+            band_counts=record.get("band_counts", {}),
+            label_counts=record.get("label_counts", {}),
+            daily_assessments=record.get("daily_assessments", {}),
+        )
+
+
+def conversation_key(counselor_id: str, session_id: str) -> str:
+    """Build the storage key for a counselor's session."""
+    return f"{counselor_id}:{session_id}"
+
+
 class Conversation(BaseModel):
     """Complete conversation thread with metadata."""
     id: Optional[str] = Field(None, description="MongoDB ObjectId as string")
+    counselor_id: str = Field("default", description="Counselor who owns the conversation")
     session_id: str = Field(..., description="Unique session identifier")
     title: str = Field(..., description="Conversation title from first user message preview")
-    messages: List[ChatMessage] = Field(default_factory=list, description="List of chat messages")
+    messages: List[Union[ChatMessage, StoredMessage]] = Field(default_factory=list, description="List of chat messages; loaded history is kept as lazy StoredMessage views")
     created_at: datetime = Field(default_factory=datetime.utcnow, description="Conversation creation timestamp")
     updated_at: datetime = Field(default_factory=datetime.utcnow, description="Last update timestamp")
     total_assessments: int = Field(0, description="Total number of assessments in conversation")
     last_phq_score: Optional[int] = Field(None, description="Most recent PHQ-8 score")
+    rollups: ConversationRollups = Field(default_factory=ConversationRollups, description="Aggregates maintained on write")
+    
+    # Storage sequence number of messages[0]; older messages are loaded on demand
+    _seq_offset: int = PrivateAttr(default=0)
+    # Number of leading messages already written to storage
+    _persisted_count: int = PrivateAttr(default=0)
+    # Stored messages from this sequence number onwards must be deleted on the next save
+    _truncate_from: Optional[int] = PrivateAttr(default=None)
     
     class Config:
         arbitrary_types_allowed = True
@@ -74,7 +282,7 @@ class Conversation(BaseModel):
             ObjectId: str
         }
     
-    def add_message(self, role: str, content: Union[str, PatientInfo, Any]):
+    def add_message(self, role: str, content: Union[str, PatientInfo, AssessmentResult, Any]):
         """Add a new message to the conversation."""
         message = ChatMessage(role=role, content=content)
         self.messages.append(message)
@@ -83,41 +291,73 @@ class Conversation(BaseModel):
         # Update metadata
         if role == "user":
             self.total_assessments += 1
+            self.rollups.record_user_message(message.timestamp)
             if not self.title:  # Set title from first user message
                 preview = content[:50] if isinstance(content, str) else "Assessment"
                 self.title = preview + "..." if len(str(content)) > 50 else str(content)
+        elif role == "patient_info" and isinstance(content, PatientInfo):
+            self.rollups.record_patient_info(content)
+        elif role == "assistant" and isinstance(content, AssessmentResult) and content.error is None:
+            self.last_phq_score = content.score
+            labels = [case.label for case in content.similar_cases or []]
+            self.rollups.record_score(content.score, labels, message.timestamp)
+    
+    @property
+    def key(self) -> str:
+        """Storage key of the conversation, unique per counselor and session."""
+        return conversation_key(self.counselor_id, self.session_id)
+    
+    @property
+    def has_older_messages(self) -> bool:
+        """True if older messages exist in storage but have not been loaded yet."""
+        return self._seq_offset > 0
+    
+    def prepend_messages(self, messages: List[Union[ChatMessage, StoredMessage]]):
+        """Insert a page of older, already persisted messages before the loaded ones."""
+        self.messages[:0] = messages
+        self._seq_offset -= len(messages)
+        self._persisted_count += len(messages)
+    
+    def clear_history(self):
+        """Drop every message, including pages that were never loaded."""
+        self.messages = []
+        self.total_assessments = 0
+        self.last_phq_score = None
+        self.rollups = ConversationRollups()
+        self._truncate_from = 0
+        self._seq_offset = 0
+        self._persisted_count = 0
+        self.updated_at = datetime.utcnow()
     
     def get_patient_summary(self) -> str:
         """Generate summary of latest patient information."""
-        # Find the most recent patient_info message
-        for message in reversed(self.messages):
-            if message.role == "patient_info" and isinstance(message.content, PatientInfo):
-                patient_info = message.content
-                summary_parts = []
-                
-                if patient_info.age:
-                    summary_parts.append(f"Age {patient_info.age}")
-                
-                # Count indicators
-                indicators = []
-                if patient_info.sleep_issues:
-                    indicators.append("Sleep")
-                if patient_info.appetite_changes:
-                    indicators.append("Appetite")
-                if patient_info.social_withdrawal:
-                    indicators.append("Social")
-                if patient_info.concentration_issues:
-                    indicators.append("Focus")
-                if patient_info.hopelessness:
-                    indicators.append("Hopelessness")
-                
-                if indicators:
-                    summary_parts.append(f"Issues: {', '.join(indicators)}")
-                
-                if patient_info.mood_symptoms:
-                    symptoms = [symptom.value for symptom in patient_info.mood_symptoms[:2]]
-                    summary_parts.append(f"Mood: {', '.join(symptoms)}")
-                
-                return " • ".join(summary_parts) if summary_parts else "Basic assessment"
+        patient_info = self.rollups.latest_patient_info
+        if patient_info is None:
+            return "No patient data"
+        
+        summary_parts = []
+        
+        if patient_info.age:
+            summary_parts.append(f"Age {patient_info.age}")
+        
+        # Count indicators
+        indicators = []
+        if patient_info.sleep_issues:
+            indicators.append("Sleep")
+        if patient_info.appetite_changes:
+            indicators.append("Appetite")
+        if patient_info.social_withdrawal:
+            indicators.append("Social")
+        if patient_info.concentration_issues:
+            indicators.append("Focus")
+        if patient_info.hopelessness:
+            indicators.append("Hopelessness")
+        
+        if indicators:
+            summary_parts.append(f"Issues: {', '.join(indicators)}")
+        
+        if patient_info.mood_symptoms:
+            symptoms = [symptom.value for symptom in patient_info.mood_symptoms[:2]]
+            summary_parts.append(f"Mood: {', '.join(symptoms)}")
         
-        return "No patient data" 
\ No newline at end of file
+        return " • ".join(summary_parts) if summary_parts else "Basic assessment"
@@ -0,0 +1,128 @@
+"""
+Precomputed top-k neighbour graph over the post embeddings.
+
+Looking up the cases related to a post should not re-encode the post's
+text and scan the corpus again, since its embedding is already there. The
+graph stores each post's ``k`` most similar other posts (row indices and
+cosine scores), computed once with blocked matrix products so memory stays
+at ``block`` rows by the corpus size. A lookup is a row read.
+
+Adding posts updates the graph incrementally: the new rows are scored
+against the whole corpus, and the existing rows only against the new
+posts, merging those candidates into their current top-k.
+"""
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+# Neighbours kept per post
+NEIGHBORS = 10
+
+# Rows scored per matrix product; memory is block x corpus size float32s
+BLOCK_ROWS = 1024
+
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k_rows(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Column indices and values of the ``k`` largest scores in every row, best first."""
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.tile(np.arange(k), (len(scores), 1))
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+class NeighborGraph:
+    """Each post's ``k`` nearest other posts by cosine similarity."""
+    
+    def __init__(self, indices: np.ndarray, scores: np.ndarray, source: Optional[Dict] = None):
+        self.indices = indices
+        self.scores = scores
+        self.source = source or {}
+    
+    def __len__(self) -> int:
+        return len(self.indices)
+    
+    @property
+    def k(self) -> int:
+        return self.indices.shape[1]
+    
+    @classmethod
+    def build(cls, embeddings: np.ndarray, k: int = NEIGHBORS, block: int = BLOCK_ROWS,
+              source: Optional[Dict] = None) -> "NeighborGraph":
+        vectors = _normalise(embeddings)
+        rows = len(vectors)
+        k = min(k, max(rows - 1, 0))
+        indices = np.empty((rows, k), dtype=np.int32)
+        scores = np.empty((rows, k), dtype=np.float32)
+        for start in range(0, rows, block):
+            end = min(start + block, rows)
+            similarities = vectors[start:end] @ vectors.T
+            # A post is not its own neighbour
+            similarities[np.arange(end - start), np.arange(start, end)] = -np.inf
+            indices[start:end], scores[start:end] = _top_k_rows(similarities, k)
+        return cls(indices, scores, source)
+    
+    def add(self, embeddings: np.ndarray, new_embeddings: np.ndarray, k: int = NEIGHBORS, block: int = BLOCK_ROWS,
+            source: Optional[Dict] = None):
+        """Extend the graph with ``new_embeddings``, appended after ``embeddings`` (the current corpus)."""
+        old = _normalise(embeddings)
+        new = _normalise(new_embeddings)
+        rows, added = len(old), len(new)
+        everything = np.concatenate([old, new])
+        # A graph cut short by a corpus smaller than k can now grow towards k
+        k = min(k if self.k >= rows - 1 else self.k, rows + added - 1)
+        
+        # Existing rows: merge the new posts into their current top-k
+        indices = np.empty((rows, k), dtype=np.int32)
+        scores = np.empty((rows, k), dtype=np.float32)
+        for start in range(0, rows, block):
+            end = min(start + block, rows)
+            new_columns = np.broadcast_to(np.arange(rows, rows + added, dtype=np.int32), (end - start, added))
+            candidates = np.concatenate([self.indices[start:end], new_columns], axis=1)
+            candidate_scores = np.concatenate([self.scores[start:end], old[start:end] @ new.T], axis=1)
+            top, top_scores = _top_k_rows(candidate_scores, k)
+            indices[start:end] = np.take_along_axis(candidates, top, axis=1)
+            scores[start:end] = top_scores
+        
+        # New rows: scored against the whole corpus
+        new_indices = np.empty((added, k), dtype=np.int32)
+        new_scores = np.empty((added, k), dtype=np.float32)
+        for start in range(0, added, block):
+            end = min(start + block, added)
+            similarities = new[start:end] @ everything.T
+            similarities[np.arange(end - start), np.arange(rows + start, rows + end)] = -np.inf
+            new_indices[start:end], new_scores[start:end] = _top_k_rows(similarities, k)
+        
+        self.indices = np.concatenate([indices, new_indices])
+        self.scores = np.concatenate([scores, new_scores])
+        if source is not None:
+            self.source = source
+    
+    def neighbors(self, index: int, k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Row indices and similarities of the ``k`` posts nearest to row ``index``, best first."""
+        k = self.k if k is None else min(k, self.k)
+        return self.indices[index, :k], self.scores[index, :k]
+    
+    def save(self, path: str):
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, indices=self.indices, scores=self.scores,
+                     source_size=self.source.get("size", -1), source_mtime=self.source.get("mtime", -1.0))
+        os.replace(path + ".tmp", path)
+    
+    @classmethod
+    def load(cls, path: str) -> "NeighborGraph":
+        with np.load(path) as arrays:
+            source = {"size": int(arrays["source_size"]), "mtime": float(arrays["source_mtime"])}
+            return cls(arrays["indices"], arrays["scores"], source)
@@ -0,0 +1,353 @@
+"""
+Local repair of the patient information the extraction LLM returns.
+
+Most extraction outputs that fail strict parsing are nearly right: wrapped
+in a code fence, a trailing comma, Python literals, ``"Low"`` or
+``"fatigued"`` for an energy level, ``"sad"`` for a mood symptom, a missing
+field. ``PatientInfoParser`` fixes those in-process and only falls back to
+LangChain's ``OutputFixingParser`` (another full LLM call) when the local
+repair cannot produce a valid ``PatientInfo``. Counters record which path
+each parse took.
+
+Local repair never decides a risk flag the model did not state: output
+that was cut off, or that leaves a yes/no field missing, null or
+"unknown", goes to the LLM instead of defaulting the flag to False.
+"""
+import ast
+import json
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from models import EnergyLevel, MoodSymptom, PatientInfo
+
+
+FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.S)
+
+FIELD_ALIASES = {
+    "patient_age": "age",
+    "age_years": "age",
+    "sleep": "sleep_issues",
+    "sleep_problems": "sleep_issues",
+    "sleep_issue": "sleep_issues",
+    "insomnia": "sleep_issues",
+    "appetite": "appetite_changes",
+    "appetite_change": "appetite_changes",
+    "energy": "energy_level",
+    "energy_levels": "energy_level",
+    "mood": "mood_symptoms",
+    "moods": "mood_symptoms",
+    "mood_symptom": "mood_symptoms",
+    "symptoms": "mood_symptoms",
+    "withdrawal": "social_withdrawal",
+    "isolation": "social_withdrawal",
+    "social_isolation": "social_withdrawal",
+    "concentration": "concentration_issues",
+    "concentration_problems": "concentration_issues",
+    "hopeless": "hopelessness",
+}
+
+# Checked in order against the words of the value; the first group with a match wins
+ENERGY_WORDS = [
+    (EnergyLevel.low, ("low", "fatigue", "fatigued", "tired", "exhausted", "lethargic", "decreased", "reduced", "drained")),
+    (EnergyLevel.high, ("high", "restless", "agitated", "agitation", "elevated", "increased", "hyper", "manic")),
+]
+
+MOOD_WORDS = {
+    MoodSymptom.sadness: ("sad", "sadness", "depressed", "depression", "down", "low", "crying", "tearful", "grief"),
+    MoodSymptom.anxiety: ("anxiety", "anxious", "worry", "worried", "nervous", "panic", "fear", "fearful", "tense"),
+    MoodSymptom.irritability: ("irritability", "irritable", "irritated", "anger", "angry", "frustrated", "frustration"),
+    MoodSymptom.emptiness: ("emptiness", "empty", "numb", "numbness", "hollow", "void"),
+}
+
+TRUE_WORDS = {"true", "yes", "y", "1", "present", "reported", "positive", "t"}
+# Only explicit negatives; "unknown", "not mentioned", null and the like stay unreadable
+FALSE_WORDS = {"false", "no", "n", "0", "none", "absent", "negative", "f"}
+
+# First words that settle a flag written as prose, e.g. "Yes - passive ideation"
+TRUE_LEADS = {"true", "yes", "y", "present", "reported", "reports", "positive", "endorses", "endorsed"}
+FALSE_LEADS = {"false", "no", "none", "absent", "negative", "denies", "denied"}
+
+
+def _json_candidate(text: str) -> str:
+    """The JSON object in ``text``, without surrounding prose or code fences."""
+    match = FENCE.search(text)
+    if match:
+        text = match.group(1)
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("no JSON object in the output")
+    end = text.rfind("}")
+    return text[start:end + 1] if end > start else text[start:]
+
+
+def _close_truncated(text: str) -> str:
+    """Close the strings, arrays and objects left open by output cut off mid-object."""
+    stack = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    
+    if in_string:
+        text += '"'
+    text = text.rstrip().rstrip(",")
+    if text.endswith(":"):
+        text += " null"
+    return text + "".join(reversed(stack))
+
+
+def _python_literals(text: str) -> str:
+    return re.sub(r"\bNone\b", "null", re.sub(r"\bFalse\b", "false", re.sub(r"\bTrue\b", "true", text)))
+
+
+# Applied cumulatively until the text parses; each is a no-op on text without that defect.
+# single_quotes only fires on text without double quotes, so it must run before unquoted_keys adds some.
+JSON_FIXES = [
+    ("smart_quotes", lambda text: text.translate(str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"}))),
+    ("comments", lambda text: re.sub(r"^\s*//.*$|/\*.*?\*/", "", text, flags=re.M | re.S)),
+    ("single_quotes", lambda text: text.replace("'", '"') if '"' not in text else text),
+    ("truncated", _close_truncated),
+    ("trailing_commas", lambda text: re.sub(r",\s*([}\]])", r"\1", text)),
+    ("python_literals", _python_literals),
+    ("unquoted_keys", lambda text: re.sub(r"([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)\s*:", r'\1"\2":', text)),
+]
+
+
+def coerce_json(text: str) -> Tuple[Any, List[str]]:
+    """Parse a nearly-JSON object, returning the value and the names of the fixes it needed."""
+    candidate = _json_candidate(text)
+    applied = []
+    for name, fix in [(None, None)] + JSON_FIXES:
+        if fix is not None:
+            fixed = fix(candidate)
+            if fixed == candidate:
+                continue
+            candidate = fixed
+            applied.append(name)
+        try:
+            return json.loads(candidate), applied
+        except json.JSONDecodeError:
+            continue
+    
+    # Python dict syntax with quotes JSON cannot take, e.g. 'don't' inside single quotes
+    try:
+        value = ast.literal_eval(re.sub(r"\bnull\b", "None", re.sub(r"\bfalse\b", "False", re.sub(r"\btrue\b", "True", candidate))))
+    except (ValueError, SyntaxError) as e:
+        raise ValueError(f"output is not repairable JSON: {e}") from e
+    return value, applied + ["python_dict"]
+
+
+def _field_name(key: Any) -> str:
+    name = re.sub(r"[^a-z0-9]+", "_", str(key).lower()).strip("_")
+    return FIELD_ALIASES.get(name, name)
+
+
+def _words(value: str) -> List[str]:
+    return re.findall(r"[a-z]+", value.lower())
+
+
+def _to_bool(value: Any) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in TRUE_WORDS:
+            return True
+        if value in FALSE_WORDS:
+            return False
+        words = _words(value)
+        if words and words[0] in TRUE_LEADS:
+            return True
+        if words and words[0] in FALSE_LEADS:
+            return False
+        return None
+    if isinstance(value, (list, dict)):
+        return bool(value)
+    return None
+
+
+def _to_age(value: Any) -> Optional[int]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        age = int(round(value))
+    elif isinstance(value, str):
+        match = re.search(r"\d+", value)
+        if not match:
+            return None
+        age = int(match.group())
+    else:
+        return None
+    return age if 0 < age < 130 else None
+
+
+def _to_energy(value: Any) -> EnergyLevel:
+    words = set(_words(value)) if isinstance(value, str) else set()
+    for level, synonyms in ENERGY_WORDS:
+        if words.intersection(synonyms):
+            return level
+    return EnergyLevel.normal
+
+
+def _to_moods(value: Any) -> List[MoodSymptom]:
+    if isinstance(value, str):
+        items = re.split(r",|;|/|\band\b", value)
+    elif isinstance(value, list):
+        items = [item for item in value if isinstance(item, str)]
+    else:
+        items = []
+    
+    symptoms = []
+    for item in items:
+        words = set(_words(item))
+        for symptom, synonyms in MOOD_WORDS.items():
+            if words.intersection(synonyms) and symptom not in symptoms:
+                symptoms.append(symptom)
+    return symptoms
+
+
+def normalise_patient_info(data: Dict) -> Tuple[Dict, List[str]]:
+    """Map an extraction dict onto ``PatientInfo`` fields, returning it and what had to change."""
+    changes = []
+    fields = PatientInfo.model_fields
+    
+    # Unwrap {"patient_info": {...}} or an echoed schema's {"properties": {...}}
+    for _ in range(2):
+        if len(data) == 1 and not fields.keys() & {_field_name(key) for key in data}:
+            inner = next(iter(data.values()))
+            if isinstance(inner, dict):
+                data = inner
+                changes.append("unwrapped")
+    
+    normalised = {}
+    for key, value in data.items():
+        name = _field_name(key)
+        if name not in fields:
+            changes.append("unknown_field")
+            continue
+        if name != key:
+            changes.append("renamed_field")
+        normalised[name] = value
+    
+    # (already valid, coerce) per field; coercions return None for values with no sensible reading
+    rules = {
+        "age": (lambda value: value is None or (isinstance(value, int) and not isinstance(value, bool)), _to_age),
+        "energy_level": (lambda value: value in EnergyLevel._value2member_map_, _to_energy),
+        "mood_symptoms": (lambda value: isinstance(value, list)
+                          and all(item in MoodSymptom._value2member_map_ for item in value), _to_moods),
+    }
+    for name, field in fields.items():
+        if field.annotation is bool:
+            rules[name] = (lambda value: isinstance(value, bool), _to_bool)
+    
+    for name, (valid, coerce) in rules.items():
+        if name not in normalised or valid(normalised[name]):
+            continue
+        coerced = coerce(normalised[name])
+        if coerced is None and name != "age":
+            # Defaulting an unreadable risk flag to False would hide it; let the LLM fixing parser decide
+            raise ValueError(f"cannot read {name} from {normalised[name]!r}")
+        else:
+            normalised[name] = coerced
+            changes.append("enum_spelling" if name in ("energy_level", "mood_symptoms") else "coerced_value")
+    
+    for name, field in fields.items():
+        if name not in normalised:
+            if field.annotation is bool:
+                raise ValueError(f"{name} is missing")
+            normalised[name] = field.get_default(call_default_factory=True)
+            changes.append("default_filled")
+    return normalised, changes
+
+
+def repair_patient_info(text: str) -> Tuple[PatientInfo, List[str]]:
+    """Build a ``PatientInfo`` from malformed extraction output without calling the LLM."""
+    data, fixes = coerce_json(text)
+    if "truncated" in fixes:
+        # The fields after the cut are unknown, not absent
+        raise ValueError("output was cut off")
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+    data, changes = normalise_patient_info(data)
+    return PatientInfo.model_validate(data), fixes + changes
+
+
+def _exact_fields(text: str) -> bool:
+    """Whether ``text`` is one complete JSON object with exactly the ``PatientInfo`` fields."""
+    try:
+        data = json.loads(_json_candidate(text))
+    except ValueError:
+        return False
+    return isinstance(data, dict) and data.keys() == PatientInfo.model_fields.keys()
+
+
+class PatientInfoParser:
+    """Strict parse, then local repair, then the LLM fixing parser as a last resort."""
+    
+    def __init__(self, parser, fixing_parser=None):
+        self.parser = parser
+        self.fixing_parser = fixing_parser
+        self._lock = threading.Lock()
+        self._paths = {"strict": 0, "local": 0, "llm": 0, "failed": 0}
+        self._repairs: Dict[str, int] = {}
+    
+    def _count(self, path: str, repairs: List[str] = ()):
+        with self._lock:
+            self._paths[path] += 1
+            for repair in repairs:
+                self._repairs[repair] = self._repairs.get(repair, 0) + 1
+    
+    def parse(self, text: str) -> PatientInfo:
+        try:
+            result = self.parser.parse(text)
+            # The strict parser reads cut-off JSON and pydantic defaults missing or misnamed fields, so
+            # only accept output that states every field
+            if _exact_fields(text):
+                self._count("strict")
+                return result
+        except (ValueError, ValidationError, TypeError):
+            pass
+        
+        try:
+            result, repairs = repair_patient_info(text)
+            self._count("local", repairs)
+            return result
+        except (ValueError, ValidationError, TypeError) as e:
+            if self.fixing_parser is None:
+                self._count("failed")
+                raise
+            print(f"Local repair of extraction output failed ({e}), asking the LLM")
+        
+        try:
+            result = self.fixing_parser.parse(text)
+        except Exception:
+            self._count("failed")
+            raise
+        self._count("llm")
+        return result
+    
+    def metrics(self) -> Dict:
+        with self._lock:
+            total = sum(self._paths.values())
+            return {
+                **self._paths,
+                "parses": total,
+                "llm_repair_rate": round(self._paths["llm"] / total, 4) if total else 0.0,
+                "repairs": dict(self._repairs),
+            }
@@ -0,0 +1,253 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from database import Database
+from models import Conversation
+
+
+def merge_batches(older: Dict, newer: Dict) -> Dict:
+    """Coalesce two pending save batches for the same conversation into one."""
+    messages = older["messages"]
+    truncate_from = older["truncate_from"]
+    
+    if newer["truncate_from"] is not None:
+        messages = [record for record in messages if record["seq"] < newer["truncate_from"]]
+        truncate_from = newer["truncate_from"] if truncate_from is None else min(truncate_from, newer["truncate_from"])
+    
+    # A later batch may re-send a sequence number (e.g. after a truncation), last one wins
+    by_seq = {record["seq"]: record for record in messages}
+    for record in newer["messages"]:
+        by_seq[record["seq"]] = record
+    
+    return {
+        "conversation_id": older["conversation_id"],
+        "truncate_from": truncate_from,
+        "messages": [by_seq[seq] for seq in sorted(by_seq)],
+        "metadata": newer["metadata"],
+        "created_at": older["created_at"],
+        "seq_shift": older.get("seq_shift", 0),
+    }
+
+
+def _rewind(conversation: Conversation, failure: Dict):
+    """Mark the writes of a failed batch unsaved again, so the next save resends them."""
+    if failure["from_seq"] is not None:
+        conversation._persisted_count = max(0, min(conversation._persisted_count, failure["from_seq"] - conversation._seq_offset))
+    if failure["truncate_from"] is not None:
+        current = conversation._truncate_from
+        conversation._truncate_from = failure["truncate_from"] if current is None else min(current, failure["truncate_from"])
+
+
+class WriteBehindQueue:
+    """Background writer that persists conversations off the Streamlit script thread.
+    
+    ``submit`` snapshots the pending writes and returns immediately. A daemon
+    thread waits ``flush_interval`` seconds to gather more saves, coalesces
+    repeated saves of the same conversation and writes everything with
+    ``Database.write_batches``. Transient failures are retried with
+    exponential backoff; the queue is flushed at interpreter shutdown.
+    
+    ``submit`` marks the conversation saved straight away, so a batch that
+    fails permanently is remembered per conversation: the next ``submit``
+    of that conversation rewinds its saved position and sends the messages
+    again, and ``failed`` reports the conversations with unsaved writes.
+    Likewise, when storage moves a save after another writer's messages
+    (see ``Database._place_batch``), the next ``submit`` moves the
+    conversation's sequence numbers on to match.
+    """
+    
+    def __init__(
+        self,
+        db: Database,
+        flush_interval: float = 0.2,
+        retry_backoff: float = 0.5,
+        max_backoff: float = 10.0,
+    ):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        
+        self._pending: "OrderedDict[str, Dict]" = OrderedDict()
+        self._enqueued_at: Dict[str, float] = {}
+        self._in_flight = 0
+        # conversation key -> {"from_seq", "truncate_from", "error"} of writes that failed permanently
+        self._failed: Dict[str, Dict] = {}
+        # conversation key -> (stored end, metadata) of its last save that storage moved after another writer's
+        self._moved: Dict[str, tuple] = {}
+        self._writing = set()
+        self._closed = False
+        self._condition = threading.Condition()
+        
+        self._stats = {
+            "submitted": 0,
+            "coalesced": 0,
+            "flushes": 0,
+            "written_batches": 0,
+            "written_messages": 0,
+            "retries": 0,
+            "dropped_batches": 0,
+            "last_flush_ms": 0.0,
+        }
+        
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+    
+    def submit(self, conversation: Conversation) -> bool:
+        """Queue the unsaved part of ``conversation`` for writing."""
+        if not self.db.available or self._closed:
+            return False
+        
+        with self._condition:
+            failure = self._failed.pop(conversation.key, None)
+            moved = None
+            # Only once everything this conversation submitted has been written
+            if conversation.key not in self._pending and conversation.key not in self._writing:
+                moved = self._moved.pop(conversation.key, None)
+        if failure is not None:
+            _rewind(conversation, failure)
+        if moved is not None:
+            moved_end, metadata = moved
+            shift = moved_end - (conversation._seq_offset + conversation._persisted_count)
+            if shift > 0:
+                self.db.apply_shift(conversation, shift, metadata)
+        
+        batch = self.db.prepare_save(conversation)
+        self.db.mark_saved(conversation)
+        
+        with self._condition:
+            self._enqueue(batch)
+            self._stats["submitted"] += 1
+            self._condition.notify()
+        return True
+    
+    def _enqueue(self, batch: Dict):
+        key = batch["conversation_id"]
+        if key in self._pending:
+            older = self._pending[key]
+            if older.get("seq_shift") and not batch.get("seq_shift") and batch["truncate_from"] is None and batch["messages"]:
+                # A retried batch storage already moved: this one continues after it
+                self.db._shift_batch(batch, older["seq_shift"], older["metadata"])
+            self._pending[key] = merge_batches(older, batch)
+            self._stats["coalesced"] += 1
+        else:
+            self._pending[key] = batch
+            self._enqueued_at[key] = time.monotonic()
+    
+    def _run(self):
+        backoff = self.retry_backoff
+        
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending and self._closed:
+                    return
+            
+            # Let repeated saves from the same script run pile up and coalesce
+            if not self._closed:
+                time.sleep(self.flush_interval)
+            
+            with self._condition:
+                batches = self._pending
+                enqueued_at = self._enqueued_at
+                self._pending = OrderedDict()
+                self._enqueued_at = {}
+                self._in_flight = len(batches)
+                self._writing = set(batches)
+            
+            started = time.perf_counter()
+            try:
+                self.db.write_batches(list(batches.values()))
+                failed = None
+            except Exception as e:
+                failed = e
+            
+            with self._condition:
+                self._in_flight = 0
+                self._writing = set()
+                self._stats["flushes"] += 1
+                self._stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+                
+                if failed is None:
+                    self._stats["written_batches"] += len(batches)
+                    self._stats["written_messages"] += sum(len(b["messages"]) for b in batches.values())
+                    for key, batch in batches.items():
+                        if batch.get("seq_shift"):
+                            self._moved[key] = (batch["messages"][-1]["seq"] + 1, batch["metadata"])
+                    backoff = self.retry_backoff
+                elif self.db.is_transient_error(failed):
+                    # Put the failed batches back in front of anything submitted meanwhile
+                    print(f"Warning: transient write failure, retrying in {backoff:.1f}s: {failed}")
+                    self._stats["retries"] += 1
+                    newer, newer_enqueued = self._pending, self._enqueued_at
+                    self._pending, self._enqueued_at = batches, enqueued_at
+                    for batch in newer.values():
+                        self._enqueue(batch)
+                    for key, at in newer_enqueued.items():
+                        self._enqueued_at[key] = min(self._enqueued_at.get(key, at), at)
+                else:
+                    print(f"Error: {len(batches)} conversation writes failed, they are resent on the next save: {failed}")
+                    self._stats["dropped_batches"] += len(batches)
+                    for key, batch in batches.items():
+                        self._record_failure(key, batch, failed)
+                
+                self._condition.notify_all()
+            
+            if failed is not None and self.db.is_transient_error(failed):
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+    
+    def _record_failure(self, key: str, batch: Dict, error: Exception):
+        # In the conversation's numbering, before any move by storage
+        seqs = [record["seq"] - batch.get("seq_shift", 0) for record in batch["messages"]]
+        failure = self._failed.setdefault(key, {"from_seq": None, "truncate_from": None})
+        failure["error"] = str(error)
+        for field, value in (("from_seq", min(seqs) if seqs else None), ("truncate_from", batch["truncate_from"])):
+            if value is not None:
+                failure[field] = value if failure[field] is None else min(failure[field], value)
+    
+    def failed(self, key: Optional[str] = None) -> Dict[str, str]:
+        """Conversations (or just ``key``) whose writes failed and are not saved yet, with the error."""
+        with self._condition:
+            return {
+                failed_key: failure["error"] for failed_key, failure in self._failed.items()
+                if key is None or failed_key == key
+            }
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every submitted write has been attempted; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+    
+    def close(self, timeout: Optional[float] = 30.0):
+        """Stop accepting writes and flush what is queued."""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+    
+    def metrics(self) -> Dict:
+        """Queue depth, write lag and counters for monitoring."""
+        with self._condition:
+            oldest = min(self._enqueued_at.values()) if self._enqueued_at else None
+            return dict(
+                self._stats,
+                queue_depth=len(self._pending),
+                pending_messages=sum(len(b["messages"]) for b in self._pending.values()),
+                in_flight=self._in_flight,
+                failed_conversations=len(self._failed),
+                lag_seconds=round(time.monotonic() - oldest, 3) if oldest is not None else 0.0,
+            )
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+
+def fingerprint(value: Any) -> str:
+    """Stable digest of a stage input, used as part of the memo key."""
+    if isinstance(value, BaseModel):
+        payload = value.model_dump_json()
+    else:
+        payload = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class Stage:
+    """A single node in the assessment pipeline.
+    
+    A stage reads the named ``inputs`` from the pipeline state, calls ``fn``
+    with them as keyword arguments and stores the result under ``output``.
+    If ``fn`` raises one of ``errors``, ``fallback`` provides the value and
+    the result is not memoised.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        inputs: List[str],
+        output: str,
+        fallback: Optional[Callable[[], Any]] = None,
+        errors: Tuple[Type[BaseException], ...] = (),
+    ):
+        self.name = name
+        self.fn = fn
+        self.inputs = inputs
+        self.output = output
+        self.fallback = fallback
+        self.errors = errors
+
+
+class Pipeline:
+    """Declarative stage graph whose nodes memoise outputs keyed by their exact inputs."""
+    
+    def __init__(self, stages: List[Stage], cache_size: int = 256):
+        self.stages = stages
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        
+        produced = set()
+        for stage in stages:
+            produced.add(stage.output)
+        self.external_inputs = sorted({
+            name for stage in stages for name in stage.inputs if name not in produced
+        })
+    
+    def stage(self, name: str) -> Stage:
+        """Look up a stage by name."""
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(name)
+    
+    def _cache_key(self, stage: Stage, state: Dict) -> Tuple[str, str]:
+        digest = hashlib.sha256()
+        for name in stage.inputs:
+            digest.update(name.encode("utf-8"))
+            digest.update(fingerprint(state.get(name)).encode("utf-8"))
+        return stage.name, digest.hexdigest()
+    
+    def is_cached(self, stage: Stage, state: Dict) -> bool:
+        """True if ``stage`` would be supplied or served from the memo rather than run."""
+        if state.get(stage.output) is not None:
+            return True
+        with self._lock:
+            return self._cache_key(stage, state) in self._cache
+    
+    def run_stage(self, stage: Stage, state: Dict) -> Dict:
+        """Run one stage against ``state`` in place, recording what happened in ``state["trace"]``."""
+        trace = state.setdefault("trace", [])
+        started = time.perf_counter()
+        
+        # Values supplied by the caller (e.g. counselor-edited patient info) are never recomputed
+        if state.get(stage.output) is not None:
+            trace.append({"stage": stage.name, "status": "provided", "duration_ms": 0.0})
+            return state
+        
+        key = self._cache_key(stage, state)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                state[stage.output] = self._cache[key]
+                trace.append({"stage": stage.name, "status": "cached", "duration_ms": 0.0})
+                return state
+        
+        try:
+            value = stage.fn(**{name: state.get(name) for name in stage.inputs})
+            status = "ran"
+        except stage.errors as e:
+            print(f"Stage '{stage.name}' failed: {e}")
+            value = stage.fallback() if stage.fallback else None
+            status = "fallback"
+        
+        if status == "ran":
+            with self._lock:
+                self._cache[key] = value
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        
+        state[stage.output] = value
+        trace.append({
+            "stage": stage.name,
+            "status": status,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        })
+        return state
+    
+    def run(self, state: Dict) -> Dict:
+        """Run every stage in order and return the final state."""
+        for stage in self.stages:
+            self.run_stage(stage, state)
+        return state
+    
+    def initial_state(self, **values: Any) -> Dict:
+        """Build an empty state with every stage output unset."""
+        state = {name: None for name in self.external_inputs}
+        for stage in self.stages:
+            state[stage.output] = None
+        state.update(values)
+        state["trace"] = []
+        return state
+    
+    def clear(self):
+        """Drop all memoised stage outputs."""
+        with self._lock:
+            self._cache.clear()
+
+
+def skipped_stages(trace: List[Dict]) -> List[str]:
+    """Names of stages that were served from the memo or supplied by the caller."""
+    return [entry["stage"] for entry in trace if entry["status"] in ("cached", "provided")]
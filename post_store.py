@@ -0,0 +1,154 @@
+"""
+Columnar storage for the labelled Reddit posts.
+
+Post metadata is held in compact numpy arrays (ids, user codes, label
+codes) and the post texts live in one UTF-8 file indexed by byte offsets,
+so a loaded store costs a few bytes per post instead of a dict with the
+full text. Texts are read from a memory map only when asked for, and
+previews are cut for the posts actually returned.
+
+On disk a store is two files next to each other: ``<prefix>.npz`` with the
+arrays and ``<prefix>.txt`` with the concatenated texts.
+"""
+import mmap
+import os
+import pickle
+from typing import Dict, Iterable, Iterator, List
+
+import numpy as np
+
+
+PREVIEW_CHARS = 200
+
+
+def clean_post_text(raw: str) -> str:
+    """Flatten a post stored as a stringified list of sentences into plain text."""
+    text = str(raw)
+    if text.startswith("['") and text.endswith("']"):
+        # Remove brackets and quotes, then split by "', '"
+        text = " ".join(text[2:-2].split("', '"))
+    
+    # Clean up any remaining artifacts
+    return text.replace("\\'", "'")
+
+
+def make_preview(text: str, length: int = PREVIEW_CHARS) -> str:
+    return text[:length] + "..." if len(text) > length else text
+
+
+def _encode(values: List[str]):
+    """Dictionary-encode strings as (codes, vocabulary)."""
+    vocabulary = sorted(set(values))
+    index = {value: code for code, value in enumerate(vocabulary)}
+    dtype = np.uint8 if len(vocabulary) <= 256 else np.int32
+    return np.array([index[value] for value in values], dtype=dtype), np.array(vocabulary)
+
+
+class PostStore:
+    """Read-only columnar view over the posts, with texts loaded on demand."""
+    
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        with np.load(prefix + ".npz") as arrays:
+            self.ids = arrays["ids"]
+            self.user_codes = arrays["user_codes"]
+            self.users = arrays["users"]
+            self.label_codes = arrays["label_codes"]
+            self.labels = arrays["labels"]
+            self.offsets = arrays["offsets"]
+        
+        self._file = open(prefix + ".txt", "rb")
+        # mmap cannot map an empty file
+        self._text = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+    
+    @staticmethod
+    def paths(prefix: str):
+        return prefix + ".npz", prefix + ".txt"
+    
+    @classmethod
+    def exists(cls, prefix: str) -> bool:
+        return all(os.path.exists(path) for path in cls.paths(prefix))
+    
+    @classmethod
+    def write(cls, prefix: str, posts: Iterable[Dict]) -> "PostStore":
+        """Write posts (dicts with id, user, label and text) as a store and open it."""
+        ids, users, labels, offsets = [], [], [], [0]
+        with open(prefix + ".txt.tmp", "wb") as f:
+            for post in posts:
+                data = post["text"].encode("utf-8")
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+                ids.append(int(post["id"]))
+                users.append(str(post["user"]))
+                labels.append(str(post["label"]))
+        
+        user_codes, user_vocabulary = _encode(users)
+        label_codes, label_vocabulary = _encode(labels)
+        with open(prefix + ".npz.tmp", "wb") as f:
+            np.savez(
+                f,
+                ids=np.array(ids, dtype=np.int64),
+                user_codes=user_codes,
+                users=user_vocabulary,
+                label_codes=label_codes,
+                labels=label_vocabulary,
+                offsets=np.array(offsets, dtype=np.int64),
+            )
+        os.replace(prefix + ".txt.tmp", prefix + ".txt")
+        os.replace(prefix + ".npz.tmp", prefix + ".npz")
+        return cls(prefix)
+    
+    @classmethod
+    def from_pickle(cls, pickle_path: str, prefix: str) -> "PostStore":
+        """Convert a legacy ``reddit_posts.pkl`` list of post dicts into a store."""
+        with open(pickle_path, "rb") as f:
+            posts = pickle.load(f)
+        return cls.write(prefix, posts)
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def close(self):
+        if isinstance(self._text, mmap.mmap):
+            self._text.close()
+        self._file.close()
+    
+    def user(self, index: int) -> str:
+        return str(self.users[self.user_codes[index]])
+    
+    def label(self, index: int) -> str:
+        return str(self.labels[self.label_codes[index]])
+    
+    def text(self, index: int) -> str:
+        """Full text of a post, read from the text file."""
+        return self._text[self.offsets[index]:self.offsets[index + 1]].decode("utf-8")
+    
+    def iter_texts(self) -> Iterator[str]:
+        for index in range(len(self)):
+            yield self.text(index)
+    
+    def preview(self, index: int, length: int = PREVIEW_CHARS) -> str:
+        """First ``length`` characters of a post, decoding at most what they can span."""
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        # A character is at most 4 bytes in UTF-8; one more byte tells whether the text goes on
+        data = self._text[start:min(end, start + 4 * length + 4)]
+        text = data.decode("utf-8", errors="ignore")
+        if end - start > len(data):
+            return text[:length] + "..."
+        return make_preview(text, length)
+    
+    def record(self, index: int, include_text: bool = False) -> Dict:
+        """A post as the dict returned by ``RedditRAG.find_similar_posts``."""
+        record = {
+            "id": int(self.ids[index]),
+            "user": self.user(index),
+            "label": self.label(index),
+            "preview": self.preview(index),
+        }
+        if include_text:
+            record["text"] = self.text(index)
+        return record
+    
+    def label_distribution(self) -> Dict[str, int]:
+        counts = np.bincount(self.label_codes, minlength=len(self.labels))
+        return {str(label): int(count) for label, count in zip(self.labels, counts) if count}
@@ -0,0 +1,149 @@
+"""
+Prompt assembly with a byte-identical prefix per stage, and prompt-cache telemetry.
+
+Providers cache prompt prefixes (OpenAI from 1024 tokens, in 128-token
+steps), so every stage sends its invariant content (shared clinical
+reference, system role, instructions, few-shot examples, format
+instructions) as one system message that never varies, and only the
+per-note fields after it. The shared reference comes first, so the stages'
+prefixes also start with the same bytes.
+``PromptCacheStats`` records the prompt and cached token counts the
+provider reports per call.
+
+``python prompt_layout.py`` prints each stage's prefix size and digest,
+checks that the prefix is identical across different notes, and reports
+the stages whose prefix is too short for the provider to cache at all.
+"""
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from langchain.schema import HumanMessage, SystemMessage
+
+# Rough characters per token for English prompts, for size estimates only
+CHARS_PER_TOKEN = 4
+
+# Shortest prompt the provider caches; a shorter prefix never gets a cache hit
+MIN_CACHED_PROMPT_TOKENS = 1024
+
+
+class StagePrompt:
+    """The messages for one stage: a fixed system prefix and a per-note template."""
+    
+    def __init__(self, stage: str, system: str, instructions: str, template: str, context: str = ""):
+        self.stage = stage
+        self.prefix = f"{system}\n\n{instructions.strip()}"
+        if context:
+            self.prefix = f"{context.strip()}\n\n{self.prefix}"
+        self.template = template.strip()
+        self.digest = hashlib.sha256(self.prefix.encode("utf-8")).hexdigest()[:16]
+    
+    def messages(self, **fields) -> List:
+        return [SystemMessage(content=self.prefix), HumanMessage(content=self.template.format(**fields))]
+    
+    @property
+    def estimated_prefix_tokens(self) -> int:
+        return len(self.prefix) // CHARS_PER_TOKEN
+    
+    @property
+    def cacheable(self) -> bool:
+        """Whether the prefix alone is long enough for the provider to cache."""
+        return self.estimated_prefix_tokens >= MIN_CACHED_PROMPT_TOKENS
+
+
+def prefix_problems(prompt: StagePrompt, samples: List[List]) -> List[str]:
+    """Ways ``prompt``'s prefix is unstable across ``samples`` (message lists for different notes); empty if none."""
+    problems = []
+    for messages in samples:
+        if messages[0].content != prompt.prefix:
+            problems.append(f"{prompt.stage}: system message differs from the static prefix")
+        if any(isinstance(message, SystemMessage) for message in messages[1:]):
+            problems.append(f"{prompt.stage}: system content after the per-note message")
+    if len({messages[0].content for messages in samples}) > 1:
+        problems.append(f"{prompt.stage}: prefix changes between notes")
+    return problems
+
+
+def usage_tokens(message) -> Tuple[Optional[int], Optional[int]]:
+    """(prompt tokens, cached prompt tokens) reported with an LLM response, or Nones."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    if usage.get("input_tokens") is not None:
+        details = usage.get("input_token_details") or {}
+        return usage["input_tokens"], details.get("cache_read", 0)
+    
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    if token_usage.get("prompt_tokens") is not None:
+        details = token_usage.get("prompt_tokens_details") or {}
+        return token_usage["prompt_tokens"], details.get("cached_tokens") or 0
+    return None, None
+
+
+class PromptCacheStats:
+    """Prompt and cached token counts per stage, and how often a call's prefix was not the static one."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict] = {}
+    
+    def record(self, prompt: StagePrompt, messages: List, response):
+        """Count one call that sent ``messages`` and got ``response``."""
+        prompt_tokens, cached_tokens = usage_tokens(response)
+        with self._lock:
+            stats = self._stages.setdefault(prompt.stage, {
+                "calls": 0,
+                "calls_with_usage": 0,
+                "calls_with_cache_hit": 0,
+                "prompt_tokens": 0,
+                "cached_tokens": 0,
+                "prefix_digest": prompt.digest,
+                "prefix_cacheable": prompt.cacheable,
+                "prefix_mismatches": 0,
+            })
+            stats["calls"] += 1
+            if messages[0].content != prompt.prefix:
+                print(f"⚠️ Prompt for '{prompt.stage}' did not start with its static prefix; the provider cache will miss")
+                stats["prefix_mismatches"] += 1
+            if prompt_tokens is None:
+                return
+            stats["calls_with_usage"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["cached_tokens"] += cached_tokens
+            stats["calls_with_cache_hit"] += cached_tokens > 0
+    
+    def metrics(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                stage: dict(
+                    stats,
+                    cached_token_ratio=round(stats["cached_tokens"] / stats["prompt_tokens"], 4) if stats["prompt_tokens"] else 0.0,
+                )
+                for stage, stats in self._stages.items()
+            }
+
+
+def main():
+    from fakes import FakeChatModel
+    from agent import CounselorAgent
+    from models import EnergyLevel, MoodSymptom, PatientInfo
+    
+    agent = CounselorAgent(llm=FakeChatModel(), advice_llm=FakeChatModel(), load_rag=False)
+    notes = ["Patient reports poor sleep and feeling hopeless.", "Client is anxious about exams, sleeping fine."]
+    infos = [PatientInfo(age=34, sleep_issues=True, energy_level=EnergyLevel.low, mood_symptoms=[MoodSymptom.sadness]),
+             PatientInfo(hopelessness=True)]
+    inputs = [dict(input_text=note, patient_info=info, phq8_score=score) for note, info, score in zip(notes, infos, (7, 2))]
+    
+    failed = False
+    for stage, prompt in agent.prompts.items():
+        problems = prefix_problems(prompt, [agent.stage_messages(stage, **fields) for fields in inputs])
+        failed = failed or bool(problems)
+        print(f"{stage:16} prefix {len(prompt.prefix):5} chars (~{prompt.estimated_prefix_tokens} tokens) "
+              f"digest {prompt.digest} {'OK' if not problems else 'UNSTABLE'}")
+        for problem in problems:
+            print(f"  {problem}")
+        if not prompt.cacheable:
+            print(f"  ⚠️ below the {MIN_CACHED_PROMPT_TOKENS}-token cache minimum; this stage's calls will not hit the prompt cache")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,71 @@
-PATIENT_INFO_EXTRACTION_PROMPT = """
+# Each stage's prompt is a static prefix (shared clinical reference, system role and instructions,
+# identical for every note) followed by the per-note fields, so provider-side prompt caching can reuse the prefix.
+# Instructions are never formatted; only the per-note templates take fields.
+
+# Reference shared by every stage and placed first in each prefix, so all stages start with the same bytes
+SHARED_CLINICAL_CONTEXT = """
+# Clinical reference
+
+You support counselors who work with people at risk of suicide. The counselor writes brief clinical notes after
+a contact; the notes are summarised, scored and turned into guidance for a colleague. Your output informs the
+counselor's judgement and never replaces it. Work only from what the notes say: do not invent history, and do not
+soften or exaggerate what is written.
+
+## Columbia Suicide Severity Rating Scale (C-SSRS)
+
+Suicidal ideation, from least to most severe:
+1. Wish to be dead: thoughts about no longer being alive, wishing to fall asleep and not wake up.
+2. Non-specific active suicidal thoughts: general thoughts of wanting to end one's life, without methods, intent or plan.
+3. Active ideation with any method, without intent to act: has thought of at least one method, but no plan or intent.
+4. Active ideation with some intent to act, without a specific plan.
+5. Active ideation with a specific plan and intent: details of the plan are partly or fully worked out.
+
+Suicidal behaviour:
+- Actual attempt: a potentially self-injurious act with at least some wish to die.
+- Interrupted attempt: someone or something stopped the person before the act began.
+- Aborted or self-interrupted attempt: the person took steps towards an attempt and stopped themselves.
+- Preparatory acts: collecting pills, obtaining a weapon, writing a note, giving away possessions.
+- Non-suicidal self-injury is recorded separately; it is a risk factor but not by itself a suicide attempt.
+
+Recent ideation (past month) and behaviour (past three months) weigh more than lifetime history, but a previous
+attempt raises risk at every level.
+
+## Severity scale used here (0-10)
+
+- 0-1: Minimal risk (no suicidal ideation)
+- 2-3: Low risk (passive thoughts, no plan)
+- 4-5: Moderate risk (active ideation, vague plan)
+- 6-7: High risk (specific plan, intent)
+- 8-10: Severe risk (imminent danger, previous attempts)
+
+## Patient information fields
+
+- age: age in years, only when the notes give it.
+- sleep_issues: insomnia, early waking, oversleeping or other sleep disturbance.
+- appetite_changes: eating more or less than usual, weight loss or gain.
+- energy_level: low for fatigue or slowed movement, high for restlessness or agitation, normal otherwise.
+- mood_symptoms: any of sadness, anxiety, irritability, emptiness.
+- social_withdrawal: isolating, avoiding friends or family, staying alone.
+- concentration_issues: trouble focusing, remembering or making decisions.
+- hopelessness: despair, feeling worthless or a burden, seeing no future, suicidal thoughts.
+
+## Risk and protective factors
+
+Risk factors: previous attempts, access to lethal means, recent loss or crisis, substance use, chronic pain or
+illness, isolation, hopelessness, agitation, impulsivity, a family history of suicide.
+Protective factors: connection to family, friends or community, responsibility for children or pets, engagement
+with care, reasons for living, problem-solving skills, religious or moral objections to suicide.
+
+## Abbreviations common in notes
+
+SI suicidal ideation, HI homicidal ideation, SH self-harm, NSSI non-suicidal self-injury, OD overdose,
+pt patient, hx history, f/u follow-up, tx treatment, dx diagnosis, ED emergency department, w/ with, w/o without.
+"""
+
+PATIENT_INFO_EXTRACTION_SYSTEM = "You are a clinical information extraction expert. Return only valid JSON."
+
+# The parser's format instructions are appended when the agent assembles the prefix
+PATIENT_INFO_EXTRACTION_INSTRUCTIONS = """
 Extract patient information from the counselor's clinical notes for suicide risk assessment.
 
 Look for indicators related to:
@@ -8,44 +75,65 @@ Look for indicators related to:
 - Protective factors (support systems, coping skills, etc.)
 - Current mental state and behavior patterns
 
+The clinical notes are in the next message.
+"""
+
+PATIENT_INFO_EXTRACTION_PROMPT = """
 INPUT TEXT:
 {input_text}
-
-{format_instructions}
 """
 
-SEVERITY_ASSESSMENT_PROMPT = """
-Assess the suicide severity risk based on the CSSRS scale (0-10) from the patient information and original input.
+SEVERITY_ASSESSMENT_SYSTEM = "You are a clinical suicide risk assessment expert. Return only valid JSON."
 
-Use this scale:
-- 0-1: Minimal risk (no suicidal ideation)
-- 2-3: Low risk (passive thoughts, no plan)
-- 4-5: Moderate risk (active ideation, vague plan)
-- 6-7: High risk (specific plan, intent)
-- 8-10: Severe risk (imminent danger, previous attempts)
+SEVERITY_ASSESSMENT_INSTRUCTIONS = """
+Assess the suicide severity risk based on the CSSRS scale (0-10) from the patient information and original input in the next message.
+
+Use the severity scale in the clinical reference above, guided by the C-SSRS levels and behaviours.
+
+Scoring rules:
+- Score from the most severe ideation or behaviour the notes describe, not from the average of the symptoms.
+- Preparatory acts, access to means or a recent attempt place the note in the high or severe bands.
+- Protective factors can lower a score within its band, never below it.
+- Depressive symptoms without any suicidal ideation stay in the minimal or low bands.
+- If the notes are ambiguous between two bands, choose the higher one.
 
 ## Examples:
 
 Example 1:
 Patient: Age 25, no sleep issues, normal energy, reports sadness, no social withdrawal
 Input: "Patient says they feel down but are looking forward to weekend plans with family"
-Output: {{"severity_score": 1}}
+Output: {"severity_score": 1}
 
 Example 2:
 Patient: Age 40, sleep issues, low energy, hopelessness present, social withdrawal
 Input: "Patient mentions sometimes wishing they wouldn't wake up but has no specific plans"
-Output: {{"severity_score": 3}}
+Output: {"severity_score": 3}
 
 Example 3:
 Patient: Age 30, multiple issues, hopelessness, mentions specific method but no timeline
 Input: "Patient has been researching ways to end their life and feels like a burden to family"
-Output: {{"severity_score": 5}}
+Output: {"severity_score": 5}
 
 Example 4:
 Patient: Age 45, severe symptoms, has detailed plan and timeline, previous attempt
 Input: "Patient has pills saved up, plans to use them this weekend, attempted overdose last year"
-Output: {{"severity_score": 8}}
+Output: {"severity_score": 8}
+
+Example 5:
+Patient: Age 19, anxiety about exams, sleeping and eating normally, close friends
+Input: "Client stressed about finals, denies SI, has a study group and plans for the summer"
+Output: {"severity_score": 0}
+
+Example 6:
+Patient: Age 52, hopelessness, social withdrawal, recent job loss
+Input: "Pt bought a rope yesterday, wrote goodbye letters, says tonight is the night"
+Output: {"severity_score": 10}
 
+Return only a JSON object with the severity score:
+{"severity_score": <number>}
+"""
+
+SEVERITY_ASSESSMENT_PROMPT = """
 ## Your Assessment:
 
 Patient Information:
@@ -59,18 +147,39 @@ Patient Information:
 - Hopelessness: {hopelessness}
 
 Original Input: {original_input}
+"""
 
-Return only a JSON object with the severity score:
-{{"severity_score": <number>}}
+CLINICAL_ADVICE_SYSTEM = "You are an expert mental health counselor providing colleague guidance."
+
+CLINICAL_ADVICE_INSTRUCTIONS = """
+Provide clinical guidance based on the suicide severity assessment in the next message.
+
+Provide structured clinical recommendations covering:
+1. Immediate suicide risk assessment
+2. Safety planning and interventions
+3. Level of care recommendations (inpatient, outpatient, crisis intervention)
+4. Protective factors to strengthen
+5. Monitoring and follow-up protocols
+6. Emergency referrals if indicated
+
+Focus on evidence-based suicide prevention strategies and CSSRS-guided interventions.
+
+Match the level of care and follow-up to the risk band:
+- Minimal or low risk: outpatient care, routine follow-up within two weeks, a safety plan if any ideation is present.
+- Moderate risk: a written safety plan, lethal means counselling, follow-up within a week, consider more frequent sessions.
+- High risk: same-day psychiatric evaluation, involve supports with consent, follow-up within 24-48 hours.
+- Severe risk: do not leave the person alone, emergency services or the emergency department now.
+
+Write the guidance as short paragraphs, one per numbered point above, each starting with a bold heading:
+**Immediate risk:**, **Safety planning:**, **Level of care:**, **Protective factors:**, **Monitoring:**, **Referrals:**.
+Address the counselor as a colleague, be specific to this patient, and keep it under 300 words.
 """
 
 CLINICAL_ADVICE_PROMPT = """
-Provide clinical guidance based on this suicide severity assessment:
-
 CSSRS Severity Score: {phq8_score}/10 ({severity_level})
 Age: {age}
 Sleep Issues: {sleep_issues}
-Appetite Changes: {appetite_changes} 
+Appetite Changes: {appetite_changes}
 Energy Level: {energy_level}
 Mood Symptoms: {mood_symptoms}
 Social Withdrawal: {social_withdrawal}
@@ -78,14 +187,4 @@ Concentration Issues: {concentration_issues}
 Hopelessness: {hopelessness}
 
 Original Input: {original_input}
-
-Provide structured clinical recommendations covering:
-1. Immediate suicide risk assessment
-2. Safety planning and interventions
-3. Level of care recommendations (inpatient, outpatient, crisis intervention)
-4. Protective factors to strengthen
-5. Monitoring and follow-up protocols
-6. Emergency referrals if indicated
-
-Focus on evidence-based suicide prevention strategies and CSSRS-guided interventions.
-""" 
\ No newline at end of file
+"""
@@ -1,35 +1,123 @@
 import pandas as pd
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 import pickle
 import os
-from typing import List, Dict, Tuple
+from typing import Iterator, List, Dict, Tuple
 import json
 
+from lexical_index import BM25Index
+from neighbor_graph import NEIGHBORS, NeighborGraph
+from post_store import PostStore, clean_post_text
+from vector_shards import ShardedIndex, read_manifest, row_batches, write_shards
+
+RETRIEVAL_MODES = ("dense", "hybrid", "prefilter")
+
+# Reciprocal rank fusion constant; larger values flatten the contribution of top ranks
+RRF_K = 60
+
+# Candidates taken from each ranking before fusing them
+HYBRID_POOL = 100
+
+
+def _top_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` largest scores, best first, without sorting the rest."""
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
 class RedditRAG:
-    """Simple RAG system for finding similar Reddit posts."""
+    """Simple RAG system for finding similar Reddit posts.
+    
+    ``retrieval_mode`` picks how posts are ranked: ``dense`` (MiniLM cosine
+    similarity), ``hybrid`` (reciprocal rank fusion of the dense and BM25
+    rankings) or ``prefilter`` (dense scoring of the BM25 candidates only,
+    for large corpora). ``model`` is anything with a SentenceTransformer-style
+    ``encode``; without one, ``EMBEDDING_SOCKET`` selects the shared embedding
+    server and otherwise the local MiniLM model is loaded.
+    
+    With ``shards`` (or ``RAG_SHARDS``) above zero, the embeddings are split
+    into that many memory-mapped shards searched by a pool of
+    ``shard_workers`` processes, and this process never holds the full
+    matrix. ``shard_timeout_ms`` bounds how long a query waits for its
+    shards; late shards are left out of the results.
     
-    def __init__(self, csv_path: str = "500_Reddit_users_posts_labels.csv"):
+    ``neighbors`` (or ``RAG_NEIGHBORS``, 0 to disable) posts nearest to each
+    post are precomputed, so ``neighbors_of`` answers from a table without
+    encoding anything.
+    """
+    
+    def __init__(
+        self,
+        csv_path: str = "500_Reddit_users_posts_labels.csv",
+        model=None,
+        data_dir: str = ".",
+        retrieval_mode: str = None,
+        prefilter_candidates: int = 200,
+        shards: int = None,
+        shard_workers: int = None,
+        shard_timeout_ms: float = None,
+        neighbors: int = None,
+    ):
         self.csv_path = csv_path
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.embeddings_path = "reddit_embeddings.pkl"
-        self.posts_path = "reddit_posts.pkl"
+        if model is None and os.getenv("EMBEDDING_SOCKET"):
+            # Shared embedding server, so this process never loads torch
+            from embedding_server import RemoteEncoder
+            model = RemoteEncoder(os.getenv("EMBEDDING_SOCKET"))
+        elif model is None:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.model = model
+        self.embeddings_path = os.path.join(data_dir, "reddit_embeddings.pkl")
+        self.posts_prefix = os.path.join(data_dir, "reddit_posts")
+        self.lexical_index_path = os.path.join(data_dir, "reddit_bm25.npz")
+        # Pre-columnar cache, converted to a PostStore on first load
+        self.legacy_posts_path = os.path.join(data_dir, "reddit_posts.pkl")
+        self.shards_dir = os.path.join(data_dir, "reddit_shards")
+        self.neighbor_graph_path = os.path.join(data_dir, "reddit_neighbors.npz")
+        
+        self.retrieval_mode = retrieval_mode or os.getenv("RAG_RETRIEVAL_MODE", "dense")
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"retrieval_mode must be one of {RETRIEVAL_MODES}, got {self.retrieval_mode!r}")
+        self.prefilter_candidates = prefilter_candidates
+        self.shard_count = int(os.getenv("RAG_SHARDS", "0")) if shards is None else shards
+        self.shard_workers = shard_workers or (int(os.getenv("RAG_SHARD_WORKERS", "0")) or None)
+        if shard_timeout_ms is None and os.getenv("RAG_SHARD_TIMEOUT_MS"):
+            shard_timeout_ms = float(os.getenv("RAG_SHARD_TIMEOUT_MS"))
+        self.shard_timeout_ms = shard_timeout_ms
+        self.neighbor_count = int(os.getenv("RAG_NEIGHBORS", str(NEIGHBORS))) if neighbors is None else neighbors
         
-        self.posts_data = None
+        self.posts = None
         self.embeddings = None
+        self.lexical_index = None
+        self.shard_index = None
+        self.neighbor_graph = None
+        self._rows_by_id = None
         
         self._load_or_create_embeddings()
+        self._load_or_create_lexical_index()
+        self._load_or_create_neighbor_graph()
+        self._load_or_create_shards()
     
     def _load_or_create_embeddings(self):
         """Load existing embeddings or create new ones."""
-        if os.path.exists(self.embeddings_path) and os.path.exists(self.posts_path):
+        if os.path.exists(self.embeddings_path) and not PostStore.exists(self.posts_prefix) and os.path.exists(self.legacy_posts_path):
+            print("Converting cached posts to the columnar store...")
+            PostStore.from_pickle(self.legacy_posts_path, self.posts_prefix).close()
+            os.remove(self.legacy_posts_path)
+        
+        if os.path.exists(self.embeddings_path) and PostStore.exists(self.posts_prefix):
+            self.posts = PostStore(self.posts_prefix)
+            if self.shard_count:
+                # Stale shards are rewritten from encoded batches, not from the pickled matrix
+                print(f"Using {self.shard_count} embedding shards for {len(self.posts)} posts")
+                return
             print("Loading existing embeddings...")
             with open(self.embeddings_path, 'rb') as f:
                 self.embeddings = pickle.load(f)
-            with open(self.posts_path, 'rb') as f:
-                self.posts_data = pickle.load(f)
-            print(f"Loaded {len(self.posts_data)} posts with embeddings")
+            print(f"Loaded {len(self.posts)} posts with embeddings")
         else:
             print("Creating new embeddings from dataset...")
             self._create_embeddings()
@@ -44,29 +132,16 @@ class RedditRAG:
             posts = []
             for idx, row in df.iterrows():
                 try:
-                    # Clean the post text
-                    post_text = str(row['Post'])
-                    if post_text.startswith("['") and post_text.endswith("']"):
-                        # Remove brackets and quotes, then split by "', '"
-                        post_text = post_text[2:-2]
-                        post_parts = post_text.split("', '")
-                        post_text = " ".join(post_parts)
-                    
-                    # Clean up any remaining artifacts
-                    post_text = post_text.replace("\\'", "'")
-                    
                     posts.append({
                         'id': idx,
                         'user': row['User'],
-                        'text': post_text,
+                        'text': clean_post_text(row['Post']),
                         'label': row['Label'],
-                        'preview': post_text[:200] + "..." if len(post_text) > 200 else post_text
                     })
                 except Exception as e:
                     print(f"Error processing row {idx}: {e}")
                     continue
             
-            self.posts_data = posts
             print(f"Processed {len(posts)} posts")
             
             # Create embeddings
@@ -74,91 +149,235 @@ class RedditRAG:
             print("Creating embeddings...")
             self.embeddings = self.model.encode(texts, show_progress_bar=True)
             
-            # Save embeddings and posts
+            # Save embeddings and posts; only the columnar metadata stays in memory
             with open(self.embeddings_path, 'wb') as f:
                 pickle.dump(self.embeddings, f)
-            with open(self.posts_path, 'wb') as f:
-                pickle.dump(self.posts_data, f)
+            self.posts = PostStore.write(self.posts_prefix, posts)
+            # Any lexical index on disk was built from the previous corpus
+            if os.path.exists(self.lexical_index_path):
+                os.remove(self.lexical_index_path)
             
             print("Embeddings created and saved successfully!")
-            
+        
         except Exception as e:
             print(f"Error creating embeddings: {e}")
-            self.posts_data = []
+            self.posts = None
             self.embeddings = np.array([])
     
-    def find_similar_posts(self, query_text: str, top_k: int = 3) -> List[Dict]:
+    def _load_or_create_lexical_index(self):
+        """Load the BM25 index, building it from the post texts if it is missing or stale."""
+        if not self.posts:
+            return
+        
+        if os.path.exists(self.lexical_index_path):
+            index = BM25Index.load(self.lexical_index_path)
+            if len(index) == len(self.posts):
+                self.lexical_index = index
+                return
+        
+        print("Building lexical index...")
+        self.lexical_index = BM25Index.build(self.posts.iter_texts())
+        self.lexical_index.save(self.lexical_index_path)
+    
+    def _full_embeddings(self) -> np.ndarray:
+        """The whole embedding matrix, read from disk if sharded mode left it out of memory."""
+        if self.embeddings is None:
+            with open(self.embeddings_path, 'rb') as f:
+                self.embeddings = pickle.load(f)
+        return self.embeddings
+    
+    def _embedding_batches(self, batch_size: int = 256) -> Iterator[np.ndarray]:
+        """The embedding rows in batches: slices of the matrix if it is in memory, else the post texts encoded again."""
+        if self.embeddings is not None:
+            yield from row_batches(self.embeddings, batch_size)
+            return
+        texts = []
+        for text in self.posts.iter_texts():
+            texts.append(text)
+            if len(texts) == batch_size:
+                yield np.asarray(self.model.encode(texts))
+                texts = []
+        if texts:
+            yield np.asarray(self.model.encode(texts))
+    
+    def _load_or_create_neighbor_graph(self):
+        """Load the neighbour graph, building it if it is missing or was built from other embeddings."""
+        if not self.neighbor_count or not self.posts:
+            return
+        
+        if os.path.exists(self.neighbor_graph_path):
+            graph = NeighborGraph.load(self.neighbor_graph_path)
+            if (
+                len(graph) == len(self.posts)
+                and graph.k >= min(self.neighbor_count, len(self.posts) - 1)
+                and graph.source == self._embeddings_source()
+            ):
+                self.neighbor_graph = graph
+                return
+        
+        print(f"Building {self.neighbor_count}-nearest neighbour graph...")
+        self.neighbor_graph = NeighborGraph.build(self._full_embeddings(), self.neighbor_count, source=self._embeddings_source())
+        self.neighbor_graph.save(self.neighbor_graph_path)
+    
+    def _embeddings_source(self) -> Dict:
+        stat = os.stat(self.embeddings_path)
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+    
+    def _shards_current(self) -> bool:
+        """Whether shards on disk match the configured count and the current embeddings file."""
+        if not self.shard_count or not self.posts:
+            return False
+        manifest = read_manifest(self.shards_dir)
+        return (
+            manifest is not None
+            and manifest["rows"] == len(self.posts)
+            and len(manifest["shards"]) == min(self.shard_count, len(self.posts))
+            and manifest["source"] == self._embeddings_source()
+        )
+    
+    def _load_or_create_shards(self):
+        """Start the shard search pool, writing the shards first if they are missing or stale."""
+        if not self.shard_count or not self.posts:
+            return
+        
+        if not self._shards_current():
+            print(f"Writing {self.shard_count} embedding shards...")
+            write_shards(self._embedding_batches(), len(self.posts), self.shards_dir, self.shard_count, self._embeddings_source())
+        
+        timeout_s = self.shard_timeout_ms / 1000 if self.shard_timeout_ms else None
+        self.shard_index = ShardedIndex(self.shards_dir, workers=self.shard_workers, timeout_s=timeout_s)
+        # The workers map the shards; this process no longer needs the full matrix
+        self.embeddings = None
+    
+    def _dense_top_k(self, query_embedding: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The ``k`` posts most similar to the query embedding, with their similarities."""
+        if self.shard_index is not None:
+            result = self.shard_index.search(query_embedding, k)[0]
+            return result.indices, result.scores
+        similarities = cosine_similarity(query_embedding, self.embeddings)[0]
+        top_indices = _top_indices(similarities, k)
+        return top_indices, similarities[top_indices]
+    
+    def _similarities(self, query_embedding: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        """Dense similarity of the query to the given posts only."""
+        if self.shard_index is not None:
+            query = query_embedding[0] / (np.linalg.norm(query_embedding[0]) or 1.0)
+            return self.shard_index.vectors(indices) @ query
+        return cosine_similarity(query_embedding, self.embeddings[indices])[0]
+    
+    def rank(self, query_text: str, top_k: int = 3, mode: str = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Indices of the ``top_k`` best posts for ``query_text``, with their dense similarities."""
+        mode = mode or self.retrieval_mode
+        if mode != "dense" and self.lexical_index is None:
+            mode = "dense"
+        query_embedding = self.model.encode([query_text])
+        
+        if mode == "prefilter":
+            candidates, _ = self.lexical_index.top_k(query_text, max(self.prefilter_candidates, top_k))
+            # Too few lexical matches to fill the results, fall back to scoring everything
+            if len(candidates) >= top_k:
+                similarities = self._similarities(query_embedding, candidates)
+                order = _top_indices(similarities, top_k)
+                return candidates[order], similarities[order]
+            mode = "dense"
+        
+        if mode == "dense":
+            return self._dense_top_k(query_embedding, top_k)
+        
+        # Hybrid: reciprocal rank fusion of the best dense and BM25 candidates; deeper ranks add next to nothing
+        pool = max(HYBRID_POOL, top_k)
+        fused: Dict[int, float] = {}
+        dense_order, _ = self._dense_top_k(query_embedding, pool)
+        lexical_order, _ = self.lexical_index.top_k(query_text, pool)
+        for ranking in (dense_order, lexical_order):
+            for rank, idx in enumerate(ranking, 1):
+                fused[int(idx)] = fused.get(int(idx), 0.0) + 1.0 / (RRF_K + rank)
+        top_indices = np.array(sorted(fused, key=lambda idx: (-fused[idx], idx))[:top_k], dtype=np.int64)
+        return top_indices, self._similarities(query_embedding, top_indices)
+    
+    def find_similar_posts(self, query_text: str, top_k: int = 3, mode: str = None) -> List[Dict]:
         """Find the top_k most similar posts to the query."""
-        if self.embeddings is None or len(self.posts_data) == 0:
+        if (self.embeddings is None and self.shard_index is None) or not self.posts:
             return []
         
         try:
-            # Create embedding for query
-            query_embedding = self.model.encode([query_text])
-            
-            # Calculate similarities
-            similarities = cosine_similarity(query_embedding, self.embeddings)[0]
-            
-            # Get top k indices
-            top_indices = np.argsort(similarities)[::-1][:top_k]
+            top_indices, similarities = self.rank(query_text, top_k, mode)
             
-            # Return similar posts with similarity scores
+            # Return similar posts with similarity scores; previews are read for these only
             similar_posts = []
-            for idx in top_indices:
-                post = self.posts_data[idx].copy()
-                post['similarity_score'] = float(similarities[idx])
+            for idx, similarity in zip(top_indices, similarities):
+                post = self.posts.record(idx)
+                post['similarity_score'] = float(similarity)
                 similar_posts.append(post)
             
             return similar_posts
-            
+        
         except Exception as e:
             print(f"Error finding similar posts: {e}")
             return []
     
-    def get_label_distribution(self) -> Dict[str, int]:
-        """Get the distribution of labels in the dataset."""
-        if not self.posts_data:
-            return {}
-        
-        labels = [post['label'] for post in self.posts_data]
-        label_counts = {}
-        for label in labels:
-            label_counts[label] = label_counts.get(label, 0) + 1
+    def neighbors_of(self, post_id: int, k: int = 3) -> List[Dict]:
+        """The ``k`` posts most similar to post ``post_id`` (at most ``neighbors``), from the precomputed graph."""
+        if self.neighbor_graph is None:
+            return []
+        if self._rows_by_id is None:
+            self._rows_by_id = {int(post_id): row for row, post_id in enumerate(self.posts.ids)}
+        row = self._rows_by_id.get(int(post_id))
+        if row is None:
+            raise KeyError(f"no post with id {post_id}")
         
-        return label_counts
-
-def format_similar_posts_for_display(similar_posts: List[Dict]) -> str:
-    """Format similar posts for display in the UI."""
-    if not similar_posts:
-        return "No similar posts found in the database."
-    
-    formatted_output = "## 📚 Similar Cases from Reddit Database\n\n"
+        related = []
+        for idx, similarity in zip(*self.neighbor_graph.neighbors(row, k)):
+            post = self.posts.record(idx)
+            post['similarity_score'] = float(similarity)
+            related.append(post)
+        return related
     
-    for i, post in enumerate(similar_posts, 1):
-        similarity_percent = int(post['similarity_score'] * 100)
+    def add_posts(self, posts: List[Dict]) -> List[int]:
+        """Append labelled posts (dicts with user, text and label) to the corpus and return their ids.
         
-        # Color coding based on label
-        label_colors = {
-            'Supportive': '🟢',
-            'Indicator': '🟡', 
-            'Ideation': '🟠',
-            'Behavior': '🔴',
-            'Attempt': '🚨'
-        }
+        Only the new texts are encoded and the neighbour graph is extended
+        incrementally; the post store, BM25 index and shards are rewritten.
+        Not safe to run while other threads query this instance.
+        """
+        if not self.posts:
+            raise RuntimeError("no corpus loaded to add posts to")
         
-        label_icon = label_colors.get(post['label'], '⚪')
+        embeddings = self._full_embeddings()
+        texts = [clean_post_text(post['text']) for post in posts]
+        new_embeddings = np.asarray(self.model.encode(texts))
+        first_id = int(self.posts.ids.max()) + 1 if len(self.posts) else 0
+        ids = list(range(first_id, first_id + len(posts)))
         
-        formatted_output += f"""
-### {i}. {label_icon} Case {post['id']} - {post['label']} Risk ({similarity_percent}% similar)
-
-**User:** {post['user']}
-
-**Post Content:**
-> {post['preview']}
-
-**Risk Classification:** {post['label']}
-
----
-"""
+        records = [self.posts.record(idx, include_text=True) for idx in range(len(self.posts))]
+        records += [
+            {'id': post_id, 'user': post['user'], 'text': text, 'label': post['label']}
+            for post_id, post, text in zip(ids, posts, texts)
+        ]
+        old_posts = self.posts
+        self.posts = PostStore.write(self.posts_prefix, records)
+        old_posts.close()
+        self._rows_by_id = None
+        
+        self.embeddings = np.concatenate([embeddings, new_embeddings.astype(embeddings.dtype)])
+        with open(self.embeddings_path, 'wb') as f:
+            pickle.dump(self.embeddings, f)
+        
+        self.lexical_index = BM25Index.build(self.posts.iter_texts())
+        self.lexical_index.save(self.lexical_index_path)
+        
+        if self.neighbor_graph is not None:
+            self.neighbor_graph.add(embeddings, new_embeddings, self.neighbor_count, source=self._embeddings_source())
+            self.neighbor_graph.save(self.neighbor_graph_path)
+        
+        if self.shard_index is not None:
+            self.shard_index.close()
+            self._load_or_create_shards()
+        return ids
     
-    return formatted_output 
\ No newline at end of file
+    def get_label_distribution(self) -> Dict[str, int]:
+        """Get the distribution of labels in the dataset."""
+        if not self.posts:
+            return {}
+        
+        return self.posts.label_distribution()
@@ -0,0 +1,88 @@
+"""
+Tiered retention: move old assessments out of the hot message store.
+
+``compact`` archives, in every conversation, the assessments beyond the
+``keep_assessments`` most recent or older than ``older_than``, as
+gzip-compressed JSONL segments (see ``Database.archive_conversation``).
+Conversations then load and save in the same time however long their
+history gets, and archived assessments are still read back on demand when
+the counselor pages past the hot ones.
+
+Run it periodically, e.g. from cron::
+
+    python retention.py --keep-assessments 50 --older-than-days 180
+"""
+import argparse
+import os
+import time
+from datetime import timedelta
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from database import Database, create_database
+
+
+def compact(
+    db: Database,
+    keep_assessments: Optional[int] = None,
+    older_than: Optional[timedelta] = None,
+    counselor_id: Optional[str] = None,
+) -> Dict:
+    """Archive old assessments of every conversation (or one counselor's) and summarise what moved."""
+    if keep_assessments is None and older_than is None:
+        raise ValueError("set keep_assessments or older_than")
+    
+    started = time.perf_counter()
+    summary = {"conversations": 0, "archived_conversations": 0, "segments": 0, "messages": 0,
+               "assessments": 0, "bytes": 0, "errors": 0}
+    for conversation_id in db.conversation_ids(counselor_id):
+        summary["conversations"] += 1
+        try:
+            stub = db.archive_conversation(conversation_id, keep_assessments, older_than)
+        except Exception as e:
+            print(f"⚠️ Could not archive {conversation_id}: {e}")
+            summary["errors"] += 1
+            continue
+        if stub is None:
+            continue
+        summary["archived_conversations"] += 1
+        summary["segments"] += 1
+        summary["messages"] += stub["messages"]
+        summary["assessments"] += stub["assessments"]
+        summary["bytes"] += stub["bytes"]
+    
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def main():
+    load_dotenv()
+    keep_default = os.getenv("ARCHIVE_KEEP_ASSESSMENTS")
+    age_default = os.getenv("ARCHIVE_AFTER_DAYS")
+    
+    parser = argparse.ArgumentParser(description="Archive old assessments into compressed cold segments")
+    parser.add_argument("--keep-assessments", type=int, default=int(keep_default) if keep_default else None,
+                        help="assessments to keep hot per conversation (ARCHIVE_KEEP_ASSESSMENTS)")
+    parser.add_argument("--older-than-days", type=float, default=float(age_default) if age_default else None,
+                        help="archive assessments older than this (ARCHIVE_AFTER_DAYS)")
+    parser.add_argument("--counselor", help="only this counselor's conversations")
+    args = parser.parse_args()
+    if args.keep_assessments is None and args.older_than_days is None:
+        parser.error("set --keep-assessments and/or --older-than-days")
+    
+    db = create_database()
+    if not db.available:
+        raise SystemExit(f"Storage unavailable: {db.last_error}")
+    
+    older_than = timedelta(days=args.older_than_days) if args.older_than_days is not None else None
+    summary = compact(db, args.keep_assessments, older_than, args.counselor)
+    print(f"✅ Archived {summary['assessments']} assessments ({summary['messages']} messages, "
+          f"{summary['bytes'] / 1024:.1f} KiB compressed) from {summary['archived_conversations']} "
+          f"of {summary['conversations']} conversations in {summary['seconds']}s")
+    if summary["errors"]:
+        print(f"⚠️ {summary['errors']} conversations could not be archived")
+
+
+if __name__ == "__main__":
+    main()
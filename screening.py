@@ -0,0 +1,39 @@
+"""
+Fast provisional risk screen for counselor notes.
+
+A keyword heuristic that runs in microseconds, used to order work before
+the LLM has assessed a note. It is not a clinical score: the CSSRS
+assessment from the agent always replaces it.
+"""
+import re
+from typing import Dict, List, Tuple
+
+from models import severity_level
+
+
+# (weight, pattern) pairs, roughly following the CSSRS escalation from ideation to behaviour
+RISK_PATTERNS: List[Tuple[int, "re.Pattern"]] = [
+    (2, re.compile(r"\b(wish(es|ed)? (they|he|she|i) (were|was) dead|not wake up|better off dead|no reason to live)\b", re.I)),
+    (2, re.compile(r"\b(suicid\w*|kill (my|him|her|them)sel(f|ves)|end (my|his|her|their) li(fe|ves))\b", re.I)),
+    (1, re.compile(r"\b(hopeless\w*|worthless|a burden|can'?t go on|trapped)\b", re.I)),
+    (2, re.compile(r"\b(plan(s|ned|ning)?|method|researching ways|note|goodbye)\b", re.I)),
+    (2, re.compile(r"\b(pills|overdose|rope|hang\w*|gun|firearm|jump\w*|bridge|cutting|razor)\b", re.I)),
+    (2, re.compile(r"\b(tonight|this weekend|tomorrow|soon|intent|intends?|going to do it)\b", re.I)),
+    (3, re.compile(r"\b(previous|prior|past|last year'?s?) (suicide )?attempts?\b|\battempted\b", re.I)),
+]
+
+# Phrases that commonly negate an indicator ("denies a plan", "no intent")
+NEGATION = re.compile(r"\b(denies|denied|no|not|without)\s+(\w+\s+){0,2}(plan|intent|method|attempts?|ideation)\b", re.I)
+
+
+def provisional_risk_score(text: str) -> int:
+    """Cheap 0-10 risk estimate for ``text`` on the same scale as the CSSRS assessment."""
+    score = sum(weight for weight, pattern in RISK_PATTERNS if pattern.search(text))
+    score -= 2 * len(NEGATION.findall(text))
+    return max(0, min(10, score))
+
+
+def provisional_screen(text: str) -> Dict:
+    """Provisional score and band for ``text``."""
+    score = provisional_risk_score(text)
+    return {"score": score, "severity_level": severity_level(score)}
@@ -0,0 +1,470 @@
+"""
+Headless HTTP API for the assessment agent.
+
+Run with ``python server.py --port 8080``. Each process builds one
+``CounselorAgent`` (LLM clients, RAG index, stage memo) and one storage
+connection, shared by all of its request threads. ``--processes`` pre-forks
+that many workers on one listening socket, each with ``--threads``
+request threads. ``--fake-llm`` swaps in ``fakes.FakeChatModel`` and
+``--no-rag`` skips loading the embedding model, so the service can be
+exercised end to end offline against the SQLite backend.
+
+Endpoints (JSON bodies, ``text`` is the counselor note):
+
+* ``GET  /healthz``                 status and counters
+* ``POST /v1/extract``              ``{text}`` -> extracted patient info
+* ``POST /v1/assess``               ``{text, patient_info?, counselor_id?, session_id?}`` -> assessment;
+                                    stored in the conversation when both ids are given
+* ``POST /v1/similar-cases``        ``{text, top_k?}`` -> similar labelled posts
+* ``POST /v1/related-cases``        ``{post_id, top_k?}`` -> posts nearest to a labelled post, precomputed
+* ``POST /v1/advice/stream``        ``{text, patient_info?, score?}`` -> newline-delimited JSON,
+                                    streamed with chunked transfer encoding
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, Iterator, Optional
+
+from pydantic import ValidationError
+
+from agent import CounselorAgent
+from database import Database, create_database
+from models import Conversation, PatientInfo, severity_level
+
+
+# CSSRS severity scores run from 0 to 10 (``phq8_score`` is the stage's historical name)
+MAX_SCORE = 10
+
+
+class RequestError(Exception):
+    """A client error, reported with ``status`` and ``message``."""
+    
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def build_agent(fake_llm: bool = False, load_rag: bool = True) -> CounselorAgent:
+    """The per-process agent, with real or fake chat models."""
+    if not fake_llm:
+        return CounselorAgent(load_rag=load_rag)
+    
+    from fakes import FakeChatModel
+    latency_ms = float(os.getenv("FAKE_LLM_LATENCY_MS", "0"))
+    return CounselorAgent(
+        llm=FakeChatModel(latency_ms=latency_ms),
+        advice_llm=FakeChatModel(latency_ms=latency_ms),
+        load_rag=load_rag,
+    )
+
+
+class AssessmentService:
+    """Endpoint logic, independent of HTTP so it can be driven directly."""
+    
+    def __init__(self, agent: CounselorAgent, db: Optional[Database] = None):
+        self.agent = agent
+        self.db = db
+    
+    @staticmethod
+    def _text(payload: Dict) -> str:
+        text = payload.get("text")
+        if not isinstance(text, str) or not text.strip():
+            raise RequestError(400, "'text' must be a non-empty string")
+        return text
+    
+    @staticmethod
+    def _patient_info(payload: Dict) -> Optional[PatientInfo]:
+        if payload.get("patient_info") is None:
+            return None
+        try:
+            return PatientInfo(**payload["patient_info"])
+        except (TypeError, ValidationError) as e:
+            raise RequestError(422, f"invalid patient_info: {e}")
+    
+    def extract(self, payload: Dict) -> Dict:
+        return {"patient_info": self.agent.extract_patient_info_only(self._text(payload)).to_record()}
+    
+    def assess(self, payload: Dict) -> Dict:
+        text = self._text(payload)
+        patient_info = self._patient_info(payload)
+        counselor_id, session_id = payload.get("counselor_id"), payload.get("session_id")
+        
+        if patient_info is None:
+            patient_info = self.agent.extract_patient_info_only(text)
+        result = self.agent.process_with_patient_info(text, patient_info)
+        
+        stored = False
+        if counselor_id and session_id and self.db is not None:
+            stored = self._store(str(counselor_id), str(session_id), text, patient_info, result)
+        return {"result": result.to_record(), "stored": stored}
+    
+    def _store(self, counselor_id: str, session_id: str, text: str, patient_info: PatientInfo, result) -> bool:
+        """Append the assessment to the conversation and save it before responding.
+        
+        Other threads, worker processes or the Streamlit app may append to
+        the same conversation meanwhile; storage places this save after
+        their messages (see ``Database._place_batch``), so no lock is needed.
+        """
+        conversation = self.db.load_conversation(counselor_id, session_id, assessments=1)
+        if conversation is None:
+            conversation = Conversation(
+                id=str(uuid.uuid4()),
+                counselor_id=counselor_id,
+                session_id=session_id,
+                title="",
+            )
+        note_seq = conversation._seq_offset + len(conversation.messages)
+        conversation.add_message("user", text)
+        conversation.add_message("patient_info", patient_info)
+        conversation.add_message("assistant", result.model_copy(update={"note_seq": note_seq}))
+        return self.db.save_conversation(conversation)
+    
+    def similar_cases(self, payload: Dict) -> Dict:
+        text = self._text(payload)
+        top_k = payload.get("top_k", 3)
+        if not isinstance(top_k, int) or not 1 <= top_k <= 50:
+            raise RequestError(400, "'top_k' must be an integer between 1 and 50")
+        if self.agent.rag_system is None:
+            raise RequestError(503, "similar case retrieval is not available")
+        return {"cases": self.agent.rag_system.find_similar_posts(text, top_k=top_k)}
+    
+    def related_cases(self, payload: Dict) -> Dict:
+        post_id = payload.get("post_id")
+        top_k = payload.get("top_k", 3)
+        if not isinstance(post_id, int):
+            raise RequestError(400, "'post_id' must be an integer")
+        if not isinstance(top_k, int) or not 1 <= top_k <= 50:
+            raise RequestError(400, "'top_k' must be an integer between 1 and 50")
+        if self.agent.rag_system is None or self.agent.rag_system.neighbor_graph is None:
+            raise RequestError(503, "related case lookup is not available")
+        try:
+            return {"cases": self.agent.rag_system.neighbors_of(post_id, k=top_k)}
+        except KeyError:
+            raise RequestError(404, f"no post with id {post_id}")
+    
+    def advice_stream(self, payload: Dict) -> Iterator[Dict]:
+        """Score first (memoised stages), then the advice as it is generated."""
+        text = self._text(payload)
+        patient_info = self._patient_info(payload)
+        score = payload.get("score")
+        if score is not None and (not isinstance(score, int) or isinstance(score, bool) or not 0 <= score <= MAX_SCORE):
+            raise RequestError(400, f"'score' must be an integer between 0 and {MAX_SCORE}")
+        
+        if score is None or patient_info is None:
+            state = self.agent.assess_only(text, patient_info)
+            patient_info = state["patient_info"]
+            score = state["phq8_score"] if score is None else score
+        
+        yield {"score": score, "severity_level": severity_level(score), "patient_info": patient_info.to_record()}
+        for delta in self.agent.stream_advice(text, patient_info, score):
+            yield {"delta": delta}
+        yield {"done": True}
+
+
+class AssessmentRequestHandler(BaseHTTPRequestHandler):
+    """HTTP/1.1 handler: persistent connections, bounded bodies, JSON in and out."""
+    
+    protocol_version = "HTTP/1.1"
+    server_version = "AssessmentService/1.0"
+    
+    def setup(self):
+        # Idle keep-alive connections are closed after this many seconds
+        self.timeout = self.server.keepalive_timeout
+        super().setup()
+    
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+    
+    def _read_json(self) -> Dict:
+        length = self.headers.get("Content-Length")
+        if length is None:
+            raise RequestError(411, "Content-Length required")
+        try:
+            length = int(length)
+        except ValueError:
+            raise RequestError(400, "invalid Content-Length")
+        if length > self.server.max_body_bytes:
+            # The body is not read, so the connection cannot be reused
+            self.close_connection = True
+            raise RequestError(413, f"request body exceeds {self.server.max_body_bytes} bytes")
+        
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise RequestError(400, f"invalid JSON: {e}")
+        if not isinstance(payload, dict):
+            raise RequestError(400, "request body must be a JSON object")
+        return payload
+    
+    def _send_headers(self, status: int, content_type: str, length: Optional[int] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if length is None:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(length))
+        if self.server.draining:
+            self.close_connection = True
+        self.send_header("Connection", "close" if self.close_connection else "keep-alive")
+        self.end_headers()
+    
+    def _send_json(self, status: int, payload: Dict):
+        body = json.dumps(payload, default=str).encode("utf-8")
+        self._send_headers(status, "application/json", len(body))
+        self.wfile.write(body)
+    
+    def _send_stream(self, events: Iterator[Dict]):
+        # Pull the first event before committing to a 200 so request errors still get a status code
+        first = next(events)
+        self._send_headers(200, "application/x-ndjson")
+        try:
+            self._write_chunk(first)
+            for event in events:
+                self._write_chunk(event)
+        except Exception as e:
+            if isinstance(e, (BrokenPipeError, ConnectionResetError)):
+                self.close_connection = True
+                return
+            self._write_chunk({"error": str(e)})
+        self.wfile.write(b"0\r\n\r\n")
+    
+    def _write_chunk(self, event: Dict):
+        data = (json.dumps(event, default=str) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+    
+    def do_GET(self):
+        if self.path == "/healthz":
+            self._send_json(503 if self.server.draining else 200, {
+                "status": "draining" if self.server.draining else "ok",
+                "pid": os.getpid(),
+                **self.server.metrics(),
+                "output_repair": self.server.service.agent.output_repair.metrics(),
+                "prompt_cache": self.server.service.agent.prompt_cache.metrics(),
+                "speculation": self.server.service.agent.speculation.metrics() if self.server.service.agent.speculation else None,
+            })
+        else:
+            self._send_json(404, {"error": f"no route for GET {self.path}"})
+    
+    def do_POST(self):
+        service = self.server.service
+        routes = {
+            "/v1/extract": service.extract,
+            "/v1/assess": service.assess,
+            "/v1/similar-cases": service.similar_cases,
+            "/v1/related-cases": service.related_cases,
+        }
+        started = time.perf_counter()
+        status = 200
+        
+        try:
+            if self.path == "/v1/advice/stream":
+                self._send_stream(service.advice_stream(self._read_json()))
+            elif self.path in routes:
+                self._send_json(200, routes[self.path](self._read_json()))
+            else:
+                raise RequestError(404, f"no route for POST {self.path}")
+        except RequestError as e:
+            status = e.status
+            self._send_json(e.status, {"error": e.message})
+        except Exception as e:
+            status = 500
+            print(f"Error handling {self.path}: {e}")
+            self._send_json(500, {"error": "internal error"})
+        finally:
+            self.server.record(self.path, status, time.perf_counter() - started)
+
+
+class AssessmentHTTPServer(HTTPServer):
+    """HTTP server that hands connections to a fixed pool of request threads.
+    
+    ``drain`` stops accepting new connections, lets in-flight requests finish
+    (closing their keep-alive connections afterwards) and waits up to
+    ``drain_timeout`` seconds for them.
+    """
+    
+    allow_reuse_address = True
+    
+    def __init__(
+        self,
+        address,
+        service: AssessmentService,
+        threads: int = 8,
+        max_body_bytes: int = 64 * 1024,
+        keepalive_timeout: float = 5.0,
+        drain_timeout: float = 30.0,
+        verbose: bool = False,
+        listener: Optional[socket.socket] = None,
+    ):
+        super().__init__(address, AssessmentRequestHandler, bind_and_activate=listener is None)
+        if listener is not None:
+            # Pre-forked worker: serve the socket inherited from the parent
+            self.socket.close()
+            self.socket = listener
+            self.server_address = listener.getsockname()
+        
+        self.service = service
+        self.max_body_bytes = max_body_bytes
+        self.keepalive_timeout = keepalive_timeout
+        self.drain_timeout = drain_timeout
+        self.verbose = verbose
+        self.draining = False
+        
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http-worker")
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stats = {"connections": 0, "requests": 0, "errors": 0, "total_seconds": 0.0}
+        self._by_route: Dict[str, int] = {}
+    
+    def process_request(self, request, client_address):
+        future = self._executor.submit(self._process, request, client_address)
+        with self._lock:
+            self._stats["connections"] += 1
+            self._in_flight.add(future)
+        future.add_done_callback(self._done)
+    
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+    
+    def _done(self, future):
+        with self._lock:
+            self._in_flight.discard(future)
+    
+    def record(self, path: str, status: int, seconds: float):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["errors"] += status >= 500
+            self._stats["total_seconds"] += seconds
+            self._by_route[path] = self._by_route.get(path, 0) + 1
+    
+    def metrics(self) -> Dict:
+        with self._lock:
+            requests = self._stats["requests"]
+            return {
+                "connections": self._stats["connections"],
+                "open_connections": len(self._in_flight),
+                "requests": requests,
+                "errors": self._stats["errors"],
+                "mean_latency_ms": round(self._stats["total_seconds"] * 1000 / requests, 2) if requests else 0.0,
+                "requests_by_route": dict(self._by_route),
+            }
+    
+    def drain(self):
+        """Stop accepting connections and wait for the ones in progress. Call from a non-serving thread."""
+        if self.draining:
+            return
+        self.draining = True
+        print(f"[{os.getpid()}] Draining: waiting for {len(self._in_flight)} open connections")
+        self.shutdown()
+        with self._lock:
+            pending = list(self._in_flight)
+        done, not_done = wait(pending, timeout=self.drain_timeout)
+        if not_done:
+            print(f"[{os.getpid()}] Drain timed out with {len(not_done)} connections still open")
+        self._executor.shutdown(wait=False)
+
+
+def serve(args, listener: Optional[socket.socket] = None):
+    """Run one server process until SIGTERM/SIGINT, then drain."""
+    service = AssessmentService(build_agent(args.fake_llm, load_rag=not args.no_rag), create_database())
+    server = AssessmentHTTPServer(
+        (args.host, args.port),
+        service,
+        threads=args.threads,
+        max_body_bytes=args.max_body_bytes,
+        keepalive_timeout=args.keepalive_timeout,
+        drain_timeout=args.drain_timeout,
+        verbose=args.verbose,
+        listener=listener,
+    )
+    
+    drain_threads = []
+    
+    def on_signal(signum, frame):
+        thread = threading.Thread(target=server.drain, name="drain", daemon=True)
+        drain_threads.append(thread)
+        thread.start()
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    
+    host, port = server.server_address[:2]
+    print(f"[{os.getpid()}] Serving on http://{host}:{port} with {args.threads} threads")
+    server.serve_forever()
+    
+    # serve_forever returns as soon as drain() calls shutdown(); wait for the drain itself
+    for thread in drain_threads:
+        thread.join()
+    server.server_close()
+    print(f"[{os.getpid()}] Stopped")
+
+
+def serve_prefork(args):
+    """Bind once, fork ``args.processes`` workers on the shared socket and forward shutdown signals."""
+    listener = socket.create_server((args.host, args.port), backlog=128)
+    children = []
+    for _ in range(args.processes):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve(args, listener)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    
+    def forward(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    
+    print(f"[{os.getpid()}] Started {len(children)} worker processes on {args.host}:{args.port}")
+    for pid in children:
+        os.waitpid(pid, 0)
+    listener.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless assessment HTTP service")
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", "8080")))
+    parser.add_argument("--processes", type=int, default=int(os.getenv("SERVER_PROCESSES", "1")),
+                        help="pre-forked worker processes, each with its own agent")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("SERVER_THREADS", "8")),
+                        help="request threads per process")
+    parser.add_argument("--max-body-bytes", type=int, default=int(os.getenv("SERVER_MAX_BODY_BYTES", str(64 * 1024))))
+    parser.add_argument("--keepalive-timeout", type=float, default=float(os.getenv("SERVER_KEEPALIVE_TIMEOUT", "5")))
+    parser.add_argument("--drain-timeout", type=float, default=float(os.getenv("SERVER_DRAIN_TIMEOUT", "30")))
+    parser.add_argument("--fake-llm", action="store_true", help="use fakes.FakeChatModel instead of OpenAI")
+    parser.add_argument("--no-rag", action="store_true", help="do not load the similar case index")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    
+    args = parse_args()
+    if args.processes > 1 and hasattr(os, "fork"):
+        serve_prefork(args)
+    else:
+        serve(args)
+    sys.exit(0)
@@ -0,0 +1,100 @@
+"""
+Speculative advice generation ahead of the severity score.
+
+The advice prompt depends on the severity score, so advice normally waits
+for the severity LLM call. In speculative mode the agent starts the advice
+call at the same time, using the keyword screen's provisional score
+(``screening.provisional_risk_score``). When the real score arrives, the
+speculative advice is kept if it falls in the same severity band;
+otherwise the speculative stream is cancelled and the advice regenerated
+with the real score, which costs no more latency than not speculating.
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from models import severity_level
+
+
+class Speculation:
+    """An advice generation started for a provisional score."""
+    
+    def __init__(self, future: Future, cancel: threading.Event, provisional_score: int):
+        self.future = future
+        self.cancel = cancel
+        self.provisional_score = provisional_score
+        self.band = severity_level(provisional_score)
+        self.started = time.perf_counter()
+
+
+class SpeculativeAdvice:
+    """Runs speculative advice calls on a small thread pool and counts how often they pay off."""
+    
+    def __init__(self, workers: int = 4):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="speculative-advice")
+        self._lock = threading.Lock()
+        self._stats = {
+            "speculations": 0,
+            "hits": 0,
+            "misses": 0,
+            "failed": 0,
+            "latency_saved_ms": 0.0,
+            "wasted_ms": 0.0,
+        }
+    
+    def start(self, generate: Callable[[threading.Event], Optional[str]], provisional_score: int) -> Speculation:
+        """Start ``generate(cancel)`` now; it should stop early and return None once ``cancel`` is set."""
+        cancel = threading.Event()
+        speculation = Speculation(None, cancel, provisional_score)
+        
+        def timed():
+            advice = generate(cancel)
+            return advice, time.perf_counter()
+        
+        speculation.future = self._pool.submit(timed)
+        with self._lock:
+            self._stats["speculations"] += 1
+        return speculation
+    
+    def resolve(self, speculation: Speculation, score: int) -> Optional[str]:
+        """The speculative advice if ``score`` is in its band, else None after cancelling it."""
+        scored = time.perf_counter()
+        if severity_level(score) != speculation.band:
+            speculation.cancel.set()
+            speculation.future.cancel()
+            with self._lock:
+                self._stats["misses"] += 1
+                self._stats["wasted_ms"] += (scored - speculation.started) * 1000
+            return None
+        
+        try:
+            advice, finished = speculation.future.result()
+        except Exception as e:
+            print(f"⚠️ Speculative advice failed, regenerating: {e}")
+            advice = None
+        if not advice:
+            with self._lock:
+                self._stats["failed"] += 1
+            return None
+        
+        # Without speculation the whole generation would have started at ``scored``
+        waited = max(0.0, time.perf_counter() - scored)
+        with self._lock:
+            self._stats["hits"] += 1
+            self._stats["latency_saved_ms"] += max(0.0, (finished - speculation.started) - waited) * 1000
+        return advice
+    
+    def metrics(self) -> Dict:
+        with self._lock:
+            resolved = self._stats["hits"] + self._stats["misses"] + self._stats["failed"]
+            return dict(
+                self._stats,
+                latency_saved_ms=round(self._stats["latency_saved_ms"], 2),
+                wasted_ms=round(self._stats["wasted_ms"], 2),
+                hit_rate=round(self._stats["hits"] / resolved, 4) if resolved else 0.0,
+                mean_saved_ms=round(self._stats["latency_saved_ms"] / self._stats["hits"], 2) if self._stats["hits"] else 0.0,
+            )
+    
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
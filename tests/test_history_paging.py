@@ -0,0 +1,104 @@
+import mongomock
+import pytest
+
+import database
+from database import ARCHIVE_PAGE_ASSESSMENTS, MongoDatabase, SQLiteDatabase
+from models import AssessmentResult, Conversation, PatientInfo
+from views import iter_assessments, render_history
+
+
+@pytest.fixture(params=["sqlite", "mongo"])
+def db(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteDatabase(str(tmp_path / "conversations.db"))
+    return MongoDatabase(client=mongomock.MongoClient())
+
+
+def write_history(db, notes, late=()):
+    """Save ``notes`` answered in order, except that each note in ``late`` is answered after the next one."""
+    conversation = Conversation(id="x", counselor_id="c1", session_id="s1", title="")
+    waiting = []
+    for n in range(notes):
+        waiting.append((n, len(conversation.messages)))
+        conversation.add_message("user", f"note {n}")
+        if n in late:
+            continue
+        for answered, note_seq in waiting:
+            conversation.add_message("patient_info", PatientInfo())
+            conversation.add_message("assistant", AssessmentResult(score=answered % 11, note_seq=note_seq))
+        waiting = []
+    assert db.save_conversation(conversation)
+    return conversation
+
+
+def pairs(conversation):
+    """(note text, score) per assessment shown, None for a part that is missing."""
+    return [
+        (user.content if user is not None else None, assistant.content.score if assistant is not None else None)
+        for _, _, user, _, assistant in iter_assessments(conversation.messages, 0, conversation._seq_offset)
+    ]
+
+
+def test_page_takes_in_the_note_its_answer_names(db):
+    write_history(db, 4, late={2})
+    conversation = db.load_conversation("c1", "s1", assessments=1)
+    assert pairs(conversation) == [("note 2", 2), ("note 3", 3)]
+    
+    db.load_older_messages(conversation, 1)
+    assert pairs(conversation)[:2] == [("note 1", 1), ("note 2", 2)]
+
+
+def test_archived_pages_inflate_only_the_members_they_need(db, monkeypatch):
+    notes = 3 * ARCHIVE_PAGE_ASSESSMENTS + 5
+    write_history(db, notes)
+    stub = db.archive_conversation("c1:s1", keep_assessments=5)
+    assert stub["assessments"] == notes - 5
+    assert len(stub["pages"]) == 3 and stub["pages"][0] == [0, 0]
+    # The members together are still one readable segment
+    assert [m.seq for m in db.load_archived_messages("c1:s1", 0)] == list(range(3 * (notes - 5)))
+    
+    inflated = []
+    inflate = database._inflate
+    monkeypatch.setattr(database, "_inflate", lambda data: inflated.append(len(data)) or inflate(data))
+    conversation = db.load_conversation("c1", "s1", assessments=5)
+    assert pairs(conversation) == [(f"note {n}", n % 11) for n in range(notes - 5, notes)]
+    
+    db.load_older_messages(conversation, 5)
+    assert pairs(conversation)[:5] == [(f"note {n}", n % 11) for n in range(notes - 10, notes - 5)]
+    assert len(conversation.messages) == 30
+    assert len(inflated) == 1 and inflated[0] < stub["bytes"] / 2
+
+
+def test_archived_page_takes_in_a_named_note_from_the_previous_member(db):
+    # The late note is the last of the first member, its answer is in the second
+    late = ARCHIVE_PAGE_ASSESSMENTS - 1
+    write_history(db, 2 * ARCHIVE_PAGE_ASSESSMENTS + 1, late={late})
+    db.archive_conversation("c1:s1", keep_assessments=1)
+    conversation = db.load_conversation("c1", "s1", assessments=1)
+    loaded = lambda: [m.content for m in conversation.messages if m.role == "user"]
+    while f"note {late + 1}" not in loaded():
+        assert db.load_older_messages(conversation, 5)
+    
+    shown = pairs(conversation)
+    assert shown[:2] == [(f"note {late}", late % 11), (f"note {late + 1}", (late + 1) % 11)]
+    assert all(user is not None and score is not None for user, score in shown)
+
+
+def test_answer_without_its_note_is_shown_on_its_own():
+    conversation = Conversation(id="x", counselor_id="c1", session_id="s1", title="")
+    conversation.add_message("user", "note 0")
+    conversation.add_message("user", "note 1")
+    conversation.add_message("patient_info", PatientInfo())
+    conversation.add_message("assistant", AssessmentResult(score=4, note_seq=0))
+    conversation.add_message("patient_info", PatientInfo())
+    conversation.add_message("assistant", AssessmentResult(score=5, note_seq=1))
+    # The page starts after note 0, so its answer has no note to go with
+    page = conversation.messages[1:]
+    
+    shown = list(iter_assessments(page, 0, 1))
+    assert [(number, note_seq, user.content if user else None, assistant.content.score) for number, note_seq, user, _, assistant in shown] == [
+        (1, 1, "note 1", 5),
+        (None, 0, None, 4),
+    ]
+    html = "".join(render_history(page, 0, first_seq=1))
+    assert "Assessment of an earlier note" in html and "Assessment #1" in html
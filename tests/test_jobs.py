@@ -0,0 +1,86 @@
+import threading
+
+from jobs import CANCELLED, DONE, FAILED, AssessmentJobQueue, job_outcome
+from models import AssessmentResult, PatientInfo
+
+
+class GatedAgent:
+    """Assesses notes once ``release`` is set; notes containing "fail" raise."""
+    
+    def __init__(self):
+        self.release = threading.Event()
+    
+    def extract_patient_info_only(self, text):
+        self.release.wait(5)
+        return PatientInfo(age=30)
+    
+    def process_with_patient_info(self, text, patient_info):
+        if "fail" in text:
+            raise RuntimeError("model unavailable")
+        return AssessmentResult(score=len(text) % 11)
+
+
+def collect_outcomes(queue, texts, **submit_kwargs):
+    """Submit ``texts`` and gather the callback outcomes without ever polling the queue."""
+    outcomes = {}
+    finished = threading.Semaphore(0)
+    
+    def on_finish(text, job):
+        outcomes[text] = (job.status, job_outcome(job))
+        finished.release()
+    
+    job_ids = {text: queue.submit(text, on_finish=lambda job, text=text: on_finish(text, job), **submit_kwargs) for text in texts}
+    return outcomes, finished, job_ids
+
+
+def test_outcomes_are_delivered_even_once_evicted():
+    agent = GatedAgent()
+    queue = AssessmentJobQueue(agent, workers=2, keep_finished=0)
+    texts = [f"note {i}" for i in range(6)]
+    outcomes, finished, job_ids = collect_outcomes(queue, texts)
+    agent.release.set()
+    for _ in texts:
+        assert finished.acquire(timeout=5)
+    queue.close()
+    
+    for text in texts:
+        status, (patient_info, result) = outcomes[text]
+        assert status == DONE
+        assert result.error is None and result.score == len(text) % 11
+        assert patient_info.age == 30
+        # keep_finished=0 evicts every job as soon as it finishes
+        assert queue.get(job_ids[text]) is None
+
+
+def test_only_cancelled_jobs_are_recorded_as_cancelled():
+    agent = GatedAgent()
+    queue = AssessmentJobQueue(agent, workers=1, keep_finished=0)
+    outcomes, finished, job_ids = collect_outcomes(queue, ["running", "queued", "fail"])
+    assert queue.cancel(job_ids["queued"])
+    agent.release.set()
+    for _ in range(3):
+        assert finished.acquire(timeout=5)
+    queue.close()
+    
+    assert outcomes["running"][0] == DONE
+    assert outcomes["queued"][0] == CANCELLED
+    assert outcomes["queued"][1][1].error == "Assessment cancelled."
+    assert outcomes["fail"][0] == FAILED
+    assert "model unavailable" in outcomes["fail"][1][1].error
+    assert queue.metrics()["cancelled"] == 1
+
+
+def test_failing_callback_does_not_stop_the_worker():
+    agent = GatedAgent()
+    agent.release.set()
+    queue = AssessmentJobQueue(agent, workers=1)
+    
+    def broken(job):
+        raise ValueError("storage down")
+    
+    first = queue.submit("first", on_finish=broken)
+    second = queue.submit("second")
+    for job_id in (first, second):
+        assert queue.get(job_id).handled.wait(5)
+    queue.close()
+    assert queue.get(second).status == DONE
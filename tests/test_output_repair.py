@@ -0,0 +1,67 @@
+import pytest
+from langchain.output_parsers import PydanticOutputParser
+
+from models import MoodSymptom, PatientInfo
+from output_repair import PatientInfoParser, repair_patient_info
+
+
+class RecordingFixer:
+    """Stands in for the LLM fixing parser and records what it was asked to fix."""
+    
+    def __init__(self):
+        self.calls = []
+    
+    def parse(self, text):
+        self.calls.append(text)
+        return PatientInfo(hopelessness=True)
+
+
+def make_parser():
+    fixer = RecordingFixer()
+    return PatientInfoParser(PydanticOutputParser(pydantic_object=PatientInfo), fixer), fixer
+
+
+ALL_FLAGS = '"sleep_issues": false, "appetite_changes": false, "social_withdrawal": false, "concentration_issues": false'
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("{age: 30, 'hopelessness': 'yes', 'mood': 'sad', 'sleep': 'no', 'appetite': 'no', 'withdrawal': 'no', "
+     "'concentration': 'no'}",
+     {"age": 30, "hopelessness": True, "mood_symptoms": [MoodSymptom.sadness]}),
+    ('{"hopelessness": "Yes - passive ideation", "social_withdrawal": "yes, reports feeling worthless", '
+     '"sleep_issues": false, "appetite_changes": false, "concentration_issues": false}',
+     {"hopelessness": True, "social_withdrawal": True}),
+    ('```json\n{"hopelessness": "denies hopelessness", ' + ALL_FLAGS + ',}\n```',
+     {"hopelessness": False, "sleep_issues": False}),
+])
+def test_repairs_near_json_locally(text, expected):
+    info, _ = repair_patient_info(text)
+    assert {name: getattr(info, name) for name in expected} == expected
+
+
+@pytest.mark.parametrize("text", [
+    # Cut off before the risk flags
+    '{"age": 40, "sleep_issues": true, "hopelessness": ',
+    '{"age": 40, ' + ALL_FLAGS,
+    # Risk flag missing, null or not stated
+    '{"age": 40, ' + ALL_FLAGS + '}',
+    '{"age": 40, "hopelessness": null, ' + ALL_FLAGS + '}',
+    '{"age": 40, "hopelessness": "unknown", ' + ALL_FLAGS + '}',
+    '{"age": 40, "hopelessness": "not mentioned", ' + ALL_FLAGS + '}',
+    '{"age": 40, "hopelessness": "passive ideation at times", ' + ALL_FLAGS + '}',
+])
+def test_unreadable_risk_flags_go_to_the_llm(text):
+    with pytest.raises(ValueError):
+        repair_patient_info(text)
+    
+    parser, fixer = make_parser()
+    assert parser.parse(text).hopelessness is True
+    assert fixer.calls == [text]
+    assert parser.metrics()["llm"] == 1
+
+
+def test_valid_output_parses_strictly():
+    parser, fixer = make_parser()
+    info = parser.parse(PatientInfo(age=22, hopelessness=True).model_dump_json())
+    assert info.hopelessness is True
+    assert parser.metrics()["strict"] == 1 and not fixer.calls
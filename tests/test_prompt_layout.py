@@ -0,0 +1,69 @@
+import pytest
+
+from agent import CounselorAgent
+from fakes import FakeChatModel
+from models import EnergyLevel, MoodSymptom, PatientInfo
+from prompt_layout import MIN_CACHED_PROMPT_TOKENS, prefix_problems
+from prompts import SHARED_CLINICAL_CONTEXT
+
+NOTES = [
+    dict(
+        input_text="Patient reports poor sleep and feeling hopeless.",
+        patient_info=PatientInfo(age=34, sleep_issues=True, energy_level=EnergyLevel.low, mood_symptoms=[MoodSymptom.sadness]),
+        phq8_score=7,
+    ),
+    dict(input_text="Client is anxious about exams, sleeping fine.", patient_info=PatientInfo(hopelessness=True), phq8_score=2),
+    dict(input_text="Pt has pills saved up {and} a date in mind.", patient_info=PatientInfo(age=61), phq8_score=9),
+]
+
+
+def make_agent():
+    return CounselorAgent(llm=FakeChatModel(), advice_llm=FakeChatModel(), load_rag=False)
+
+
+@pytest.fixture(scope="module")
+def agent():
+    return make_agent()
+
+
+@pytest.mark.parametrize("stage", ["extract_info", "assess_severity", "generate_advice"])
+def test_prefix_is_byte_identical_across_notes(agent, stage):
+    prompt = agent.prompts[stage]
+    samples = [agent.stage_messages(stage, **fields) for fields in NOTES]
+    samples.append(agent.stage_messages(stage, band_only=True, **NOTES[0]))
+    assert prefix_problems(prompt, samples) == []
+    # The note only ever appears after the prefix
+    for fields, messages in zip(NOTES, samples):
+        assert fields["input_text"] not in messages[0].content
+        assert fields["input_text"] in messages[1].content
+
+
+def test_prefix_is_identical_across_agents(agent):
+    other = make_agent()
+    assert {stage: prompt.prefix for stage, prompt in agent.prompts.items()} == {
+        stage: prompt.prefix for stage, prompt in other.prompts.items()
+    }
+    assert {stage: prompt.digest for stage, prompt in agent.prompts.items()} == {
+        stage: prompt.digest for stage, prompt in other.prompts.items()
+    }
+
+
+def test_stages_share_the_leading_reference(agent):
+    for prompt in agent.prompts.values():
+        assert prompt.prefix.startswith(SHARED_CLINICAL_CONTEXT.strip())
+
+
+@pytest.mark.parametrize("stage", ["extract_info", "assess_severity", "generate_advice"])
+def test_prefix_reaches_the_cache_minimum(agent, stage):
+    prompt = agent.prompts[stage]
+    assert prompt.cacheable, f"{stage} prefix is ~{prompt.estimated_prefix_tokens} tokens, below {MIN_CACHED_PROMPT_TOKENS}"
+
+
+def test_repeated_assessments_hit_the_prompt_cache():
+    agent = make_agent()
+    for fields in NOTES[:2]:
+        agent.process_with_patient_info(fields["input_text"], fields["patient_info"])
+    metrics = agent.prompt_cache.metrics()
+    for stage in ("assess_severity", "generate_advice"):
+        assert metrics[stage]["prefix_mismatches"] == 0
+        assert metrics[stage]["calls_with_cache_hit"] >= 1
@@ -0,0 +1,115 @@
+import multiprocessing
+import os
+
+import mongomock
+import pytest
+
+from database import MongoDatabase, SQLiteDatabase
+from models import AssessmentResult, Conversation, PatientInfo
+from persistence import WriteBehindQueue
+
+
+def append_assessment(db, text, score):
+    """What the server does per request: load the latest page, append one assessment, save."""
+    conversation = db.load_conversation("c1", "s1", assessments=1)
+    if conversation is None:
+        conversation = Conversation(id="x", counselor_id="c1", session_id="s1", title="")
+    note_seq = conversation._seq_offset + len(conversation.messages)
+    conversation.add_message("user", text)
+    conversation.add_message("patient_info", PatientInfo())
+    conversation.add_message("assistant", AssessmentResult(score=score, note_seq=note_seq))
+    assert db.save_conversation(conversation)
+
+
+def check_history(db, notes):
+    """Every note stored once, in seq order, with its own assessment."""
+    conversation = db.load_conversation("c1", "s1")
+    messages = conversation.messages
+    assert [message.seq for message in messages] == list(range(len(messages)))
+    assert sorted(message.content for message in messages if message.role == "user") == sorted(notes)
+    for message in messages:
+        if message.role == "assistant":
+            note = messages[message.content.note_seq]
+            assert note.role == "user" and note.content == f"note {message.content.score}"
+    assert conversation.total_assessments == len(notes)
+    assert sum(conversation.rollups.band_counts.values()) == sum(message.role == "assistant" for message in messages)
+
+
+@pytest.fixture(params=["sqlite", "mongo"])
+def make_db(request, tmp_path):
+    if request.param == "sqlite":
+        return lambda: SQLiteDatabase(str(tmp_path / "conversations.db"))
+    client = mongomock.MongoClient()
+    return lambda: MongoDatabase(client=client)
+
+
+def test_stale_writers_do_not_overwrite_each_other(make_db):
+    first, second = make_db(), make_db()
+    append_assessment(first, "note 0", 0)
+    
+    # Both load the same state, then both append
+    a = first.load_conversation("c1", "s1", assessments=1)
+    b = second.load_conversation("c1", "s1", assessments=1)
+    for conversation, db, n in ((a, first, 1), (b, second, 2)):
+        note_seq = conversation._seq_offset + len(conversation.messages)
+        conversation.add_message("user", f"note {n}")
+        conversation.add_message("patient_info", PatientInfo())
+        conversation.add_message("assistant", AssessmentResult(score=n, note_seq=note_seq))
+        assert db.save_conversation(conversation)
+    
+    # The moved conversation keeps saving after the other writer's messages
+    b.add_message("user", "note 3")
+    assert second.save_conversation(b)
+    check_history(first, ["note 0", "note 1", "note 2", "note 3"])
+
+
+def test_retried_save_is_not_duplicated(make_db):
+    db = make_db()
+    conversation = Conversation(id="x", counselor_id="c1", session_id="s1", title="")
+    conversation.add_message("user", "note 0")
+    batch = db.prepare_save(conversation)
+    db.write_batches([batch])
+    db.write_batches([db.prepare_save(conversation)])
+    assert [message.content for message in db.load_conversation("c1", "s1").messages] == ["note 0"]
+
+
+def test_write_behind_queue_follows_a_moved_save(make_db):
+    db, other = make_db(), make_db()
+    append_assessment(db, "note 0", 0)
+    conversation = db.load_conversation("c1", "s1")
+    append_assessment(other, "note 1", 1)
+    
+    writer = WriteBehindQueue(db, flush_interval=0.01)
+    try:
+        conversation.add_message("user", "note 2")
+        writer.submit(conversation)
+        assert writer.flush(5)
+        conversation.add_message("user", "note 3")
+        writer.submit(conversation)
+        assert writer.flush(5)
+    finally:
+        writer.close()
+    
+    stored = db.load_conversation("c1", "s1").messages
+    assert [message.seq for message in stored] == list(range(8))
+    assert [message.content for message in stored if message.role == "user"] == ["note 0", "note 1", "note 2", "note 3"]
+
+
+def _worker(path, worker, count):
+    db = SQLiteDatabase(path)
+    for i in range(count):
+        n = worker * count + i
+        append_assessment(db, f"note {n}", n)
+
+
+def test_concurrent_processes_append_every_assessment(tmp_path):
+    path = str(tmp_path / "conversations.db")
+    workers, count = 4, 15
+    context = multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn")
+    processes = [context.Process(target=_worker, args=(path, worker, count)) for worker in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+        assert process.exitcode == 0
+    check_history(SQLiteDatabase(path), [f"note {n}" for n in range(workers * count)])
@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+import pytest
+
+from vector_shards import read_manifest, row_batches, write_shards
+
+
+@pytest.mark.parametrize("rows,shards,batch_rows", [(10, 3, 4), (10, 3, 1), (7, 7, 100), (5, 8, 2)])
+def test_streamed_shards_match_the_normalised_matrix(tmp_path, rows, shards, batch_rows):
+    matrix = np.random.default_rng(rows).standard_normal((rows, 6)).astype(np.float32)
+    manifest = write_shards(row_batches(matrix, batch_rows), rows, str(tmp_path), shards, {"size": 1})
+    
+    assert read_manifest(str(tmp_path)) == manifest
+    assert manifest["rows"] == rows and manifest["dimensions"] == 6
+    assert len(manifest["shards"]) == min(shards, rows)
+    stored = np.concatenate([np.load(os.path.join(tmp_path, entry["path"])) for entry in manifest["shards"]])
+    expected = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.testing.assert_allclose(stored, expected, rtol=1e-6)
+    assert [entry["start"] for entry in manifest["shards"]] == list(np.cumsum([0] + [entry["rows"] for entry in manifest["shards"]])[:-1])
+
+
+def test_batches_are_consumed_from_a_generator(tmp_path):
+    seen = []
+    
+    def batches():
+        for start in range(0, 12, 5):
+            batch = np.ones((min(5, 12 - start), 3), dtype=np.float32)
+            seen.append(len(batch))
+            yield batch
+    
+    write_shards(batches(), 12, str(tmp_path), 2)
+    assert seen == [5, 5, 2]
+
+
+def test_row_count_is_checked(tmp_path):
+    with pytest.raises(ValueError):
+        write_shards(row_batches(np.ones((3, 2))), 4, str(tmp_path), 2)
+    with pytest.raises(ValueError):
+        write_shards(row_batches(np.ones((5, 2))), 4, str(tmp_path), 2)
+
+
+def test_empty_corpus_writes_one_empty_shard(tmp_path):
+    manifest = write_shards([], 0, str(tmp_path), 4)
+    assert manifest["rows"] == 0 and len(manifest["shards"]) == 1
+    assert np.load(os.path.join(tmp_path, manifest["shards"][0]["path"])).shape == (0, 0)
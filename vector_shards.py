@@ -0,0 +1,211 @@
+"""
+Sharded dense search over memory-mapped embedding segments.
+
+``write_shards`` streams batches of embedding rows into row ranges, each
+a normalised float32 ``.npy`` file written through a memory map, with a
+``manifest.json`` describing them; the full matrix is never held. ``ShardedIndex`` fans each query out to a process pool: every worker
+memory-maps the shards it is asked about (so the OS page cache, not each
+process, holds the vectors), scores them and returns its local top-k,
+which the caller merges. A query whose shards do not all answer within
+``timeout_s`` returns the merged top-k of the shards that did, marked
+partial, unless ``allow_partial`` is off.
+"""
+import atexit
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+MANIFEST = "manifest.json"
+
+# Shards opened by this worker process, by path
+_open_shards: Dict[str, np.ndarray] = {}
+
+
+def _shard(path: str) -> np.ndarray:
+    shard = _open_shards.get(path)
+    if shard is None:
+        shard = _open_shards[path] = np.load(path, mmap_mode="r")
+    return shard
+
+
+def _search_shard(path: str, start: int, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top ``k`` rows of one shard for each query, as global row indices and cosine scores."""
+    scores = queries @ _shard(path).T
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < scores.shape[1] else np.tile(np.arange(k), (len(queries), 1))
+    return top + start, np.take_along_axis(scores, top, axis=1)
+
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def row_batches(matrix: np.ndarray, batch_rows: int = 4096) -> Iterator[np.ndarray]:
+    """``matrix`` in consecutive slices of ``batch_rows`` rows, for ``write_shards``."""
+    for start in range(0, len(matrix), batch_rows):
+        yield matrix[start:start + batch_rows]
+
+
+def write_shards(batches: Iterable[np.ndarray], rows: int, directory: str, shards: int, source: Optional[Dict] = None) -> Dict:
+    """Write ``rows`` embedding rows, given in ``batches``, as ``shards`` normalised row ranges under ``directory``.
+    
+    Returns the manifest. Only one batch is normalised in memory at a time.
+    """
+    os.makedirs(directory, exist_ok=True)
+    bounds = np.linspace(0, rows, max(1, min(shards, rows or 1)) + 1).astype(int)
+    entries = [
+        {"path": f"shard-{i:04d}.npy", "start": int(start), "rows": int(end - start)}
+        for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:]))
+    ]
+    
+    dimensions = 0
+    written = 0
+    shard, out = -1, None
+    for batch in batches:
+        batch = _normalise(batch)
+        dimensions = batch.shape[1]
+        taken = 0
+        while taken < len(batch):
+            if written >= rows:
+                raise ValueError(f"more than the {rows} rows expected")
+            if written == bounds[shard + 1]:
+                if out is not None:
+                    out.flush()
+                shard += 1
+                entry = entries[shard]
+                out = np.lib.format.open_memmap(
+                    os.path.join(directory, entry["path"]), mode="w+", dtype=np.float32, shape=(entry["rows"], dimensions)
+                )
+            count = min(len(batch) - taken, int(bounds[shard + 1]) - written)
+            out[written - bounds[shard]:written - bounds[shard] + count] = batch[taken:taken + count]
+            taken += count
+            written += count
+    if out is not None:
+        out.flush()
+        del out
+    if written != rows:
+        raise ValueError(f"expected {rows} rows, got {written}")
+    # Only an empty corpus leaves a shard unwritten
+    for entry in entries[shard + 1:]:
+        np.save(os.path.join(directory, entry["path"]), np.zeros((0, dimensions), dtype=np.float32))
+    
+    manifest = {
+        "rows": rows,
+        "dimensions": dimensions,
+        "shards": entries,
+        "source": source or {},
+    }
+    with open(os.path.join(directory, MANIFEST + ".tmp"), "w") as f:
+        json.dump(manifest, f)
+    os.replace(os.path.join(directory, MANIFEST + ".tmp"), os.path.join(directory, MANIFEST))
+    return manifest
+
+
+def read_manifest(directory: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class ShardedResult(NamedTuple):
+    indices: np.ndarray
+    scores: np.ndarray
+    shards_answered: int
+    shards_total: int
+    
+    @property
+    def partial(self) -> bool:
+        return self.shards_answered < self.shards_total
+
+
+class ShardedIndex:
+    """Process-pool search over the shards in ``directory``."""
+    
+    def __init__(self, directory: str, workers: Optional[int] = None, timeout_s: Optional[float] = None,
+                 allow_partial: bool = True):
+        self.directory = directory
+        self.manifest = read_manifest(directory)
+        if self.manifest is None:
+            raise FileNotFoundError(f"no shard manifest in {directory}")
+        self.shards = [(os.path.join(directory, entry["path"]), entry["start"], entry["rows"]) for entry in self.manifest["shards"]]
+        self.timeout_s = timeout_s
+        self.allow_partial = allow_partial
+        self.workers = workers or min(len(self.shards), os.cpu_count() or 1)
+        # spawn, not fork: the app and API processes run threads that a forked child would inherit mid-flight
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self._lock = threading.Lock()
+        self._stats = {"queries": 0, "partial_results": 0, "shard_timeouts": 0, "total_seconds": 0.0}
+        atexit.register(self.close)
+    
+    def __len__(self) -> int:
+        return self.manifest["rows"]
+    
+    def vectors(self, indices: np.ndarray) -> np.ndarray:
+        """Normalised vectors of the given global rows, read from the caller's own maps."""
+        out = np.empty((len(indices), self.manifest["dimensions"]), dtype=np.float32)
+        starts = np.array([start for _, start, _ in self.shards])
+        owners = np.searchsorted(starts, indices, side="right") - 1
+        for i, (index, owner) in enumerate(zip(indices, owners)):
+            path, start, _ = self.shards[owner]
+            out[i] = _shard(path)[index - start]
+        return out
+    
+    def search(self, queries: np.ndarray, k: int, timeout_s: Optional[float] = None) -> List[ShardedResult]:
+        """Global top ``k`` (indices and cosine scores, best first) for each query vector."""
+        started = time.perf_counter()
+        queries = _normalise(np.atleast_2d(queries))
+        timeout_s = self.timeout_s if timeout_s is None else timeout_s
+        futures = [self._pool.submit(_search_shard, path, start, queries, k) for path, start, _ in self.shards]
+        # Shards run in parallel, so each gets the same deadline
+        done, not_done = wait(futures, timeout=timeout_s)
+        for future in not_done:
+            future.cancel()
+        answered = [future.result() for future in futures if future in done and future.exception() is None]
+        failed = len(futures) - len(answered)
+        if failed and not self.allow_partial:
+            raise TimeoutError(f"{failed} of {len(futures)} shards did not answer")
+        
+        results = []
+        for q in range(len(queries)):
+            if answered:
+                indices = np.concatenate([local[0][q] for local in answered])
+                scores = np.concatenate([local[1][q] for local in answered])
+                order = np.argsort(-scores, kind="stable")[:k]
+                indices, scores = indices[order], scores[order]
+            else:
+                indices, scores = np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+            results.append(ShardedResult(indices, scores, len(answered), len(futures)))
+        
+        with self._lock:
+            self._stats["queries"] += len(queries)
+            self._stats["partial_results"] += len(queries) if failed else 0
+            self._stats["shard_timeouts"] += len(not_done)
+            self._stats["total_seconds"] += time.perf_counter() - started
+        if failed:
+            print(f"⚠️ Sharded search answered from {len(answered)} of {len(futures)} shards")
+        return results
+    
+    def metrics(self) -> Dict:
+        with self._lock:
+            calls = self._stats["queries"]
+            return dict(
+                self._stats,
+                shards=len(self.shards),
+                workers=self.workers,
+                mean_ms=round(self._stats["total_seconds"] * 1000 / calls, 3) if calls else 0.0,
+            )
+    
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,367 @@
+"""
+HTML/markdown rendering for the Streamlit app.
+
+These builders are pure functions of the stored messages, so historical
+assessments are rendered once and served from a RenderCache afterwards.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache, partial
+from typing import Callable, Dict, Hashable, List, Optional
+
+from models import AssessmentResult, PatientInfo
+
+
+@lru_cache(maxsize=None)
+def read_stylesheet(path: str = "style.css") -> Optional[str]:
+    """Contents of the stylesheet, read from disk once per process."""
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def build_patient_info_card(patient_info, message_id=""):
+    """Build the visual patient information card."""
+    
+    # Determine mood indicators
+    risk_indicators = []
+    if patient_info.sleep_issues:
+        risk_indicators.append("💤 Sleep Disturbances")
+    if patient_info.appetite_changes:
+        risk_indicators.append("🍽️ Appetite Changes")
+    if patient_info.social_withdrawal:
+        risk_indicators.append("🚪 Social Isolation")
+    if patient_info.concentration_issues:
+        risk_indicators.append("🧠 Concentration Problems")
+    if patient_info.hopelessness:
+        risk_indicators.append("⚠️ Hopelessness/Despair")
+    
+    # Energy level icon - handle enum
+    energy_icon = {"low": "🔋", "normal": "⚡", "high": "⚡⚡"}
+    energy_value = patient_info.energy_level.value if hasattr(patient_info.energy_level, 'value') else str(patient_info.energy_level)
+    energy_display = f"{energy_icon.get(energy_value, '⚡')} {energy_value.title()}"
+    age_display = patient_info.age or 'Not specified'
+    
+    # Create the basic card structure
+    html_parts = [
+        f'<div class="patient-info-card" id="patient-info-{message_id}">',
+        '    <div class="patient-info-header">',
+        '        <h3>🚨 Suicide Risk Factors Identified</h3>',
+        '    </div>',
+        '    <div class="patient-info-content">',
+        '        <div class="info-row">',
+        '            <div class="info-item">',
+        '                <span class="info-label">👤 Age</span>',
+        f'                <span class="info-value">{age_display}</span>',
+        '            </div>',
+        '            <div class="info-item">',
+        '                <span class="info-label">⚡ Energy</span>',
+        f'                <span class="info-value">{energy_display}</span>',
+        '            </div>',
+        '        </div>'
+    ]
+    
+    # Add mood symptoms section if present - handle enum list
+    if patient_info.mood_symptoms:
+        html_parts.extend([
+            '        <div class="mood-symptoms">',
+            '            <span class="info-label">🎭 Risk Symptoms:</span>'
+        ])
+        for symptom in patient_info.mood_symptoms:
+            symptom_value = symptom.value if hasattr(symptom, 'value') else str(symptom)
+            html_parts.append(f'            <span class="mood-badge">{symptom_value}</span>')
+        html_parts.append('        </div>')
+    
+    # Add indicators section
+    if risk_indicators:
+        html_parts.extend([
+            '        <div class="indicators-grid">'
+        ])
+        for indicator in risk_indicators:
+            html_parts.append(f'            <div class="indicator">{indicator}</div>')
+        html_parts.append('        </div>')
+    else:
+        html_parts.append('        <div class="no-indicators">✅ No significant suicide risk indicators detected</div>')
+    
+    # Close the card
+    html_parts.extend([
+        '    </div>',
+        '</div>'
+    ])
+    
+    # Join all parts
+    return '\n'.join(html_parts)
+
+def format_cssrs_result(content):
+    """Extract and format a legacy markdown CSSRS result for better display."""
+    lines = content.split('\n')
+    formatted_content = ""
+    
+    for line in lines:
+        if "## CSSRS Assessment Result" in line:
+            continue
+        elif "**Score:" in line and "/10**" in line:
+            # Extract score and severity
+            score_match = re.search(r'\*\*Score: (\d+)/10\*\* - \*([^*]+)\*', line)
+            if score_match:
+                formatted_content += format_score_card(score_match.group(1), score_match.group(2))
+            else:
+                formatted_content += line + "\n"
+        else:
+            formatted_content += line + "\n"
+    
+    return formatted_content
+
+def format_score_card(score, severity):
+    """HTML score card shown at the top of an assessment."""
+    return f"""
+<div class="phq-score-card">
+    <div class="score-section">
+        <div class="score-number">{score}</div>
+        <div class="score-label">/ 10</div>
+    </div>
+    <div class="severity-section">
+        <div class="severity-label">Suicide Risk</div>
+        <div class="severity-text">{severity}</div>
+    </div>
+</div>
+"""
+
+def format_assessment_result(result, advice=None, include_similar_cases=True):
+    """Render a structured assessment; ``advice`` overrides the guidance text while streaming."""
+    if result.error:
+        return f"⚠️ {result.error}"
+    
+    patient_info = result.patient_info
+    mood_symptoms = ", ".join(symptom.value for symptom in patient_info.mood_symptoms) or "None identified"
+    
+    formatted_content = format_score_card(result.score, result.severity_level) + f"""
+## Extracted Patient Information
+- **Age:** {patient_info.age or 'Not specified'}
+- **Sleep Issues:** {'Yes' if patient_info.sleep_issues else 'No'}
+- **Appetite Changes:** {'Yes' if patient_info.appetite_changes else 'No'}
+- **Energy Level:** {patient_info.energy_level.value.title()}
+- **Mood Symptoms:** {mood_symptoms}
+- **Social Withdrawal:** {'Yes' if patient_info.social_withdrawal else 'No'}
+- **Concentration Issues:** {'Yes' if patient_info.concentration_issues else 'No'}
+- **Hopelessness Indicators:** {'Yes' if patient_info.hopelessness else 'No'}
+
+## Clinical Guidance
+{result.advice if advice is None else advice}
+"""
+
+    if include_similar_cases:
+        if result.similar_cases is None:
+            formatted_content += "\n## 📚 Similar Cases\n*Similar cases not available*\n"
+        else:
+            formatted_content += "\n" + format_similar_posts_for_display([case.model_dump() for case in result.similar_cases])
+    
+    return formatted_content
+
+def format_assistant_content(content):
+    """Render an assistant message: structured results directly, legacy markdown via format_cssrs_result."""
+    if isinstance(content, AssessmentResult):
+        return format_assessment_result(content)
+    return format_cssrs_result(str(content))
+
+def format_similar_posts_for_display(similar_posts: List[Dict]) -> str:
+    """Format similar posts for display in the UI."""
+    if not similar_posts:
+        return "No similar posts found in the database."
+    
+    formatted_output = "## 📚 Similar Cases from Reddit Database\n\n"
+    
+    for i, post in enumerate(similar_posts, 1):
+        similarity_percent = int(post['similarity_score'] * 100)
+        
+        # Color coding based on label
+        label_colors = {
+            'Supportive': '🟢',
+            'Indicator': '🟡', 
+            'Ideation': '🟠',
+            'Behavior': '🔴',
+            'Attempt': '🚨'
+        }
+        
+        label_icon = label_colors.get(post['label'], '⚪')
+        
+        formatted_output += f"""
+### {i}. {label_icon} Case {post['id']} - {post['label']} Risk ({similarity_percent}% similar)
+
+**User:** {post['user']}
+
+**Post Content:**
+> {post['preview']}
+
+**Risk Classification:** {post['label']}
+
+---
+"""
+
+    return formatted_output 
+
+def build_user_message(content, timestamp_label):
+    """HTML block for a counselor's crisis report."""
+    return f"""
+            <div class="message-container user-message">
+                <div class="message-header">
+                    <span class="role-label">Crisis Report</span>
+                    <span class="message-timestamp">{timestamp_label}</span>
+                </div>
+                <div class="message-content">{content}</div>
+            </div>
+            """
+
+def build_assistant_message(formatted_content, timestamp_label, streaming=False):
+    """HTML block wrapping a rendered risk assessment."""
+    css_class = "message-container assistant-message streaming" if streaming else "message-container assistant-message"
+    return f"""
+                    <div class="{css_class}">
+                        <div class="message-header">
+                            <span class="role-label">Risk Assessment</span>
+                            <span class="message-timestamp">{timestamp_label}</span>
+                        </div>
+                        <div class="message-content">{formatted_content}</div>
+                    </div>
+                    """
+
+def message_digest(message) -> str:
+    """Hash of a message's role, timestamp and content, identifying what its rendering depends on."""
+    content = message.content
+    if isinstance(content, (PatientInfo, AssessmentResult)):
+        payload = content.model_dump_json()
+    else:
+        payload = str(content)
+    digest = hashlib.sha1()
+    digest.update(f"{message.role}|{message.timestamp.isoformat()}|".encode("utf-8"))
+    digest.update(payload.encode("utf-8"))
+    return digest.hexdigest()
+
+def build_assessment_blocks(assessment_number, user_msg, patient_info_msg=None, assistant_msg=None) -> List[str]:
+    """HTML blocks (report, patient card, assessment) for one historical assessment.
+    
+    Without ``user_msg`` (its note is on a page not loaded), only the answer is rendered.
+    """
+    title = f"Assessment #{assessment_number}" if assessment_number is not None else "Assessment of an earlier note"
+    blocks = [build_user_message(user_msg.content, title)] if user_msg is not None else []
+    
+    if patient_info_msg is not None and isinstance(patient_info_msg.content, PatientInfo):
+        blocks.append(build_patient_info_card(patient_info_msg.content, f"msg-{assessment_number}"))
+    
+    if assistant_msg is not None:
+        formatted_content = format_assistant_content(assistant_msg.content)
+        blocks.append(build_assistant_message(formatted_content, title))
+    
+    return blocks
+
+
+class RenderCache:
+    """Thread-safe LRU cache of rendered HTML for messages that never change.
+    
+    Entries are keyed by conversation, note sequence number and content
+    digests. Digests are memoised per (conversation, note, role) with the
+    message timestamp, so a rerun over already-loaded messages does not
+    re-hash them and the cache holds no references to the messages.
+    """
+    
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, List[str]]" = OrderedDict()
+        self._digests: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def digest(self, message, conversation_id: str, note_seq: int) -> str:
+        """``message_digest`` of ``message``, part of the assessment of note ``note_seq``, memoised."""
+        key = (conversation_id, note_seq, message.role)
+        timestamp = message.timestamp
+        with self._lock:
+            entry = self._digests.get(key)
+            # A cleared history reuses sequence numbers, but not timestamps
+            if entry is not None and entry[0] == timestamp:
+                self._digests.move_to_end(key)
+                return entry[1]
+        
+        digest = message_digest(message)
+        with self._lock:
+            self._digests[key] = (timestamp, digest)
+            self._digests.move_to_end(key)
+            while len(self._digests) > 3 * self.max_entries:
+                self._digests.popitem(last=False)
+        return digest
+    
+    def get_or_build(self, key: Hashable, build: Callable[[], List[str]]) -> List[str]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        
+        blocks = build()
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = blocks
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return blocks
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def iter_assessments(messages, first_assessment_number, first_seq: int = 0):
+    """Group messages into (number, note seq, user, patient_info, assistant) tuples the way the history is displayed.
+    
+    A patient info and assessment pair follows its note, or names it with
+    ``AssessmentResult.note_seq`` when other notes were queued in between;
+    ``first_seq`` is the sequence number of ``messages[0]``. A pair whose
+    note is not among ``messages`` is yielded on its own, where it was
+    stored, with no number or user message; its note seq is the one it
+    names, or its own seq if it names none.
+    """
+    answers = {}
+    for i, message in enumerate(messages):
+        if message.role != "patient_info":
+            continue
+        assistant_msg = messages[i + 1] if i + 1 < len(messages) and messages[i + 1].role == "assistant" else None
+        note_seq = getattr(assistant_msg.content, "note_seq", None) if assistant_msg is not None else None
+        if note_seq is None and i > 0 and messages[i - 1].role == "user":
+            note_seq = first_seq + i - 1
+        answers[first_seq + i] = (note_seq, message, assistant_msg)
+    notes = {
+        note_seq: (message, assistant_msg)
+        for note_seq, message, assistant_msg in answers.values()
+        if note_seq is not None and first_seq <= note_seq < first_seq + len(messages) and messages[note_seq - first_seq].role == "user"
+    }
+    
+    assessment_counter = first_assessment_number
+    for i, message in enumerate(messages):
+        seq = first_seq + i
+        if message.role == "user":
+            assessment_counter += 1
+            patient_info_msg, assistant_msg = notes.get(seq, (None, None))
+            yield assessment_counter, seq, message, patient_info_msg, assistant_msg
+        elif seq in answers:
+            note_seq, patient_info_msg, assistant_msg = answers[seq]
+            if notes.get(note_seq, (None,))[0] is not patient_info_msg:
+                yield None, seq if note_seq is None else note_seq, None, patient_info_msg, assistant_msg
+
+
+def render_history(messages, first_assessment_number, cache: Optional[RenderCache] = None, first_seq: int = 0,
+                   conversation_id: str = "") -> List[str]:
+    """HTML blocks for a run of historical messages, reusing cached blocks where possible."""
+    blocks = []
+    for number, note_seq, user_msg, patient_info_msg, assistant_msg in iter_assessments(messages, first_assessment_number, first_seq):
+        build = partial(build_assessment_blocks, number, user_msg, patient_info_msg, assistant_msg)
+        if cache is None:
+            blocks.extend(build())
+            continue
+        digests = tuple(cache.digest(m, conversation_id, note_seq) for m in (user_msg, patient_info_msg, assistant_msg) if m is not None)
+        blocks.extend(cache.get_or_build((conversation_id, note_seq, number) + digests, build))
+    return blocks